@@ -0,0 +1,95 @@
+"""
+管理 API 路由
+
+需在請求標頭帶入 X-Admin-Token (與環境變數 ADMIN_TOKEN 相同)；未設定 ADMIN_TOKEN 時所有管理端點停用。
+"""
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import FileResponse
+import logging
+import secrets
+from typing import Optional
+
+from core.config import MONITORING_CONFIG
+from core.profiler import get_profiler, list_profiles, publish_profiler_command
+
+# 設定日誌
+logger = logging.getLogger(__name__)
+
+# 建立路由器
+router = APIRouter()
+
+
+async def require_admin(x_admin_token: Optional[str] = Header(None)) -> None:
+    """驗證管理權杖"""
+    expected = MONITORING_CONFIG["ADMIN_TOKEN"]
+    if not expected:
+        raise HTTPException(status_code=403, detail="未設定 ADMIN_TOKEN，管理端點已停用")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, expected):
+        raise HTTPException(status_code=401, detail="管理權杖錯誤")
+
+
+@router.post("/admin/profile", dependencies=[Depends(require_admin)])
+async def start_profiling(
+    seconds: Optional[float] = None,
+    jobs: Optional[int] = None,
+    target: str = "all"
+):
+    """
+    開啟取樣分析，結果以 folded stacks 格式寫入 logs/profiles
+
+    - **seconds**: 取樣秒數 (預設 30，上限 600)
+    - **jobs**: worker 取樣到完成指定數量的任務為止
+    - **target**: all / api / worker / 指定 worker ID
+    """
+    if seconds is not None and seconds <= 0:
+        raise HTTPException(status_code=400, detail="seconds 必須大於 0")
+    if jobs is not None and jobs <= 0:
+        raise HTTPException(status_code=400, detail="jobs 必須大於 0")
+    try:
+        receivers = await publish_profiler_command("start", target, seconds=seconds, jobs=jobs)
+        logger.info(f"已發布取樣開始指令：target={target}，收到的行程數 {receivers}")
+        return {
+            "success": True,
+            "message": "已通知開始取樣分析",
+            "target": target,
+            "receivers": receivers
+        }
+    except Exception as e:
+        logger.error(f"發布取樣指令失敗：{e}")
+        raise HTTPException(status_code=500, detail=f"發布取樣指令失敗：{str(e)}")
+
+
+@router.post("/admin/profile/stop", dependencies=[Depends(require_admin)])
+async def stop_profiling(target: str = "all"):
+    """提早結束取樣分析並寫出結果"""
+    try:
+        receivers = await publish_profiler_command("stop", target)
+        return {
+            "success": True,
+            "message": "已通知結束取樣分析",
+            "target": target,
+            "receivers": receivers
+        }
+    except Exception as e:
+        logger.error(f"發布取樣指令失敗：{e}")
+        raise HTTPException(status_code=500, detail=f"發布取樣指令失敗：{str(e)}")
+
+
+@router.get("/admin/profiles", dependencies=[Depends(require_admin)])
+async def get_profiles():
+    """列出取樣結果 (包含自動保留的慢任務 slow/)"""
+    return {
+        "success": True,
+        "current_process": get_profiler().status(),
+        "profiles": list_profiles()
+    }
+
+
+@router.get("/admin/profiles/{name:path}", dependencies=[Depends(require_admin)])
+async def download_profile(name: str):
+    """下載單一取樣結果"""
+    directory = MONITORING_CONFIG["PROFILE_DIR"].resolve()
+    path = (directory / name).resolve()
+    if directory not in path.parents or path.suffix != ".folded" or not path.is_file():
+        raise HTTPException(status_code=404, detail="取樣結果不存在")
+    return FileResponse(path, media_type="text/plain", filename=path.name)
@@ -0,0 +1,340 @@
+"""
+批次換臉 API 路由
+"""
+from fastapi import APIRouter, File, UploadFile, Form, HTTPException
+from fastapi.responses import FileResponse
+import asyncio
+import json
+import logging
+import os
+import uuid
+import zipfile
+from datetime import datetime
+from pathlib import Path
+from typing import BinaryIO, Dict, List, Optional
+
+from core.config import UPLOAD_CONFIG, TEMPLATE_CONFIG, QUEUE_CONFIG, PENDING_UPLOADS_DIR, ensure_directories
+from core.batch import create_batch, delete_batch, get_batch, load_batch_items, summarize_batch, build_archive
+from core.task_queue import submit_tasks
+from core.identity import identity_digest
+from api.face_swap import validate_file, check_estimated_wait
+
+# 設定日誌
+logger = logging.getLogger(__name__)
+
+# 建立路由器
+router = APIRouter()
+
+MANIFEST_NAME = "manifest.ndjson"  # zip 內的清單檔名
+
+
+def read_archive_sources(fileobj: BinaryIO, max_total_size: int) -> Dict[str, bytes]:
+    """
+    從 zip 讀取來源照片 (略過目錄、隱藏檔與不支援的格式)；zip 內的 manifest.ndjson 以同名鍵返回
+
+    讀取前先以中央目錄記錄的解壓大小檢查總量 (zipfile 讀取時不會超出記錄的大小)，
+    超過 max_total_size 時不解壓任何檔案。
+    """
+    sources: Dict[str, bytes] = {}
+    try:
+        archive = zipfile.ZipFile(fileobj)
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="壓縮檔格式錯誤，請上傳 zip 檔")
+    with archive:
+        entries: Dict[str, zipfile.ZipInfo] = {}
+        for info in archive.infolist():
+            name = Path(info.filename).name
+            if info.is_dir() or not name or name.startswith(".") or "__MACOSX" in info.filename:
+                continue
+            if name != MANIFEST_NAME and Path(name).suffix.lower() not in UPLOAD_CONFIG["ALLOWED_EXTENSIONS"]:
+                continue
+            if name != MANIFEST_NAME and info.file_size > UPLOAD_CONFIG["MAX_FILE_SIZE"]:
+                raise HTTPException(status_code=413, detail=f"壓縮檔內的 {name} 過大")
+            if name in entries:
+                raise HTTPException(status_code=400, detail=f"壓縮檔內有重複的檔名：{name}")
+            entries[name] = info
+
+        total_size = sum(info.file_size for info in entries.values())
+        if total_size > max_total_size:
+            raise HTTPException(
+                status_code=413,
+                detail=f"來源照片解壓後共 {total_size // (1024 * 1024)}MB，超過批次上限 {max_total_size // (1024 * 1024)}MB"
+            )
+        for name, info in entries.items():
+            sources[name] = archive.read(info)
+    return sources
+
+
+def parse_manifest(data: bytes, sources: Dict[str, bytes]) -> List[dict]:
+    """解析 NDJSON 清單：每行 {"source": 檔名, "template_id": 模板 ID, "source_face_index": 0, "target_face_index": 0}"""
+    items = []
+    for line_no, line in enumerate(data.decode("utf-8-sig").splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            entry = json.loads(line)
+            item = {
+                "source": str(entry["source"]),
+                "template_id": str(entry["template_id"]),
+                "source_face_index": int(entry.get("source_face_index", 0)),
+                "target_face_index": int(entry.get("target_face_index", 0)),
+            }
+        except (ValueError, KeyError, TypeError) as err:
+            raise HTTPException(status_code=400, detail=f"清單第 {line_no} 行格式錯誤：{err}")
+        if item["source"] not in sources:
+            raise HTTPException(status_code=400, detail=f"清單第 {line_no} 行的來源照片不存在：{item['source']}")
+        items.append(item)
+    return items
+
+
+def write_pending_sources(batch_id: str, sources: Dict[str, bytes], items: List[dict]) -> List[Path]:
+    """
+    將子任務的來源照片寫入 pending 暫存區
+
+    worker 完成任務後會刪除自己的暫存檔，因此每個子任務各有一個檔案；
+    同一張照片只寫入一次，其餘子任務以硬連結共用內容 (不支援時才複製)。
+    """
+    ensure_directories()
+    written: Dict[str, Path] = {}
+    paths = []
+    for index, item in enumerate(items):
+        name = item["source"]
+        suffix = Path(name).suffix.lower() or ".jpg"
+        path = PENDING_UPLOADS_DIR / f"{batch_id}-{index:05d}-source{suffix}"
+        first = written.get(name)
+        if first is None:
+            path.write_bytes(sources[name])
+            written[name] = path
+        else:
+            try:
+                os.link(first, path)
+            except OSError:
+                path.write_bytes(sources[name])
+        paths.append(path)
+    return paths
+
+
+@router.post("/face-swap/batch")
+async def create_batch_swap(
+    files: List[UploadFile] = File(None, description="來源照片 (可多張)"),
+    archive: Optional[UploadFile] = File(None, description="來源照片的 zip 壓縮檔 (可內含 manifest.ndjson)"),
+    manifest: Optional[UploadFile] = File(None, description="NDJSON 清單，每行指定一個子任務的來源與模板"),
+    template_ids: Optional[str] = Form(None, description="模板 ID，以逗號分隔 (未提供清單時，每張照片 × 每個模板)"),
+    source_face_index: int = Form(0, description="來源臉部索引 (未提供清單時使用)"),
+    target_face_index: int = Form(0, description="目標臉部索引 (未提供清單時使用)")
+):
+    """
+    批次換臉任務提交
+
+    建立一個批次與多個子任務，子任務依模板分組入列，返回批次 ID 供查詢進度與下載結果
+
+    - **files** / **archive**: 來源照片 (多檔上傳或 zip)
+    - **manifest**: NDJSON 清單，每行 `{"source": "a.jpg", "template_id": "1"}`；也可放在 zip 內的 manifest.ndjson
+    - **template_ids**: 沒有清單時使用，每張照片與每個模板各產生一個子任務
+    """
+    try:
+        # 收集來源照片
+        sources: Dict[str, bytes] = {}
+        for file in files or []:
+            if not file.filename:
+                continue
+            validate_file(file)
+            content = await file.read()
+            if not content:
+                raise HTTPException(status_code=400, detail=f"{file.filename} 內容為空")
+            name = Path(file.filename).name
+            if name in sources:
+                raise HTTPException(status_code=400, detail=f"上傳的照片有重複的檔名：{name}")
+            sources[name] = content
+        if archive and archive.filename:
+            # zip 直接從上傳的暫存檔讀取，不整個載入記憶體；來源照片總大小 (含多檔上傳) 受同一上限限制
+            max_upload_size = QUEUE_CONFIG["MAX_BATCH_UPLOAD_SIZE"]
+            if archive.size and archive.size > max_upload_size:
+                raise HTTPException(status_code=413, detail=f"壓縮檔過大，最大允許 {max_upload_size // (1024 * 1024)}MB")
+            uploaded_size = sum(len(content) for content in sources.values())
+            archive_sources = await asyncio.to_thread(
+                read_archive_sources, archive.file, max(max_upload_size - uploaded_size, 0)
+            )
+            conflicts = sorted(set(archive_sources) & set(sources))
+            if conflicts:
+                raise HTTPException(status_code=400, detail=f"壓縮檔內的檔名與上傳的照片重複：{', '.join(conflicts)}")
+            sources.update(archive_sources)
+
+        manifest_data = await manifest.read() if manifest and manifest.filename else sources.pop(MANIFEST_NAME, None)
+        if not sources:
+            raise HTTPException(status_code=400, detail="請上傳至少一張來源照片 (files 或 archive)")
+
+        # 展開子任務
+        if manifest_data:
+            items = parse_manifest(manifest_data, sources)
+        else:
+            requested = [template_id.strip() for template_id in (template_ids or "").split(",") if template_id.strip()]
+            if not requested:
+                raise HTTPException(status_code=400, detail="請提供 template_ids 或 manifest")
+            items = [
+                {
+                    "source": name,
+                    "template_id": template_id,
+                    "source_face_index": source_face_index,
+                    "target_face_index": target_face_index,
+                }
+                for template_id in requested
+                for name in sources
+            ]
+
+        invalid = sorted({item["template_id"] for item in items} - set(TEMPLATE_CONFIG["TEMPLATES"]))
+        if invalid:
+            raise HTTPException(
+                status_code=400,
+                detail=f"無效的模板 ID: {invalid}，可用的模板 ID: {list(TEMPLATE_CONFIG['TEMPLATES'].keys())}"
+            )
+        if not items:
+            raise HTTPException(status_code=400, detail="清單沒有任何子任務")
+        max_items = QUEUE_CONFIG["MAX_BATCH_ITEMS"]
+        if len(items) > max_items:
+            raise HTTPException(status_code=413, detail=f"子任務數 {len(items)} 超過上限 {max_items}")
+
+        await check_estimated_wait()
+
+        # 依模板分組 (穩定排序保留原本順序)，同一模板的子任務連續處理
+        items.sort(key=lambda item: item["template_id"])
+
+        batch_id = f"batch-{uuid.uuid4()}"
+        pending_paths = await asyncio.to_thread(write_pending_sources, batch_id, sources, items)
+
+        created_at = datetime.now().isoformat()
+        # 同一張照片的子任務共用臉部特徵快取，只有第一個被處理的子任務需要偵測來源臉部
+        digests: Dict[tuple, str] = {}
+        tasks = []
+        for index, (item, pending_path) in enumerate(zip(items, pending_paths)):
+            task_id = f"{batch_id}-{index:05d}"
+            status = {
+                "task_id": task_id,
+                "status": "pending",
+                "progress": 0,
+                "message": "任務已提交，等待處理...",
+                "template_id": item["template_id"],
+                "batch_id": batch_id,
+                "source_name": item["source"],
+                "created_at": created_at,
+                "queued_at": created_at,
+                "result_url": None,
+                "template_name": None,
+                "template_description": None,
+                "error": None
+            }
+            digest_key = (item["source"], item["source_face_index"])
+            if digest_key not in digests:
+                digests[digest_key] = identity_digest([sources[item["source"]]], item["source_face_index"])
+            job = {
+                "task_id": task_id,
+                "file_path": str(pending_path),
+                "template_id": item["template_id"],
+                "template_path": None,
+                "source_face_index": item["source_face_index"],
+                "target_face_index": item["target_face_index"],
+                "source_digest": digests[digest_key]
+            }
+            tasks.append((task_id, status, job))
+
+        # 先寫入批次紀錄再入列，子任務入列後批次一定已存在；未能入列 (拒絕或失敗) 時刪除紀錄與暫存檔
+        # 整個批次需一次放得進佇列：容量檢查與所有子任務入列在同一個原子 script 完成
+        max_queue_size = QUEUE_CONFIG["MAX_QUEUE_SIZE"] if QUEUE_CONFIG["ENABLE_QUEUE_LIMIT"] else 0
+        accepted, current_queue_size = False, 0
+        try:
+            await create_batch(batch_id, {
+                "batch_id": batch_id,
+                "created_at": created_at,
+                "total": len(tasks),
+                "template_ids": sorted({item["template_id"] for item in items}),
+                "task_ids": [task_id for task_id, _, _ in tasks],
+            })
+            accepted, current_queue_size, _ = await submit_tasks(tasks, max_queue_size)
+        finally:
+            if not accepted:
+                await delete_batch(batch_id)
+                for pending_path in pending_paths:
+                    pending_path.unlink(missing_ok=True)
+        if not accepted:
+            logger.warning(
+                f"佇列容量不足，拒絕批次 {batch_id} ({len(tasks)} 個子任務)。當前佇列: {current_queue_size}/{max_queue_size}"
+            )
+            raise HTTPException(
+                status_code=503,
+                detail={
+                    "error": "queue_full",
+                    "message": QUEUE_CONFIG["QUEUE_FULL_MESSAGE"],
+                    "current_queue_size": current_queue_size,
+                    "max_queue_size": max_queue_size,
+                    "batch_size": len(tasks)
+                }
+            )
+
+        logger.info(f"已提交批次換臉：{batch_id}，{len(sources)} 張照片，{len(tasks)} 個子任務")
+
+        return {
+            "success": True,
+            "message": "批次已提交，請使用批次 ID 查詢處理進度",
+            "batch_id": batch_id,
+            "total": len(tasks),
+            "status_url": f"/api/face-swap/batch/{batch_id}",
+            "archive_url": f"/api/face-swap/batch/{batch_id}/archive"
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"批次提交失敗：{e}")
+        raise HTTPException(status_code=500, detail=f"批次提交失敗：{str(e)}")
+
+
+@router.get("/face-swap/batch/{batch_id}")
+async def get_batch_status(batch_id: str, include_items: bool = False):
+    """
+    查詢批次進度 (由子任務狀態即時彙總)
+
+    - **include_items**: 是否附上每個子任務的狀態
+    """
+    try:
+        batch = await get_batch(batch_id)
+        if not batch:
+            raise HTTPException(status_code=404, detail="批次不存在或已過期")
+        items = await load_batch_items(batch)
+        summary = summarize_batch(batch, items)
+        if summary["status"] == "completed":
+            summary["archive_url"] = f"/api/face-swap/batch/{batch_id}/archive"
+        if include_items:
+            summary["items"] = items
+        return {"success": True, "batch": summary}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"查詢批次狀態失敗：{e}")
+        raise HTTPException(status_code=500, detail=f"查詢批次狀態失敗：{str(e)}")
+
+
+@router.get("/face-swap/batch/{batch_id}/archive")
+async def download_batch_archive(batch_id: str):
+    """下載批次結果 (zip，含 manifest.json)；批次尚未全部結束時返回 409"""
+    try:
+        batch = await get_batch(batch_id)
+        if not batch:
+            raise HTTPException(status_code=404, detail="批次不存在或已過期")
+        items = await load_batch_items(batch)
+        summary = summarize_batch(batch, items)
+        if summary["status"] != "completed":
+            raise HTTPException(
+                status_code=409,
+                detail={
+                    "error": "batch_not_finished",
+                    "message": "批次尚未全部處理完成",
+                    "progress": summary["progress"]
+                }
+            )
+        path = await asyncio.to_thread(build_archive, batch_id, items)
+        return FileResponse(path=str(path), filename=f"{batch_id}.zip", media_type="application/zip")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"打包批次結果失敗：{e}")
+        raise HTTPException(status_code=500, detail=f"打包批次結果失敗：{str(e)}")
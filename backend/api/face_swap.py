@@ -1,38 +1,75 @@
 """
 換臉 API 路由
 """
-from fastapi import APIRouter, File, UploadFile, Form, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, File, UploadFile, Form, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, StreamingResponse
 import uuid
 import json
 from pathlib import Path
 import logging
-from typing import Optional
+from typing import List, Optional, Tuple
 from datetime import datetime
 import asyncio
-import cv2
+import time
 from concurrent.futures import ThreadPoolExecutor
 
-from core.face_processor import get_face_processor, cleanup_old_results, get_system_info
 from core.config import (
     UPLOAD_CONFIG,
+    MODEL_CONFIG,
+    PRESCREEN_CONFIG,
     TEMPLATE_CONFIG,
     QUEUE_CONFIG,
+    MONITORING_CONFIG,
     get_template_path,
     RESULTS_DIR,
     UPLOADS_DIR,
     PENDING_UPLOADS_DIR,
     ensure_directories,
 )
-from core.file_cleanup import cleanup_upload_file
+from core.file_cleanup import cleanup_upload_file, cleanup_old_results
 from core.redis_client import (
     redis_client,
     TASK_KEY_PREFIX,
-    QUEUE_SIZE_KEY,
     GPU_LOCK_KEY,
-    TASK_QUEUE_KEY,
 )
 from core.distributed_lock import RedisLock
+from core.task_queue import (
+    submit_task,
+    start_task,
+    finish_task,
+    get_queue_size,
+    get_task_position,
+    estimate_wait_seconds,
+)
+from core.worker_registry import get_live_workers, get_worker_capacity, summarize_capacity
+from core.rpc import call_worker, NoWorkerAvailableError, RpcTimeoutError, RpcError
+from core.autoscale import get_autoscale_signals
+from core.metrics import METRICS_ENABLED, observe_stage, record_task_result, record_cache_lookup, record_prescreen, format_timings
+from core.identity import (
+    identity_digest,
+    identity_face,
+    identity_source_face,
+    load_identity_embedding,
+    save_identity_embedding,
+    get_identity,
+    save_validation,
+    load_validation,
+)
+from core.task_store import (
+    TASK_STATUSES,
+    get_task_status,
+    update_task_status,
+    delete_tasks,
+    prune_task_index,
+    count_tasks,
+    list_task_ids,
+    load_tasks_by_ids,
+)
+from core.task_events import (
+    get_task_event_hub,
+    QUEUE_ADVANCED,
+    RESYNC,
+)
 
 # 設定日誌
 logger = logging.getLogger(__name__)
@@ -42,6 +79,10 @@ router = APIRouter()
 
 # 配置
 MAX_CONCURRENT_TASKS = 1000  # 限制同時等待 GPU 的任務數量（避免記憶體爆炸）
+TERMINAL_STATUSES = ("completed", "failed")
+EVENT_KEEPALIVE_SECONDS = 15  # 推播連線心跳間隔
+POSITION_REFRESH_INTERVAL = 1.0  # 排隊位置重新計算的最短間隔（秒）
+RESULT_MEDIA_TYPES = {".jpg": "image/jpeg", ".mp4": "video/mp4"}  # 結果檔案格式 (影片換臉輸出 mp4)
 
 # 線程池 - GPU操作 (單線程串行)
 executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gpu_worker")
@@ -58,68 +99,70 @@ def get_task_semaphore():
 
 # ==================== Redis 工具函數 ====================
 
-async def get_task_status(task_id: str) -> dict:
-    """從 Redis 獲取任務狀態"""
-    data = await redis_client.get(f"{TASK_KEY_PREFIX}{task_id}")
-    if data:
-        return json.loads(data)
-    return None
-
-async def set_task_status(task_id: str, status: dict):
-    """設置任務狀態到 Redis (TTL 48 小時)"""
-    await redis_client.setex(
-        f"{TASK_KEY_PREFIX}{task_id}",
-        172800,  # 48 小時過期
-        json.dumps(status, ensure_ascii=False)
-    )
+async def load_tasks(limit: Optional[int] = None, offset: int = 0, status: Optional[str] = None):
+    """從任務索引讀取任務資料 (依建立時間由新到舊)"""
+    if limit is not None and limit <= 0:
+        return []
+    await prune_task_index()
+    stop = offset + limit - 1 if limit is not None else -1
+    task_ids = await list_task_ids(offset, stop, status=status)
+    return await load_tasks_by_ids(task_ids)
+
+def apply_queue_position(status: dict, position: dict) -> dict:
+    """等待中的任務以即時位置覆蓋提交時的快照"""
+    if status.get("status") == "pending":
+        status["queue_ahead"] = position["queue_ahead"]
+        status["eta_seconds"] = position["eta_seconds"]
+    else:
+        status.pop("eta_seconds", None)
+    return status
+
+
+async def task_event_stream(task_id: str):
+    """
+    任務事件串流：先送出目前快照，之後隨狀態變更與佇列前進推送，任務結束時停止
+
+    Yields:
+        Tuple[事件類型 (status/position/ping), 資料]
+    """
+    async with get_task_event_hub().listen(task_id) as subscription:
+        # 先訂閱再讀取快照，避免漏掉兩者之間的更新
+        status = await get_task_status(task_id)
+        if not status:
+            return
+        position = await get_task_position(task_id)
+        yield "status", apply_queue_position(status, position)
+        last_position_at = asyncio.get_event_loop().time()
+
+        while status.get("status") not in TERMINAL_STATUSES:
+            try:
+                event = await asyncio.wait_for(subscription.get(), timeout=EVENT_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield "ping", None
+                continue
+
+            if event == QUEUE_ADVANCED:
+                if status.get("status") != "pending":
+                    continue
+                # 合併短時間內的多次佇列前進事件
+                wait = POSITION_REFRESH_INTERVAL - (asyncio.get_event_loop().time() - last_position_at)
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                new_position = await get_task_position(task_id)
+                last_position_at = asyncio.get_event_loop().time()
+                if new_position["queue_ahead"] != position["queue_ahead"]:
+                    position = new_position
+                    apply_queue_position(status, position)
+                    yield "position", position
+                continue
+
+            if event == RESYNC:
+                status = await get_task_status(task_id) or status
+                position = await get_task_position(task_id)
+            else:
+                status.update(event)
+            yield "status", apply_queue_position(status, position)
 
-async def update_task_status(task_id: str, updates: dict):
-    """更新任務狀態"""
-    task = await get_task_status(task_id)
-    if task:
-        task.update(updates)
-        await set_task_status(task_id, task)
-
-async def get_queue_size() -> int:
-    """獲取當前佇列大小"""
-    size = await redis_client.get(QUEUE_SIZE_KEY)
-    return int(size) if size else 0
-
-async def incr_queue_size() -> int:
-    """佇列大小 +1"""
-    return await redis_client.incr(QUEUE_SIZE_KEY)
-
-async def decr_queue_size() -> int:
-    """佇列大小 -1"""
-    size = await redis_client.decr(QUEUE_SIZE_KEY)
-    # 防止負數
-    if size < 0:
-        await redis_client.set(QUEUE_SIZE_KEY, 0)
-        return 0
-    return size
-
-
-async def load_tasks(limit: Optional[int] = None, with_keys: bool = False):
-    """從 Redis 讀取任務資料並依建立時間排序"""
-
-    results = []
-    async for key in redis_client.scan_iter(f"{TASK_KEY_PREFIX}*"):
-        data = await redis_client.get(key)
-        if not data:
-            continue
-        try:
-            payload = json.loads(data)
-        except json.JSONDecodeError as err:  # noqa: F841
-            logger.warning(f"解析任務資料失敗：key={key}，原因: {err}")
-            continue
-        results.append((key, payload))
-
-    results.sort(key=lambda item: item[1].get("created_at", ""), reverse=True)
-    if limit is not None:
-        results[:] = results[:limit]
-    if with_keys:
-        return results
-    return [item[1] for item in results]
 
 def validate_file(file: UploadFile) -> None:
     """驗證上傳的檔案"""
@@ -162,6 +205,57 @@ async def save_pending_file(task_id: str, role: str, filename: str, content: byt
     await asyncio.to_thread(pending_path.write_bytes, content)
     return pending_path
 
+async def load_task_identity(identity_id: Optional[str]) -> Optional[dict]:
+    """worker 端讀取任務引用的身分 (未引用時為 None；已過期時任務失敗)"""
+    if not identity_id:
+        return None
+    identity = await get_identity(identity_id)
+    if not identity:
+        raise ValueError("身分不存在或已過期，請重新上傳照片")
+    return identity
+
+
+async def resolve_source_face(
+    processor,
+    source_image,
+    source_face_index: int,
+    identity: Optional[dict],
+    source_digest: Optional[str],
+    extra_source_contents: Optional[List[bytes]],
+    timings: dict,
+    source_hints: Optional[list] = None
+) -> Tuple[object, Optional[int]]:
+    """
+    取得來源臉部：身分直接使用其特徵；否則先查特徵快取，未命中才偵測 (多張照片時融合) 並寫入快取；
+    有預檢提示 (source_hints) 時主照片不再偵測
+
+    Returns:
+        Tuple[來源臉部, 參與融合的照片數 (使用特徵快取時為 None)]
+    """
+    if identity:
+        face = identity_source_face(identity, source_face_index)
+        return face, identity["faces"][source_face_index].get("fused_sources")
+    if source_digest:
+        embedding = await load_identity_embedding(source_digest)
+        record_cache_lookup("identity", embedding is not None)
+        if embedding is not None:
+            return identity_face(embedding), None
+
+    loop = asyncio.get_event_loop()
+    source_face, fused_sources = await loop.run_in_executor(
+        executor,
+        processor.build_source_face,
+        source_image,
+        extra_source_contents,
+        source_face_index,
+        timings,
+        source_hints
+    )
+    if source_digest:
+        await save_identity_embedding(source_digest, source_face.normed_embedding)
+    return source_face, fused_sources
+
+
 async def process_face_swap_task(
     task_id: str,
     file_content: bytes,
@@ -169,135 +263,496 @@ async def process_face_swap_task(
     template_content: Optional[bytes] = None,
     source_face_index: int = 0,
     target_face_index: int = 0,
-    initial_queue_size: Optional[int] = None
-):
-    """背景任務：執行換臉處理 (使用 Semaphore + Redis 分散式鎖)"""
+    initial_queue_size: Optional[int] = None,
+    worker_id: Optional[str] = None,
+    enqueued_at: Optional[float] = None,
+    timings: Optional[dict] = None,
+    extra_source_contents: Optional[List[bytes]] = None,
+    source_digest: Optional[str] = None,
+    identity_id: Optional[str] = None,
+    source_hints: Optional[list] = None
+) -> bool:
+    """
+    背景任務：執行換臉處理 (使用 Semaphore + Redis 分散式鎖)
+
+    叢集 GPU 鎖只涵蓋換臉推論；儲存原圖、解碼與結果編碼寫檔都在鎖外執行。
+    各階段耗時 (秒) 會累加到 timings，並隨最終狀態寫入任務的 timings 欄位。
+
+    來源臉部特徵依 source_digest 快取：同一組來源照片換其他模板時不再偵測；
+    有多張來源照片 (extra_source_contents) 時平行偵測並融合為單一身分。
+    以 identity_id 引用已建立的身分時，直接使用其特徵與已儲存的原圖；
+    提交時預檢找到的臉部位置 (source_hints) 讓主照片不必重新偵測。
+
+    Returns:
+        bool: 任務是否成功完成
+    """
+    timings = {} if timings is None else timings
 
     # 先獲取 semaphore,限制同時等待 GPU 的任務數量
     async with get_task_semaphore():
-        async with RedisLock():
-            logger.info(
-                f"開始處理背景換臉任務 {task_id}，提交時佇列大小: "
-                f"{initial_queue_size if initial_queue_size is not None else 'unknown'}"
+        logger.info(
+            f"開始處理背景換臉任務 {task_id}，提交時佇列大小: "
+            f"{initial_queue_size if initial_queue_size is not None else 'unknown'}"
+        )
+
+        final_updates = None
+        failure_reason = None
+        try:
+            # 開始處理：更新狀態並通知訂閱者 (單次 round trip)
+            await start_task(task_id, {
+                "status": "processing",
+                "progress": 30,
+                "message": "正在偵測臉部特徵...",
+                "queue_ahead": 0,
+                "worker_id": worker_id,
+            })
+
+            # 獲取臉部處理器 (只在 worker 執行，API 行程不匯入模型相關模組)
+            from core.face_processor import get_face_processor
+            processor = get_face_processor()
+            logger.info(f"任務 {task_id} 使用 GPU 處理")
+
+            # 處理模板
+            template_path = None
+            if template_id == "custom" and template_content:
+                template_info = {"description": "使用者自訂模板"}
+                template_name = "自訂模板"
+            else:
+                template_info = TEMPLATE_CONFIG["TEMPLATES"][template_id]
+                template_path = get_template_path(template_id)
+                template_name = template_info["name"]
+                template_content = None
+
+            # 已建立的身分：特徵與原圖都已在建立時處理
+            identity = await load_task_identity(identity_id)
+
+            # 儲存原圖與解碼 (不需 GPU 鎖)
+            loop = asyncio.get_event_loop()
+            original_path, source_image, target_image = await loop.run_in_executor(
+                executor,
+                processor.load_images,
+                file_content,
+                template_path,
+                template_content,
+                task_id,
+                timings,
+                identity is None
             )
 
-            try:
-                # 更新任務狀態：開始處理
-                await update_task_status(task_id, {
-                    "status": "processing",
-                    "progress": 10,
-                    "message": "正在初始化 AI 模型...",
-                    "queue_ahead": 0
-                })
-
-                # 獲取臉部處理器
-                processor = get_face_processor()
-                logger.info(f"任務 {task_id} 使用 GPU 處理")
-
-                # 更新進度：模型載入完成
-                await update_task_status(task_id, {
-                    "progress": 30,
-                    "message": "正在偵測臉部特徵...",
-                    "queue_ahead": 0
-                })
-
-                # 處理模板
-                if template_id == "custom" and template_content:
-                    template_info = {"description": "使用者自訂模板"}
-                    template_name = "自訂模板"
-
-                    loop = asyncio.get_event_loop()
-                    process_result = await loop.run_in_executor(
-                        executor,
-                        processor.process_image_data,
-                        file_content,
-                        template_content,
-                        source_face_index,
-                        target_face_index,
-                        task_id
-                    )
-                else:
-                    template_info = TEMPLATE_CONFIG["TEMPLATES"][template_id]
-                    template_path = get_template_path(template_id)
-                    template_name = template_info["name"]
-
-                    await update_task_status(task_id, {
-                        "progress": 50,
-                        "message": "AI 正在進行換臉處理...",
-                        "queue_ahead": 0
-                    })
-
-                    loop = asyncio.get_event_loop()
-                    process_result = await loop.run_in_executor(
-                        executor,
-                        processor.process_image_file,
-                        file_content,
-                        template_path,
-                        source_face_index,
-                        target_face_index,
-                        task_id
-                    )
-
-                await update_task_status(task_id, {
-                    "progress": 90,
-                    "message": "正在生成最終結果...",
-                    "queue_ahead": 0
-                })
-
-                result_path = process_result["result_path"]
-                original_path = process_result["original_path"]
-
-                result_filename = Path(result_path).name
-                result_url = f"/results/{result_filename}"
+            source_face, fused_sources = await resolve_source_face(
+                processor, source_image, source_face_index, identity, source_digest, extra_source_contents, timings,
+                source_hints
+            )
 
+            await update_task_status(task_id, {
+                "progress": 50,
+                "message": "AI 正在進行換臉處理..."
+            })
+
+            # 只有換臉推論需要叢集 GPU 鎖
+            lock_wait_started = time.perf_counter()
+            async with RedisLock(owner=worker_id):
+                observe_stage("lock_wait", time.perf_counter() - lock_wait_started, timings)
+                result_image = await loop.run_in_executor(
+                    executor,
+                    processor.swap_faces,
+                    source_image,
+                    target_image,
+                    source_face_index,
+                    target_face_index,
+                    timings,
+                    source_face
+                )
+
+            # 編碼與寫檔 (釋放鎖後執行，其他 worker 可同時開始推論)
+            result_path = await loop.run_in_executor(executor, processor.save_result, result_image, timings)
+
+            result_filename = Path(result_path).name
+            result_url = f"/results/{result_filename}"
+
+            if identity:
+                original_url = identity["original_url"]
+            else:
                 original_filename = Path(original_path).name
                 original_url = f"/uploads/{original_filename}"
 
-                await update_task_status(task_id, {
-                    "status": "completed",
-                    "progress": 100,
-                    "message": "換臉處理完成",
-                    "result_url": result_url,
-                    "original_url": original_url,
-                    "template_id": template_id,
-                    "template_name": template_name,
-                    "template_description": template_info["description"],
-                    "completed_at": datetime.now().isoformat(),
-                    "queue_ahead": 0
-                })
-
-                logger.info(f"任務 {task_id} 換臉處理完成：{result_url}")
+            final_updates = {
+                "status": "completed",
+                "progress": 100,
+                "message": "換臉處理完成",
+                "result_url": result_url,
+                "original_url": original_url,
+                "template_id": template_id,
+                "template_name": template_name,
+                "template_description": template_info["description"],
+                "completed_at": datetime.now().isoformat(),
+                "queue_ahead": 0,
+                "source_resolution": f"{source_image.shape[1]}x{source_image.shape[0]}",
+                "template_resolution": f"{target_image.shape[1]}x{target_image.shape[0]}",
+                "source_images": identity["source_images"] if identity else 1 + len(extra_source_contents or []),
+                "fused_sources": fused_sources,
+                "identity_id": identity_id,
+            }
+
+            logger.info(f"任務 {task_id} 換臉處理完成：{result_url}")
+
+        except Exception as e:
+            final_updates = {
+                "status": "failed",
+                "progress": 0,
+                "message": f"換臉處理失敗：{str(e)}",
+                "error": str(e),
+                "failed_at": datetime.now().isoformat(),
+                "queue_ahead": 0
+            }
+
+            logger.error(f"任務 {task_id} 換臉處理失敗：{e}")
+            failure_reason = type(e).__name__
+
+        finally:
+            # 失敗時也記錄已完成階段的耗時，方便找出卡在哪一步
+            end_to_end = time.time() - enqueued_at if enqueued_at else None
+            if final_updates is not None:
+                if end_to_end is not None:
+                    timings["total"] = end_to_end
+                final_updates["timings"] = format_timings(timings)
+
+            # 寫入最終狀態並移出佇列 (單次 round trip)
+            try:
+                remaining_queue_size = await finish_task(task_id, final_updates or {})
+            except Exception as redis_error:
+                logger.warning(f"任務 {task_id} 寫入完成狀態失敗：{redis_error}")
+                remaining_queue_size = "unknown"
+            logger.info(f"背景換臉任務 {task_id} 完成，佇列大小: {remaining_queue_size}")
+            record_task_result(
+                (final_updates or {}).get("status", "failed"),
+                end_to_end,
+                failure_reason,
+            )
+
+    return bool(final_updates) and final_updates["status"] == "completed"
+
+async def read_swap_request(
+    file: Optional[UploadFile],
+    template_id: Optional[str],
+    template_file: Optional[UploadFile],
+) -> Tuple[str, Optional[bytes], Optional[bytes]]:
+    """
+    驗證並讀取換臉請求的上傳檔案
+
+    Returns:
+        Tuple[模板 ID (自訂模板為 custom), 使用者圖片內容 (未上傳時為 None), 自訂模板內容]
+    """
+    # 自動判斷使用自訂模板還是預設模板
+    if template_file and template_file.filename:
+        template_id = "custom"
+    elif not template_id:
+        # 如果都沒有提供，拋出錯誤
+        raise HTTPException(
+            status_code=400, 
+            detail="請提供 template_id 或上傳 template_file"
+        )
+        
+    # 驗證並讀取檔案內容 (以 identity_id 引用身分時不上傳照片)
+    file_content = None
+    if file and file.filename:
+        validate_file(file)
+        file_content = await file.read()
+        if not file_content:
+            raise HTTPException(status_code=400, detail="檔案內容為空")
+    
+    # 處理模板檔案
+    template_content = None
+    if template_id == "custom" and template_file:
+        validate_file(template_file)
+        template_content = await template_file.read()
+        if not template_content:
+            raise HTTPException(status_code=400, detail="模板檔案內容為空")
+    elif template_id != "custom" and template_id not in TEMPLATE_CONFIG["TEMPLATES"]:
+        raise HTTPException(
+            status_code=400,
+            detail=f"無效的模板 ID: {template_id}，可用的模板 ID: {list(TEMPLATE_CONFIG['TEMPLATES'].keys())}"
+        )
+    return template_id, file_content, template_content
+
+
+async def read_extra_sources(source_files: Optional[List[UploadFile]]) -> List[Tuple[str, bytes]]:
+    """驗證並讀取同一人的其他來源照片 (含主照片最多 MAX_SOURCE_IMAGES 張)"""
+    extra_files = [extra for extra in source_files or [] if extra.filename]
+    max_sources = UPLOAD_CONFIG["MAX_SOURCE_IMAGES"]
+    if 1 + len(extra_files) > max_sources:
+        raise HTTPException(status_code=400, detail=f"來源照片最多 {max_sources} 張")
+    extra_sources = []
+    for extra in extra_files:
+        validate_file(extra)
+        content = await extra.read()
+        if not content:
+            raise HTTPException(status_code=400, detail=f"{extra.filename} 內容為空")
+        extra_sources.append((extra.filename, content))
+    return extra_sources
+
+
+async def resolve_swap_identity(
+    identity_id: Optional[str],
+    file_content: Optional[bytes],
+    extra_sources: List[Tuple[str, bytes]],
+    source_face_index: int,
+) -> Optional[dict]:
+    """檢查照片與 identity_id 擇一提供，返回引用的身分紀錄 (上傳照片時為 None)"""
+    if not identity_id:
+        if file_content is None:
+            raise HTTPException(status_code=400, detail="請上傳照片 (file) 或提供 identity_id")
+        return None
+    if file_content is not None or extra_sources:
+        raise HTTPException(status_code=400, detail="照片與 identity_id 請擇一提供")
+    identity = await get_identity(identity_id)
+    if not identity:
+        raise HTTPException(status_code=404, detail="身分不存在或已過期，請重新上傳照片")
+    face_count = len(identity.get("faces") or [])
+    if source_face_index >= face_count:
+        raise HTTPException(
+            status_code=400,
+            detail=f"身分照片只有 {face_count} 張臉，但指定了第 {source_face_index + 1} 張臉"
+        )
+    return identity
+
+
+async def prescreen_source(
+    file_content: Optional[bytes],
+    filename: str,
+    source_face_index: int,
+) -> Tuple[Optional[list], List[str]]:
+    """
+    入列前的照片預檢：驗證 worker 以低解析度偵測臉部並檢查品質
+
+    沒有臉時返回 400 (REJECT_NO_FACE)，品質不足時返回警告 (REJECT_LOW_QUALITY 時返回 400)；
+    沒有 worker 或逾時則略過預檢直接入列。找到的臉部位置交給 worker 作為提示，不必偵測整張來源照片。
+
+    Returns:
+        Tuple[臉部提示 (未預檢或找不到指定臉部時為 None), 警告訊息]
+    """
+    if file_content is None or not PRESCREEN_CONFIG["ENABLED"]:
+        return None, []
+
+    pending_path = await save_pending_file(f"prescreen-{uuid.uuid4().hex}", "source", filename, file_content)
+    try:
+        result = await call_worker(
+            "prescreen_image",
+            {"file_path": str(pending_path), "source_face_index": source_face_index},
+            timeout=PRESCREEN_CONFIG["TIMEOUT"],
+            prefer_validator=True,
+        )
+    except RpcError as e:
+        # 預檢只是提早拒絕，失敗時仍交由換臉任務完整偵測
+        logger.warning(f"照片預檢略過：{e}")
+        record_prescreen("skipped")
+        return None, []
+    finally:
+        pending_path.unlink(missing_ok=True)
+
+    if result["face_count"] == 0 and PRESCREEN_CONFIG["REJECT_NO_FACE"]:
+        record_prescreen("rejected")
+        raise HTTPException(status_code=400, detail="在照片中沒有偵測到臉部，請上傳清晰的正面照片")
+    warnings = [issue["message"] for issue in result["issues"]]
+    if result["face_count"] == 0:
+        warnings.append("在照片中沒有偵測到臉部，換臉可能失敗")
+    if warnings and PRESCREEN_CONFIG["REJECT_LOW_QUALITY"]:
+        record_prescreen("rejected")
+        raise HTTPException(status_code=400, detail=f"照片品質不足：{'；'.join(warnings)}")
+    record_prescreen("warned" if warnings else "passed")
+
+    faces = result["faces"]
+    return (faces if source_face_index < len(faces) else None), warnings
+
+
+async def resolve_source_hints(
+    file_content: Optional[bytes],
+    filename: str,
+    source_face_index: int,
+    validation_token: Optional[str] = None,
+) -> Tuple[Optional[list], List[str]]:
+    """
+    取得交給 worker 的來源臉部提示
+
+    有 validation_token 時沿用 /api/validate-image 的偵測結果 (不再預檢，worker 也不再偵測)；
+    token 已過期時退回照片預檢。
+
+    Returns:
+        Tuple[臉部提示, 警告訊息]
+    """
+    if not validation_token:
+        return await prescreen_source(file_content, filename, source_face_index)
+    if file_content is None:
+        raise HTTPException(status_code=400, detail="validation_token 需與驗證過的照片一起提交")
+
+    try:
+        faces = await load_validation(validation_token, file_content)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    record_cache_lookup("validation", faces is not None)
+    if faces is None:
+        logger.info("validation_token 已過期，改為照片預檢")
+        return await prescreen_source(file_content, filename, source_face_index)
+
+    if not faces:
+        raise HTTPException(status_code=400, detail="在照片中沒有偵測到臉部，請上傳清晰的正面照片")
+    if source_face_index >= len(faces):
+        raise HTTPException(
+            status_code=400,
+            detail=f"來源圖片只有 {len(faces)} 張臉，但指定了第 {source_face_index + 1} 張臉"
+        )
+    # 沒有關鍵點 (無法對齊計算特徵) 時交由 worker 重新偵測
+    return (faces if all(face.get("kps") for face in faces) else None), []
+
+
+async def check_estimated_wait() -> None:
+    """依 worker 容量預估等待時間，超過 MAX_ESTIMATED_WAIT 時返回 503"""
+    max_wait = QUEUE_CONFIG["MAX_ESTIMATED_WAIT"]
+    if max_wait <= 0:
+        return
+    current_queue_size = await get_queue_size()
+    estimated_wait = await estimate_wait_seconds(current_queue_size)
+    if estimated_wait is not None and estimated_wait > max_wait:
+        logger.warning(
+            f"預估等待 {estimated_wait:.1f} 秒超過上限 {max_wait} 秒，拒絕新任務"
+        )
+        raise HTTPException(
+            status_code=503,
+            detail={
+                "error": "queue_wait_too_long",
+                "message": QUEUE_CONFIG["QUEUE_WAIT_MESSAGE"],
+                "current_queue_size": current_queue_size,
+                "estimated_wait_seconds": round(estimated_wait, 1),
+                "max_estimated_wait": max_wait
+            }
+        )
+
+
+async def enqueue_swap_task(
+    task_id: str,
+    template_id: str,
+    file: Optional[UploadFile],
+    file_content: Optional[bytes],
+    template_file: Optional[UploadFile],
+    template_content: Optional[bytes],
+    source_face_index: int,
+    target_face_index: int,
+    lane: str = "face_swap",
+    extra_sources: Optional[List[Tuple[str, bytes]]] = None,
+    identity: Optional[dict] = None,
+    extra_fields: Optional[dict] = None,
+    source_hints: Optional[list] = None,
+) -> int:
+    """
+    寫入 pending 暫存檔並提交任務 (佇列已滿時清除暫存檔並返回 503)
+
+    extra_sources 為同一人的其他來源照片 (檔名, 內容)，worker 會融合所有照片的臉部特徵；
+    引用身分 (identity) 時直接使用已儲存的身分照片，不寫入 pending 暫存檔；
+    extra_fields 同時寫入任務狀態與佇列 payload (例如 kind)；source_hints 為預檢找到的來源臉部位置
+
+    Returns:
+        int: 前方未完成任務數
+    """
+    # 將上傳檔案寫入 pending 暫存區
+    if identity:
+        source_path = Path(identity["image_path"])
+    else:
+        source_path = await save_pending_file(task_id, "source", file.filename or "source.jpg", file_content)
+
+    template_path: Optional[Path] = None
+    if template_id == "custom" and template_content:
+        template_path = await save_pending_file(task_id, "template", template_file.filename or "template.jpg", template_content)
+
+    extra_paths = [
+        await save_pending_file(task_id, f"source{index}", filename, content)
+        for index, (filename, content) in enumerate(extra_sources or [], start=2)
+    ]
+
+    # 初始化任務狀態
+    created_at = datetime.now().isoformat()
+    initial_status = {
+        "task_id": task_id,
+        "status": "pending",
+        "progress": 0,
+        "message": "任務已提交，等待處理...",
+        "template_id": template_id,
+        "created_at": created_at,
+        "queued_at": created_at,
+        "result_url": None,
+        "template_name": None,
+        "template_description": None,
+        "error": None
+    }
+    job_payload = {
+        "task_id": task_id,
+        "file_path": str(source_path),
+        "template_id": template_id,
+        "template_path": str(template_path) if template_path else None,
+        "source_face_index": source_face_index,
+        "target_face_index": target_face_index,
+        "extra_source_paths": [str(path) for path in extra_paths],
+        "source_digest": None if identity else identity_digest(
+            [file_content, *(content for _, content in extra_sources or [])], source_face_index
+        ),
+        "identity_id": identity["identity_id"] if identity else None,
+        "source_hints": source_hints
+    }
+    if extra_fields:
+        initial_status.update(extra_fields)
+        job_payload.update(extra_fields)
+
+    # 容量檢查 + 建立狀態 + 推入佇列 (單次原子 round trip)
+    max_queue_size = QUEUE_CONFIG["MAX_QUEUE_SIZE"] if QUEUE_CONFIG["ENABLE_QUEUE_LIMIT"] else 0
+    accepted, _, queue_ahead = await submit_task(task_id, initial_status, job_payload, max_queue_size, lane)
+    if not accepted:
+        current_queue_size = queue_ahead  # 拒絕時返回的是目前佇列大小
+        logger.warning(
+            f"佇列已滿，拒絕新任務。當前佇列: {current_queue_size}/{max_queue_size}"
+        )
+        for pending_path in (None if identity else source_path, template_path, *extra_paths):
+            if pending_path:
+                pending_path.unlink(missing_ok=True)
+        raise HTTPException(
+            status_code=503,  # Service Unavailable
+            detail={
+                "error": "queue_full",
+                "message": QUEUE_CONFIG["QUEUE_FULL_MESSAGE"],
+                "current_queue_size": current_queue_size,
+                "max_queue_size": max_queue_size
+            }
+        )
+
+    logger.info(
+        f"已提交換臉任務：{task_id} ({lane})，pending 檔案：{source_path}"
+    )
+    return queue_ahead
+
+
+async def wait_for_task(task_id: str, timeout: float) -> Optional[dict]:
+    """等待任務結束 (經事件推播，不輪詢)，逾時返回 None"""
+    async def wait() -> Optional[dict]:
+        async for kind, data in task_event_stream(task_id):
+            if kind == "status" and data.get("status") in TERMINAL_STATUSES:
+                break
+        # 重新讀取完整狀態 (事件只帶有變更的欄位)
+        return await get_task_status(task_id)
+
+    try:
+        return await asyncio.wait_for(wait(), timeout=timeout)
+    except asyncio.TimeoutError:
+        return None
 
-            except Exception as e:
-                await update_task_status(task_id, {
-                    "status": "failed",
-                    "progress": 0,
-                    "message": f"換臉處理失敗：{str(e)}",
-                    "error": str(e),
-                    "failed_at": datetime.now().isoformat(),
-                    "queue_ahead": 0
-                })
-
-                logger.error(f"任務 {task_id} 換臉處理失敗：{e}")
-
-            finally:
-                try:
-                    remaining_queue_size = await decr_queue_size()
-                except Exception as redis_error:
-                    logger.warning(f"任務 {task_id} 更新佇列大小失敗：{redis_error}")
-                    remaining_queue_size = "unknown"
-                logger.info(f"背景換臉任務 {task_id} 完成，佇列大小: {remaining_queue_size}")
-                await update_task_status(task_id, {
-                    "queue_remaining": remaining_queue_size
-                })
 
 @router.post("/face-swap")
 async def swap_face(
-    file: UploadFile = File(..., description="使用者上傳的照片"),
+    file: UploadFile = File(None, description="使用者上傳的照片 (與 identity_id 二選一)"),
     template_id: Optional[str] = Form(None, description="模板 ID"),
     template_file: Optional[UploadFile] = File(None, description="自訂模板檔案"),
     source_face_index: int = Form(0, description="來源臉部索引"),
-    target_face_index: int = Form(0, description="目標臉部索引")
+    target_face_index: int = Form(0, description="目標臉部索引"),
+    source_files: List[UploadFile] = File(None, description="同一人的其他來源照片 (可多張，融合臉部特徵)"),
+    identity_id: Optional[str] = Form(None, description="已建立的身分 ID (/api/identities)，取代上傳照片"),
+    validation_token: Optional[str] = Form(None, description="/api/validate-image 返回的 token，沿用同一張照片的偵測結果")
 ):
     """
     非同步換臉任務提交
@@ -309,108 +764,37 @@ async def swap_face(
     - **template_file**: 自訂模板檔案，可選參數
     - **source_face_index**: 來源圖片中的臉部索引 (預設: 0)
     - **target_face_index**: 模板圖片中的臉部索引 (預設: 0)
+    - **source_files**: 同一人的其他照片 (可選，含 file 最多 MAX_SOURCE_IMAGES 張)，臉部特徵融合為單一身分
+    - **identity_id**: 以 /api/identities 建立的身分取代 file (不需重新上傳與偵測)
+    - **validation_token**: 同一張照片先呼叫 /api/validate-image 時返回的 token，worker 沿用其臉部偵測結果
     """
     try:
-        # 檢查佇列容量限制
-        if QUEUE_CONFIG["ENABLE_QUEUE_LIMIT"]:
-            current_queue_size = await get_queue_size()
-            max_queue_size = QUEUE_CONFIG["MAX_QUEUE_SIZE"]
-
-            if current_queue_size >= max_queue_size:
-                logger.warning(
-                    f"佇列已滿，拒絕新任務。當前佇列: {current_queue_size}/{max_queue_size}"
-                )
-                raise HTTPException(
-                    status_code=503,  # Service Unavailable
-                    detail={
-                        "error": "queue_full",
-                        "message": QUEUE_CONFIG["QUEUE_FULL_MESSAGE"],
-                        "current_queue_size": current_queue_size,
-                        "max_queue_size": max_queue_size
-                    }
-                )
-
         # 生成 task_id
         task_id = str(uuid.uuid4())
 
-        # 自動判斷使用自訂模板還是預設模板
-        if template_file and template_file.filename:
-            template_id = "custom"
-        elif not template_id:
-            # 如果都沒有提供，拋出錯誤
-            raise HTTPException(
-                status_code=400, 
-                detail="請提供 template_id 或上傳 template_file"
-            )
-            
-        # 驗證檔案
-        validate_file(file)
-        
-        # 讀取檔案內容
-        file_content = await file.read()
-        if not file_content:
-            raise HTTPException(status_code=400, detail="檔案內容為空")
+        template_id, file_content, template_content = await read_swap_request(file, template_id, template_file)
+        extra_sources = await read_extra_sources(source_files)
+        identity = await resolve_swap_identity(identity_id, file_content, extra_sources, source_face_index)
         
-        # 處理模板檔案
-        template_content = None
-        if template_id == "custom" and template_file:
-            validate_file(template_file)
-            template_content = await template_file.read()
-            if not template_content:
-                raise HTTPException(status_code=400, detail="模板檔案內容為空")
-        elif template_id != "custom" and template_id not in TEMPLATE_CONFIG["TEMPLATES"]:
-            raise HTTPException(
-                status_code=400,
-                detail=f"無效的模板 ID: {template_id}，可用的模板 ID: {list(TEMPLATE_CONFIG['TEMPLATES'].keys())}"
-            )
-        
-        # 將上傳檔案寫入 pending 暫存區
-        source_path = await save_pending_file(task_id, "source", file.filename or "source.jpg", file_content)
-
-        template_path: Optional[Path] = None
-        if template_id == "custom" and template_content:
-            template_path = await save_pending_file(task_id, "template", template_file.filename or "template.jpg", template_content)
-
-        # 初始化任務狀態
-        created_at = datetime.now().isoformat()
-        await set_task_status(task_id, {
-            "task_id": task_id,
-            "status": "pending",
-            "progress": 0,
-            "message": "任務已提交，等待處理...",
-            "template_id": template_id,
-            "created_at": created_at,
-            "result_url": None,
-            "template_name": None,
-            "template_description": None,
-            "error": None,
-            "queue_ahead": None
-        })
-
-        # 增加佇列計數並推送佇列
-        queue_size = await incr_queue_size()
-        queue_ahead = queue_size - 1 if queue_size > 0 else 0
-        await update_task_status(task_id, {
-            "queue_ahead": queue_ahead,
-            "queued_at": created_at
-        })
-
-        job_payload = {
-            "task_id": task_id,
-            "file_path": str(source_path),
-            "template_id": template_id,
-            "template_path": str(template_path) if template_path else None,
-            "source_face_index": source_face_index,
-            "target_face_index": target_face_index,
-            "initial_queue_position": queue_size
-        }
-        await redis_client.rpush(
-            TASK_QUEUE_KEY,
-            json.dumps(job_payload, ensure_ascii=False)
+        # 依 worker 容量預估等待時間，過長則直接拒絕 (不寫入任何檔案)
+        await check_estimated_wait()
+        # 照片預檢 (或沿用驗證結果)：沒有臉的照片不必排隊
+        source_hints, warnings = await resolve_source_hints(
+            file_content, file.filename if file else "source.jpg", source_face_index, validation_token
         )
 
-        logger.info(
-            f"已提交換臉任務：{task_id}，pending 檔案：{source_path}"
+        queue_ahead = await enqueue_swap_task(
+            task_id,
+            template_id,
+            file,
+            file_content,
+            template_file,
+            template_content,
+            source_face_index,
+            target_face_index,
+            extra_sources=extra_sources,
+            identity=identity,
+            source_hints=source_hints,
         )
 
         return {
@@ -418,7 +802,8 @@ async def swap_face(
             "message": "任務已提交，請使用任務 ID 查詢處理狀態",
             "task_id": task_id,
             "status": "pending",
-            "queue_ahead": queue_ahead
+            "queue_ahead": queue_ahead,
+            "warnings": warnings
         }
         
     except HTTPException:
@@ -444,15 +829,20 @@ async def get_task_status_api(task_id: str):
             raise HTTPException(status_code=404, detail="任務不存在")
 
         queue_size_snapshot = None
+        service_rate = None
         try:
-            queue_size_snapshot = await get_queue_size()
+            position = await get_task_position(task_id)
+            queue_size_snapshot = position["queue_size"]
+            service_rate = position["service_rate"]
+            apply_queue_position(status, position)
         except Exception as redis_error:
-            logger.warning(f"取得目前佇列大小失敗：{redis_error}")
+            logger.warning(f"取得目前佇列位置失敗：{redis_error}")
 
         return {
             "success": True,
             "task_status": status,
-            "queue_size": queue_size_snapshot
+            "queue_size": queue_size_snapshot,
+            "service_rate": service_rate
         }
 
     except HTTPException:
@@ -464,21 +854,84 @@ async def get_task_status_api(task_id: str):
             detail=f"查詢任務狀態失敗：{str(e)}"
         )
 
+@router.get("/face-swap/events/{task_id}")
+async def stream_task_events(task_id: str, request: Request):
+    """
+    以 Server-Sent Events 推送任務進度、排隊位置與最終結果
+
+    事件類型：
+    - **status**: 完整任務狀態 (與 /face-swap/status 的 task_status 相同)
+    - **position**: 排隊位置變更 (queue_ahead / queue_size / eta_seconds)
+
+    任務完成或失敗後伺服器主動結束串流。
+
+    - **task_id**: 任務 ID
+    """
+    if not await redis_client.exists(f"{TASK_KEY_PREFIX}{task_id}"):
+        raise HTTPException(status_code=404, detail="任務不存在")
+
+    async def event_source():
+        try:
+            async for event, data in task_event_stream(task_id):
+                if await request.is_disconnected():
+                    break
+                if event == "ping":
+                    yield ": ping\n\n"
+                    continue
+                yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+        except Exception as e:
+            logger.warning(f"任務 {task_id} 事件串流中斷：{e}")
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",  # 關閉 Nginx 緩衝
+        },
+    )
+
+@router.websocket("/face-swap/ws/{task_id}")
+async def task_events_websocket(websocket: WebSocket, task_id: str):
+    """
+    以 WebSocket 推送任務事件，訊息格式：{"type": "status" | "position", "data": {...}}
+
+    - **task_id**: 任務 ID
+    """
+    await websocket.accept()
+    try:
+        if not await redis_client.exists(f"{TASK_KEY_PREFIX}{task_id}"):
+            await websocket.send_json({"type": "error", "data": {"detail": "任務不存在"}})
+            await websocket.close(code=4404)
+            return
+        async for event, data in task_event_stream(task_id):
+            if event == "ping":
+                continue
+            await websocket.send_json({"type": event, "data": data})
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.warning(f"任務 {task_id} WebSocket 推播中斷：{e}")
+
 @router.get("/face-swap/tasks")
-async def list_tasks(limit: int = 10):
+async def list_tasks(limit: int = 10, offset: int = 0, status: Optional[str] = None):
     """
     列出最近的任務
     
     - **limit**: 返回任務數量限制
+    - **offset**: 分頁起始位置
+    - **status**: 只列出指定狀態的任務 (pending/processing/completed/failed)
     """
+    if status is not None and status not in TASK_STATUSES:
+        raise HTTPException(status_code=400, detail=f"不支援的任務狀態：{status}")
     try:
-        tasks_with_keys = await load_tasks(with_keys=True)
-        tasks = [item[1] for item in tasks_with_keys[:limit]]
+        tasks = await load_tasks(limit=max(limit, 0), offset=max(offset, 0), status=status)
 
         return {
             "success": True,
             "tasks": tasks,
-            "total": len(tasks_with_keys)
+            "total": await count_tasks(status)
         }
         
     except Exception as e:
@@ -500,10 +953,11 @@ async def delete_task(task_id: str):
         if not task:
             raise HTTPException(status_code=404, detail="任務不存在")
         
-        # 如果任務已完成且有結果檔案，嘗試刪除檔案
-        if task.get("result_url"):
+        # 如果任務已完成且有結果檔案，嘗試刪除檔案 (全模板任務有多個結果)
+        result_urls = [task.get("result_url")] + [item.get("result_url") for item in task.get("results") or []]
+        for result_url in filter(None, result_urls):
             try:
-                result_filename = task["result_url"].split("/")[-1]
+                result_filename = result_url.split("/")[-1]
                 result_path = RESULTS_DIR / result_filename
                 if result_path.exists():
                     result_path.unlink()
@@ -511,8 +965,8 @@ async def delete_task(task_id: str):
             except Exception as e:
                 logger.warning(f"刪除結果檔案失敗：{e}")
         
-        # 刪除原圖檔案
-        if task.get("original_url"):
+        # 刪除原圖檔案 (身分照片由 /api/identities 管理，不隨任務刪除)
+        if task.get("original_url") and not task.get("identity_id"):
             try:
                 original_filename = task["original_url"].split("/")[-1]
                 original_path = UPLOADS_DIR / original_filename
@@ -523,7 +977,7 @@ async def delete_task(task_id: str):
                 logger.warning(f"刪除原圖檔案失敗：{e}")
         
         # 刪除任務記錄
-        await redis_client.delete(f"{TASK_KEY_PREFIX}{task_id}")
+        await delete_tasks([task_id])
         
         return {
             "success": True,
@@ -555,26 +1009,52 @@ async def validate_image(file: UploadFile = File(..., description="要驗證的
         if not file_content:
             raise HTTPException(status_code=400, detail="檔案內容為空")
         
-        # 獲取臉部處理器
-        processor = get_face_processor()
-        
-        # 驗證圖片
-        validation_result = processor.validate_image(file_content)
+        # 交由驗證 worker 偵測臉部 (API 行程不載入模型；沒有驗證 worker 時由一般 worker 處理)
+        pending_path = await save_pending_file(f"validate-{uuid.uuid4().hex}", "source", file.filename or "source.jpg", file_content)
+        try:
+            validation_result = await call_worker(
+                "validate_image", {"file_path": str(pending_path)}, prefer_validator=True
+            )
+        finally:
+            pending_path.unlink(missing_ok=True)
         
         if not validation_result["valid"]:
             raise HTTPException(
                 status_code=400,
                 detail=f"圖片驗證失敗：{validation_result.get('error', '未知錯誤')}"
             )
+
+        # 保存偵測結果，提交同一張照片換臉時以 validation_token 沿用 (回應不含關鍵點與特徵)
+        validation_token = uuid.uuid4().hex
+        await save_validation(validation_token, file_content, [
+            {
+                "index": face["index"],
+                "bbox": face["bbox"],
+                "kps": face.get("kps"),
+                "det_score": face["confidence"],
+                "embedding": face.get("embedding"),
+            }
+            for face in validation_result["faces"]
+        ])
+        validation_result["faces"] = [
+            {key: face[key] for key in ("index", "bbox", "confidence")}
+            for face in validation_result["faces"]
+        ]
         
         return {
             "success": True,
             "message": "圖片驗證成功",
-            "image_info": validation_result
+            "image_info": validation_result,
+            "validation_token": validation_token,
+            "expires_in": MODEL_CONFIG["VALIDATION_TOKEN_TTL"]
         }
         
     except HTTPException:
         raise
+    except NoWorkerAvailableError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except RpcTimeoutError as e:
+        raise HTTPException(status_code=504, detail=f"圖片驗證逾時：{str(e)}")
     except Exception as e:
         logger.error(f"圖片驗證失敗：{e}")
         raise HTTPException(
@@ -591,7 +1071,7 @@ async def get_result_file(filename: str):
     """
     try:
         # 安全檢查：只允許特定格式的檔名
-        if not filename.startswith("result_") or not filename.endswith(".jpg"):
+        if not filename.startswith("result_") or Path(filename).suffix not in RESULT_MEDIA_TYPES:
             raise HTTPException(status_code=400, detail="無效的檔案名稱")
         
         # 建構檔案路徑
@@ -605,7 +1085,7 @@ async def get_result_file(filename: str):
         return FileResponse(
             path=str(file_path),
             filename=filename,
-            media_type="image/jpeg"
+            media_type=RESULT_MEDIA_TYPES[Path(filename).suffix]
         )
         
     except HTTPException:
@@ -661,7 +1141,7 @@ async def delete_result_file(filename: str):
     """
     try:
         # 安全檢查
-        if not filename.startswith("result_") or not filename.endswith(".jpg"):
+        if not filename.startswith("result_") or Path(filename).suffix not in RESULT_MEDIA_TYPES:
             raise HTTPException(status_code=400, detail="無效的檔案名稱")
         
         # 建構檔案路徑
@@ -746,8 +1226,9 @@ async def get_queue_status_api():
         # 檢查 GPU 鎖狀態
         gpu_lock_exists = await redis_client.exists(GPU_LOCK_KEY)
 
-        # 獲取佇列配置
+        # 獲取佇列配置與 worker 容量
         current_queue_size = await get_queue_size()
+        capacity = summarize_capacity(await get_live_workers())
         max_queue_size = QUEUE_CONFIG["MAX_QUEUE_SIZE"] if QUEUE_CONFIG["ENABLE_QUEUE_LIMIT"] else None
         queue_available = max_queue_size - current_queue_size if max_queue_size else None
 
@@ -760,10 +1241,16 @@ async def get_queue_status_api():
                 "available_slots": queue_available,
                 "is_full": current_queue_size >= max_queue_size if max_queue_size else False,
                 "gpu_lock_active": bool(gpu_lock_exists),
-                "max_concurrent": 1  # GPU串行處理
+                "max_concurrent": capacity["live_workers"],  # 每個 worker 一次處理一個任務
+                "estimated_wait_seconds": (
+                    round(current_queue_size / capacity["throughput"], 1)
+                    if capacity["throughput"] else None
+                )
             },
+            "workers": capacity,
             "task_statistics": {
-                "note": "Task statistics disabled for performance"
+                "metrics_enabled": METRICS_ENABLED,
+                "metrics_path": MONITORING_CONFIG["METRICS_PATH"]
             },
             "system_resources": {
                 "cpu_percent": cpu_percent,
@@ -781,6 +1268,56 @@ async def get_queue_status_api():
             detail=f"獲取佇列狀態失敗：{str(e)}"
         )
 
+@router.get("/queue/autoscale")
+async def get_autoscale_signals_api(target_latency: Optional[float] = None):
+    """
+    擴縮容訊號 (供外部 autoscaler 使用)
+
+    - **target_latency**: 目標等待時間（秒），預設使用 AUTOSCALE_TARGET_LATENCY
+
+    Returns:
+        dict: 各通道佇列深度、最舊工作等待時間、到達/完成速率與建議 worker 數 (desired_workers)
+    """
+    if target_latency is not None and target_latency <= 0:
+        raise HTTPException(status_code=400, detail="target_latency 必須大於 0")
+    try:
+        signals = await get_autoscale_signals(target_latency)
+        return {
+            "success": True,
+            **signals
+        }
+
+    except Exception as e:
+        logger.error(f"計算擴縮容訊號失敗：{e}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"計算擴縮容訊號失敗：{str(e)}"
+        )
+
+@router.get("/workers")
+async def list_workers():
+    """
+    列出存活的 worker 與彙總容量
+
+    Returns:
+        dict: 各 worker 的裝置、provider、目前任務、完成數與吞吐量估計
+    """
+    try:
+        workers = await get_live_workers()
+        return {
+            "success": True,
+            "workers": workers,
+            "capacity": summarize_capacity(workers),
+            "timestamp": datetime.now().isoformat()
+        }
+
+    except Exception as e:
+        logger.error(f"獲取 worker 狀態失敗：{e}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"獲取 worker 狀態失敗：{str(e)}"
+        )
+
 @router.post("/cleanup")
 async def cleanup_results(max_age_hours: int = 24):
     """
@@ -793,11 +1330,17 @@ async def cleanup_results(max_age_hours: int = 24):
         cleanup_old_results(max_age_hours)
         
         # 清理舊的任務記錄（保留最近100個）
-        tasks_with_keys = await load_tasks(with_keys=True)
-        if len(tasks_with_keys) > 100:
-            for redis_key, _ in tasks_with_keys[100:]:
-                await redis_client.delete(redis_key)
-            logger.info("已清理舊任務記錄，保留最新 100 個任務")
+        await prune_task_index()
+        removed = 0
+        while True:
+            excess = await count_tasks() - 100
+            if excess <= 0:
+                break
+            old_task_ids = await list_task_ids(0, min(excess, 500) - 1, newest_first=False)
+            await delete_tasks(old_task_ids)
+            removed += len(old_task_ids)
+        if removed:
+            logger.info(f"已清理 {removed} 筆舊任務記錄，保留最新 100 個任務")
         
         return {
             "success": True,
@@ -820,20 +1363,23 @@ async def get_system_status():
         dict: 系統資訊包括GPU、記憶體、CPU等資訊
     """
     try:
-        system_info = get_system_info()
-        
-        # 獲取處理器的GPU狀態
-        processor = get_face_processor()
-        processor_gpu_status = getattr(processor, 'gpu_available', False)
+        # 由 worker 回報 (GPU 與模型只存在於 worker)
+        worker_info = await call_worker("system_info")
+        processor_gpu_status = worker_info["processor_gpu_enabled"]
         
         return {
             "success": True,
-            "system_info": system_info,
+            "system_info": worker_info["system_info"],
             "processor_gpu_enabled": processor_gpu_status,
+            "worker_id": worker_info["worker_id"],
             "message": f"目前使用{'GPU' if processor_gpu_status else 'CPU'}模式進行處理",
             "timestamp": datetime.now().isoformat()
         }
         
+    except NoWorkerAvailableError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except RpcTimeoutError as e:
+        raise HTTPException(status_code=504, detail=f"獲取系統資訊逾時：{str(e)}")
     except Exception as e:
         logger.error(f"獲取系統資訊失敗：{e}")
         raise HTTPException(
@@ -843,134 +1389,94 @@ async def get_system_status():
 
 @router.post("/swapper")
 async def swapper(
-    file: UploadFile = File(..., description="使用者上傳的照片"),
+    file: UploadFile = File(None, description="使用者上傳的照片 (與 identity_id 二選一)"),
     template_id: Optional[str] = Form(None, description="模板 ID"),
     template_file: Optional[UploadFile] = File(None, description="自訂模板檔案"),
     source_face_index: int = Form(0, description="來源臉部索引"),
-    target_face_index: int = Form(0, description="目標臉部索引")
+    target_face_index: int = Form(0, description="目標臉部索引"),
+    source_files: List[UploadFile] = File(None, description="同一人的其他來源照片 (可多張，融合臉部特徵)"),
+    identity_id: Optional[str] = Form(None, description="已建立的身分 ID (/api/identities)，取代上傳照片"),
+    validation_token: Optional[str] = Form(None, description="/api/validate-image 返回的 token，沿用同一張照片的偵測結果")
 ):
     """
     同步換臉 API
     
-    實時處理換臉請求並直接返回結果
+    將任務提交到優先通道 (worker 先於一般佇列取出)，等待處理完成後直接返回結果；
+    超過 SYNC_SWAP_TIMEOUT 仍未完成時返回 504，任務仍會繼續處理，可用 task_id 查詢狀態
     
     Args:
         file: 使用者上傳的照片檔案
         template_id: 模板 ID (1-6)，可選參數
         template_file: 自訂模板檔案，可選參數
-        source_face_index: 來源圖片中的臉部索引 (預設: 0)
-        target_face_index: 模板圖片中的臉部索引 (預設: 0)
+        source_face_index: 來源臉部索引 (預設: 0)
+        target_face_index: 目標臉部索引 (預設: 0)
+        source_files: 同一人的其他來源照片 (可選)，臉部特徵融合為單一身分
+        identity_id: 以 /api/identities 建立的身分取代 file (可選)
+        validation_token: /api/validate-image 返回的 token (可選)，沿用同一張照片的偵測結果
     """
     try:
-        sync_task_id = f"sync-{uuid.uuid4()}"
-        async with RedisLock():
-            sync_queue_size: Optional[object] = None
-            try:
-                sync_queue_size = await get_queue_size()
-            except Exception as redis_error:
-                logger.warning(f"同步任務 {sync_task_id} 無法取得佇列大小：{redis_error}")
-                sync_queue_size = "unknown"
-            logger.info(f"開始處理同步換臉請求，佇列大小: {sync_queue_size}")
-            
-            try:
-                # 自動判斷使用自訂模板還是預設模板
-                if template_file and template_file.filename:
-                    template_id = "custom"
-                elif not template_id:
-                    # 如果都沒有提供，拋出錯誤
-                    raise HTTPException(
-                        status_code=400, 
-                        detail="請提供 template_id 或上傳 template_file"
-                    )
-                    
-                # 驗證檔案
-                validate_file(file)
-                
-                # 讀取檔案內容
-                file_content = await file.read()
-                if not file_content:
-                    raise HTTPException(status_code=400, detail="檔案內容為空")
-                
-                # 處理模板檔案
-                template_content = None
-                if template_id == "custom" and template_file:
-                    validate_file(template_file)
-                    template_content = await template_file.read()
-                    if not template_content:
-                        raise HTTPException(status_code=400, detail="模板檔案內容為空")
-                elif template_id != "custom" and template_id not in TEMPLATE_CONFIG["TEMPLATES"]:
-                    raise HTTPException(
-                        status_code=400,
-                        detail=f"無效的模板 ID: {template_id}，可用的模板 ID: {list(TEMPLATE_CONFIG['TEMPLATES'].keys())}"
-                    )
-                
-                # 獲取臉部處理器
-                processor = get_face_processor()
-                
-                # 直接進行換臉處理
-                start_time = datetime.now()
-                
-                # 保存原圖
-                original_filename = f"original_{uuid.uuid4().hex[:8]}.jpg"
-                original_path = UPLOADS_DIR / original_filename
-                UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
-                with open(original_path, 'wb') as f:
-                    f.write(file_content)
-                original_url = f"/uploads/{original_filename}"
-                
-                # 將檔案內容轉換為圖片
-                source_image = processor._decode_image(file_content)
-        
-                # 處理模板圖片
-                if template_id == "custom" and template_content:
-                    target_image = processor._decode_image(template_content)
-                else:
-                    # 載入預設模板
-                    template_path = get_template_path(template_id)
-                    target_image = cv2.imread(str(template_path))
-                    if target_image is None:
-                        raise HTTPException(status_code=400, detail=f"無法載入模板 {template_id}")
-        
-                # 執行換臉
-                result_image = await asyncio.get_event_loop().run_in_executor(
-                    executor,
-                    processor.swap_faces,
-                    source_image,
-                    target_image,
-                    source_face_index,
-                    target_face_index
-                )
-                
-                # 保存結果
-                result_filename = f"result_{uuid.uuid4().hex[:8]}.jpg"
-                result_path = RESULTS_DIR / result_filename
-                cv2.imwrite(str(result_path), result_image)
-                
-                result_url = f"/results/{result_filename}"
-                
-                processing_time = (datetime.now() - start_time).total_seconds()
-                
-                # 獲取模板資訊
-                template_info = TEMPLATE_CONFIG["TEMPLATES"].get(template_id, {})
-                template_name = template_info.get("name", f"模板 {template_id}")
-                template_description = template_info.get("description", "")
-                
-                return {
-                    "success": True,
-                    "result_url": result_url,
-                    "original_url": original_url,
-                    "template_name": template_name,
-                    "template_description": template_description,
-                    "processing_time": f"{processing_time:.2f}s",
-                    "message": "換臉處理完成"
+        task_id = f"sync-{uuid.uuid4()}"
+        started = time.perf_counter()
+
+        template_id, file_content, template_content = await read_swap_request(file, template_id, template_file)
+        extra_sources = await read_extra_sources(source_files)
+        identity = await resolve_swap_identity(identity_id, file_content, extra_sources, source_face_index)
+
+        # 沒有 worker 時提交只會等到逾時，直接拒絕
+        capacity = await get_worker_capacity()
+        if not capacity["live_workers"]:
+            raise HTTPException(status_code=503, detail="目前沒有可用的 worker")
+        source_hints, warnings = await resolve_source_hints(
+            file_content, file.filename if file else "source.jpg", source_face_index, validation_token
+        )
+
+        await enqueue_swap_task(
+            task_id,
+            template_id,
+            file,
+            file_content,
+            template_file,
+            template_content,
+            source_face_index,
+            target_face_index,
+            lane="priority",
+            extra_sources=extra_sources,
+            identity=identity,
+            source_hints=source_hints,
+        )
+
+        timeout = QUEUE_CONFIG["SYNC_SWAP_TIMEOUT"]
+        status = await wait_for_task(task_id, timeout)
+        if status is None or status.get("status") not in TERMINAL_STATUSES:
+            raise HTTPException(
+                status_code=504,
+                detail={
+                    "error": "sync_timeout",
+                    "message": f"換臉處理超過 {timeout} 秒，請使用任務 ID 查詢處理狀態",
+                    "task_id": task_id
                 }
-            finally:
-                try:
-                    final_queue_size = await get_queue_size()
-                except Exception as redis_error:
-                    logger.warning(f"同步任務 {sync_task_id} 更新佇列大小失敗：{redis_error}")
-                    final_queue_size = "unknown"
-                logger.info(f"同步換臉請求完成，佇列大小: {final_queue_size}")
+            )
+        if status["status"] == "failed":
+            raise HTTPException(status_code=500, detail=f"處理失敗：{status.get('error') or status.get('message')}")
+
+        processing_time = time.perf_counter() - started
+        logger.info(f"同步換臉請求 {task_id} 完成，耗時 {processing_time:.2f}s")
+
+        return {
+            "success": True,
+            "task_id": task_id,
+            "result_url": status.get("result_url"),
+            "original_url": status.get("original_url"),
+            "template_name": status.get("template_name"),
+            "template_description": status.get("template_description"),
+            "processing_time": f"{processing_time:.2f}s",
+            "timings": status.get("timings"),
+            "source_resolution": status.get("source_resolution"),
+            "template_resolution": status.get("template_resolution"),
+            "worker_id": status.get("worker_id"),
+            "warnings": warnings,
+            "message": "換臉處理完成"
+        }
         
     except HTTPException:
         # 重新拋出 HTTP 異常
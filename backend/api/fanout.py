@@ -0,0 +1,290 @@
+"""
+全模板換臉 API 路由
+
+一次請求把使用者的臉換入所有可用模板 (或指定分類 / 模板)：worker 只偵測一次來源臉部，
+依序處理各模板 (模板圖片與臉部偵測皆有快取)，每完成一個模板就寫入任務狀態並推播，
+取代逐一提交多個換臉任務。
+"""
+from fastapi import APIRouter, File, UploadFile, Form, HTTPException
+import asyncio
+import logging
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional
+
+from core.config import TEMPLATE_CONFIG, get_template_path
+from core.distributed_lock import RedisLock
+from core.task_queue import start_task, finish_task
+from core.task_store import update_task_status
+from core.metrics import observe_stage, record_task_result, format_timings
+from api.face_swap import (
+    executor,
+    get_task_semaphore,
+    validate_file,
+    read_extra_sources,
+    resolve_swap_identity,
+    check_estimated_wait,
+    resolve_source_hints,
+    enqueue_swap_task,
+    load_task_identity,
+    resolve_source_face,
+)
+
+# 設定日誌
+logger = logging.getLogger(__name__)
+
+# 建立路由器
+router = APIRouter()
+
+
+def template_available(template_id: str) -> bool:
+    """模板圖片是否存在"""
+    try:
+        return get_template_path(template_id).exists()
+    except Exception:
+        return False
+
+
+def select_templates(category: Optional[str], template_ids: Optional[str]) -> List[str]:
+    """
+    選出要換臉的模板 (依設定順序，只含可用模板)
+
+    Args:
+        category: 模板分類 (/api/templates/categories)，未指定時不限分類
+        template_ids: 逗號分隔的模板 ID，未指定時使用所有模板
+    """
+    templates = TEMPLATE_CONFIG["TEMPLATES"]
+    if template_ids:
+        requested = [value.strip() for value in template_ids.split(",") if value.strip()]
+        invalid = [value for value in requested if value not in templates]
+        if invalid:
+            raise HTTPException(
+                status_code=400,
+                detail=f"無效的模板 ID: {', '.join(invalid)}，可用的模板 ID: {list(templates.keys())}"
+            )
+        selected = [template_id for template_id in templates if template_id in requested]
+    else:
+        selected = list(templates.keys())
+
+    if category:
+        categories = sorted({info["category"] for info in templates.values()})
+        if category not in categories:
+            raise HTTPException(status_code=400, detail=f"無效的模板分類: {category}，可用的分類: {categories}")
+        selected = [template_id for template_id in selected if templates[template_id]["category"] == category]
+
+    selected = [template_id for template_id in selected if template_available(template_id)]
+    if not selected:
+        raise HTTPException(status_code=400, detail="沒有符合條件的可用模板")
+    return selected
+
+
+async def process_fanout_task(
+    task_id: str,
+    file_content: bytes,
+    template_ids: List[str],
+    source_face_index: int = 0,
+    target_face_index: int = 0,
+    worker_id: Optional[str] = None,
+    enqueued_at: Optional[float] = None,
+    timings: Optional[dict] = None,
+    extra_source_contents: Optional[List[bytes]] = None,
+    source_digest: Optional[str] = None,
+    identity_id: Optional[str] = None,
+    source_hints: Optional[list] = None
+) -> bool:
+    """
+    背景任務：將同一張臉換入多個模板
+
+    來源臉部只解碼、偵測 (或讀取快取特徵) 一次；叢集 GPU 鎖在每個模板換臉時各取得一次，
+    其他 worker 的任務不會被整組模板卡住。單一模板失敗只記錄在該模板的結果，不影響其他模板；
+    全部模板都失敗時任務才視為失敗。
+
+    Returns:
+        bool: 任務是否成功完成
+    """
+    timings = {} if timings is None else timings
+
+    async with get_task_semaphore():
+        final_updates = None
+        failure_reason = None
+        try:
+            await start_task(task_id, {
+                "status": "processing",
+                "progress": 5,
+                "message": "正在偵測來源臉部...",
+                "queue_ahead": 0,
+                "worker_id": worker_id,
+            })
+
+            from core.face_processor import get_face_processor
+            processor = get_face_processor()
+            loop = asyncio.get_event_loop()
+
+            identity = await load_task_identity(identity_id)
+            original_path, source_image = await loop.run_in_executor(
+                executor, processor.load_source, file_content, task_id, timings, identity is None
+            )
+            source_face, fused_sources = await resolve_source_face(
+                processor, source_image, source_face_index, identity, source_digest, extra_source_contents, timings,
+                source_hints
+            )
+
+            results = []
+            for position, template_id in enumerate(template_ids, start=1):
+                template_info = TEMPLATE_CONFIG["TEMPLATES"][template_id]
+                item = {"template_id": template_id, "template_name": template_info["name"]}
+                try:
+                    target_image = await loop.run_in_executor(
+                        executor, processor.load_template, get_template_path(template_id), timings
+                    )
+                    lock_wait_started = time.perf_counter()
+                    async with RedisLock(owner=worker_id):
+                        observe_stage("lock_wait", time.perf_counter() - lock_wait_started, timings)
+                        result_image = await loop.run_in_executor(
+                            executor,
+                            processor.swap_faces,
+                            source_image,
+                            target_image,
+                            source_face_index,
+                            target_face_index,
+                            timings,
+                            source_face
+                        )
+                    result_path = await loop.run_in_executor(executor, processor.save_result, result_image, timings)
+                    item.update({"status": "completed", "result_url": f"/results/{Path(result_path).name}"})
+                except Exception as e:
+                    logger.warning(f"任務 {task_id} 模板 {template_id} 換臉失敗：{e}")
+                    item.update({"status": "failed", "error": str(e)})
+                results.append(item)
+
+                await update_task_status(task_id, {
+                    "progress": 10 + int(position / len(template_ids) * 85),
+                    "message": f"AI 正在進行換臉處理 ({position}/{len(template_ids)})...",
+                    "templates_done": position,
+                    "results": results,
+                })
+
+            completed = sum(1 for item in results if item["status"] == "completed")
+            if completed == 0:
+                raise RuntimeError(f"所有模板換臉皆失敗：{results[0]['error']}")
+
+            final_updates = {
+                "status": "completed",
+                "progress": 100,
+                "message": f"換臉處理完成 (成功 {completed}/{len(template_ids)} 個模板)",
+                "original_url": identity["original_url"] if identity else f"/uploads/{Path(original_path).name}",
+                "completed_at": datetime.now().isoformat(),
+                "queue_ahead": 0,
+                "results": results,
+                "templates_done": len(template_ids),
+                "completed_templates": completed,
+                "failed_templates": len(template_ids) - completed,
+                "source_resolution": f"{source_image.shape[1]}x{source_image.shape[0]}",
+                "source_images": identity["source_images"] if identity else 1 + len(extra_source_contents or []),
+                "fused_sources": fused_sources,
+                "identity_id": identity_id,
+            }
+            logger.info(f"任務 {task_id} 全模板換臉完成：{completed}/{len(template_ids)}")
+
+        except Exception as e:
+            final_updates = {
+                "status": "failed",
+                "progress": 0,
+                "message": f"換臉處理失敗：{str(e)}",
+                "error": str(e),
+                "failed_at": datetime.now().isoformat(),
+                "queue_ahead": 0
+            }
+            logger.error(f"任務 {task_id} 全模板換臉失敗：{e}")
+            failure_reason = type(e).__name__
+
+        finally:
+            end_to_end = time.time() - enqueued_at if enqueued_at else None
+            if end_to_end is not None:
+                timings["total"] = end_to_end
+            final_updates["timings"] = format_timings(timings)
+            try:
+                await finish_task(task_id, final_updates)
+            except Exception as redis_error:
+                logger.warning(f"任務 {task_id} 寫入完成狀態失敗：{redis_error}")
+            record_task_result(final_updates["status"], end_to_end, failure_reason)
+
+    return final_updates["status"] == "completed"
+
+
+@router.post("/face-swap/all-templates")
+async def swap_face_all_templates(
+    file: UploadFile = File(None, description="使用者上傳的照片 (與 identity_id 二選一)"),
+    category: Optional[str] = Form(None, description="模板分類，未指定時使用所有分類"),
+    template_ids: Optional[str] = Form(None, description="逗號分隔的模板 ID，未指定時使用所有模板"),
+    source_face_index: int = Form(0, description="來源臉部索引"),
+    target_face_index: int = Form(0, description="目標臉部索引"),
+    source_files: List[UploadFile] = File(None, description="同一人的其他來源照片 (可多張，融合臉部特徵)"),
+    identity_id: Optional[str] = Form(None, description="已建立的身分 ID (/api/identities)，取代上傳照片"),
+    validation_token: Optional[str] = Form(None, description="/api/validate-image 返回的 token，沿用同一張照片的偵測結果")
+):
+    """
+    全模板換臉任務提交
+
+    單一任務把使用者的臉換入所有可用模板 (或指定分類 / 模板)，來源臉部只偵測一次；
+    每完成一個模板，結果就加入任務狀態的 results (可經 /api/face-swap/events 推播即時取得)
+
+    - **file**: 使用者上傳的照片檔案
+    - **category**: 模板分類 (見 /api/templates/categories)，可選參數
+    - **template_ids**: 逗號分隔的模板 ID，可選參數
+    - **source_face_index**: 來源圖片中的臉部索引 (預設: 0)
+    - **target_face_index**: 模板圖片中的臉部索引 (預設: 0)，套用到每個模板
+    - **source_files**: 同一人的其他照片 (可選)，臉部特徵融合為單一身分
+    - **identity_id**: 以 /api/identities 建立的身分取代 file
+    - **validation_token**: /api/validate-image 返回的 token，沿用同一張照片的偵測結果
+    """
+    try:
+        task_id = str(uuid.uuid4())
+
+        selected = select_templates(category, template_ids)
+        file_content = None
+        if file and file.filename:
+            validate_file(file)
+            file_content = await file.read()
+            if not file_content:
+                raise HTTPException(status_code=400, detail="檔案內容為空")
+        extra_sources = await read_extra_sources(source_files)
+        identity = await resolve_swap_identity(identity_id, file_content, extra_sources, source_face_index)
+
+        await check_estimated_wait()
+        source_hints, warnings = await resolve_source_hints(
+            file_content, file.filename if file else "source.jpg", source_face_index, validation_token
+        )
+
+        queue_ahead = await enqueue_swap_task(
+            task_id,
+            None,
+            file,
+            file_content,
+            None,
+            None,
+            source_face_index,
+            target_face_index,
+            extra_sources=extra_sources,
+            identity=identity,
+            extra_fields={"kind": "fanout", "template_ids": selected, "templates_total": len(selected)},
+            source_hints=source_hints,
+        )
+
+        return {
+            "success": True,
+            "message": "任務已提交，請使用任務 ID 查詢處理狀態",
+            "task_id": task_id,
+            "status": "pending",
+            "queue_ahead": queue_ahead,
+            "template_ids": selected,
+            "warnings": warnings
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"全模板任務提交失敗：{e}")
+        raise HTTPException(status_code=500, detail=f"全模板任務提交失敗：{str(e)}")
@@ -0,0 +1,114 @@
+"""
+身分 API 路由
+
+上傳一次照片建立身分，之後以 identity_id 換入任意模板 (不需重新上傳、暫存與偵測來源臉部)
+"""
+from fastapi import APIRouter, File, UploadFile, HTTPException
+import logging
+import uuid
+from pathlib import Path
+from typing import List
+
+from core.config import MODEL_CONFIG
+from core.identity import save_identity, get_identity, delete_identity, public_identity
+from core.rpc import call_worker, NoWorkerAvailableError, RpcTimeoutError, RpcError
+from api.face_swap import validate_file, save_pending_file, read_extra_sources
+
+# 設定日誌
+logger = logging.getLogger(__name__)
+
+# 建立路由器
+router = APIRouter()
+
+
+@router.post("/identities")
+async def create_identity(
+    file: UploadFile = File(..., description="使用者上傳的照片"),
+    source_files: List[UploadFile] = File(None, description="同一人的其他照片 (可多張，融合臉部特徵)")
+):
+    """
+    建立身分
+
+    由 worker 正規化照片、偵測所有臉部並計算特徵，身分保留 IDENTITY_TTL 秒 (每次使用時延長)；
+    之後的 /api/face-swap、/api/swapper 以 identity_id 取代 file
+
+    - **file**: 使用者上傳的照片檔案
+    - **source_files**: 同一人的其他照片 (可選)，每張臉的特徵與其他照片中最相似的臉融合
+    """
+    identity_id = uuid.uuid4().hex
+    pending_paths = []
+    try:
+        validate_file(file)
+        file_content = await file.read()
+        if not file_content:
+            raise HTTPException(status_code=400, detail="檔案內容為空")
+        extra_sources = await read_extra_sources(source_files)
+
+        pending_paths.append(await save_pending_file(f"identity-{identity_id}", "source", file.filename or "source.jpg", file_content))
+        for index, (filename, content) in enumerate(extra_sources, start=2):
+            pending_paths.append(await save_pending_file(f"identity-{identity_id}", f"source{index}", filename, content))
+
+        # API 行程不載入模型，交由 worker 偵測並計算特徵
+        try:
+            record = await call_worker(
+                "create_identity",
+                {"identity_id": identity_id, "file_paths": [str(path) for path in pending_paths]},
+            )
+        except NoWorkerAvailableError as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        except RpcTimeoutError as e:
+            raise HTTPException(status_code=504, detail=f"建立身分逾時：{str(e)}")
+        except RpcError as e:
+            raise HTTPException(status_code=400, detail=f"建立身分失敗：{str(e)}")
+
+        await save_identity(record)
+        logger.info(f"已建立身分：{identity_id} ({len(record['faces'])} 張臉，{record['source_images']} 張照片)")
+
+        return {
+            "success": True,
+            "message": "身分已建立，請以 identity_id 提交換臉",
+            "identity": public_identity(record),
+            "expires_in": MODEL_CONFIG["IDENTITY_TTL"]
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"建立身分失敗：{e}")
+        raise HTTPException(status_code=500, detail=f"建立身分失敗：{str(e)}")
+    finally:
+        for pending_path in pending_paths:
+            pending_path.unlink(missing_ok=True)
+
+
+@router.get("/identities/{identity_id}")
+async def get_identity_api(identity_id: str):
+    """查詢身分 (臉部位置與融合照片數，不含特徵)"""
+    try:
+        record = await get_identity(identity_id, touch=False)
+        if not record:
+            raise HTTPException(status_code=404, detail="身分不存在或已過期")
+        return {"success": True, "identity": public_identity(record)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"查詢身分失敗：{e}")
+        raise HTTPException(status_code=500, detail=f"查詢身分失敗：{str(e)}")
+
+
+@router.delete("/identities/{identity_id}")
+async def delete_identity_api(identity_id: str):
+    """刪除身分與其正規化照片 (已提交的任務若尚未處理將會失敗)"""
+    try:
+        record = await delete_identity(identity_id)
+        if not record:
+            raise HTTPException(status_code=404, detail="身分不存在或已過期")
+        image_path = record.get("image_path")
+        if image_path:
+            Path(image_path).unlink(missing_ok=True)
+        return {"success": True, "message": "身分已刪除", "identity_id": identity_id}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"刪除身分失敗：{e}")
+        raise HTTPException(status_code=500, detail=f"刪除身分失敗：{str(e)}")
@@ -0,0 +1,289 @@
+"""
+影片 / GIF 換臉 API 路由
+"""
+from fastapi import APIRouter, File, UploadFile, Form, HTTPException
+import asyncio
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from core.config import VIDEO_CONFIG, QUEUE_CONFIG, PENDING_UPLOADS_DIR, ensure_directories
+from core.distributed_lock import RedisLock
+from core.task_queue import submit_task, start_task, finish_task
+from core.task_store import update_task_status
+from core.metrics import observe_stage, record_task_result, format_timings
+from api.face_swap import (
+    executor,
+    get_task_semaphore,
+    validate_file,
+    save_pending_file,
+    prescreen_source,
+    check_estimated_wait,
+)
+
+# 設定日誌
+logger = logging.getLogger(__name__)
+
+# 建立路由器
+router = APIRouter()
+
+
+def validate_video_file(file: UploadFile) -> None:
+    """驗證上傳的影片檔案"""
+    if file.size and file.size > VIDEO_CONFIG["MAX_FILE_SIZE"]:
+        raise HTTPException(
+            status_code=413,
+            detail=f"影片過大，最大允許 {VIDEO_CONFIG['MAX_FILE_SIZE'] // (1024*1024)}MB"
+        )
+    if file.content_type not in VIDEO_CONFIG["ALLOWED_MIME_TYPES"]:
+        raise HTTPException(
+            status_code=415,
+            detail=f"不支援的影片格式，請上傳 {', '.join(sorted(VIDEO_CONFIG['ALLOWED_MIME_TYPES']))} 格式的影片"
+        )
+    file_extension = Path(file.filename or "").suffix.lower()
+    if file_extension not in VIDEO_CONFIG["ALLOWED_EXTENSIONS"]:
+        raise HTTPException(
+            status_code=415,
+            detail=f"不支援的影片副檔名，請上傳 {', '.join(sorted(VIDEO_CONFIG['ALLOWED_EXTENSIONS']))} 格式的影片"
+        )
+
+
+def copy_upload(file: UploadFile, path: Path) -> int:
+    """將上傳的影片分段複製到 pending 暫存區 (不整個讀進記憶體)，超過大小上限時刪除並返回 413"""
+    size = 0
+    with open(path, "wb") as out:
+        while True:
+            block = file.file.read(1024 * 1024)
+            if not block:
+                break
+            size += len(block)
+            if size > VIDEO_CONFIG["MAX_FILE_SIZE"]:
+                out.close()
+                path.unlink(missing_ok=True)
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"影片過大，最大允許 {VIDEO_CONFIG['MAX_FILE_SIZE'] // (1024*1024)}MB"
+                )
+            out.write(block)
+    return size
+
+
+async def process_video_task(
+    task_id: str,
+    file_content: bytes,
+    video_path: str,
+    source_face_index: int = 0,
+    target_face_index: int = 0,
+    worker_id: Optional[str] = None,
+    enqueued_at: Optional[float] = None,
+    timings: Optional[dict] = None
+) -> bool:
+    """
+    背景任務：執行影片換臉
+
+    影片逐段處理，叢集 GPU 鎖只在每個區段換臉時持有 (解碼、追蹤、編碼都在鎖外)，
+    其他 worker 的圖片任務不會被整段影片卡住；每個區段完成後更新進度。
+
+    Returns:
+        bool: 任務是否成功完成
+    """
+    timings = {} if timings is None else timings
+
+    async with get_task_semaphore():
+        final_updates = None
+        failure_reason = None
+        try:
+            await start_task(task_id, {
+                "status": "processing",
+                "progress": 5,
+                "message": "正在偵測來源臉部...",
+                "queue_ahead": 0,
+                "worker_id": worker_id,
+            })
+
+            from core.face_processor import get_face_processor
+            from core.video_processor import swap_video
+            processor = get_face_processor()
+            loop = asyncio.get_event_loop()
+
+            original_path, source_image = await loop.run_in_executor(
+                executor, processor.load_source, file_content, task_id, timings
+            )
+
+            @contextmanager
+            def chunk_lock():
+                """在處理執行緒中持有叢集 GPU 鎖 (每個區段一次)"""
+                lock = RedisLock(owner=worker_id)
+                started = time.perf_counter()
+                asyncio.run_coroutine_threadsafe(lock.acquire(), loop).result()
+                observe_stage("lock_wait", time.perf_counter() - started, timings)
+                try:
+                    yield
+                finally:
+                    asyncio.run_coroutine_threadsafe(lock.release(), loop).result()
+
+            def report(processed: int, total: int) -> None:
+                """回報處理進度 (等待寫入完成，避免晚到的進度覆蓋最終狀態)"""
+                updates = {"frames_processed": processed, "frames_total": total or None}
+                if total:
+                    updates["progress"] = 10 + int(min(processed / total, 1.0) * 85)
+                    updates["message"] = f"AI 正在進行影片換臉 ({processed}/{total})..."
+                else:
+                    updates["message"] = f"AI 正在進行影片換臉 (已處理 {processed} 張影格)..."
+                asyncio.run_coroutine_threadsafe(update_task_status(task_id, updates), loop).result()
+
+            stats = await loop.run_in_executor(
+                executor,
+                lambda: swap_video(
+                    processor,
+                    source_image,
+                    video_path,
+                    source_face_index,
+                    target_face_index,
+                    timings,
+                    swap_guard=chunk_lock,
+                    progress=report,
+                )
+            )
+
+            final_updates = {
+                "status": "completed",
+                "progress": 100,
+                "message": "影片換臉完成",
+                "result_url": f"/results/{Path(stats['result_path']).name}",
+                "original_url": f"/uploads/{Path(original_path).name}",
+                "completed_at": datetime.now().isoformat(),
+                "queue_ahead": 0,
+                "frames_processed": stats["frames"],
+                "frames_total": stats["frames"],
+                "video": {key: value for key, value in stats.items() if key != "result_path"},
+            }
+            logger.info(f"任務 {task_id} 影片換臉完成：{final_updates['result_url']}")
+
+        except Exception as e:
+            final_updates = {
+                "status": "failed",
+                "progress": 0,
+                "message": f"影片換臉失敗：{str(e)}",
+                "error": str(e),
+                "failed_at": datetime.now().isoformat(),
+                "queue_ahead": 0
+            }
+            logger.error(f"任務 {task_id} 影片換臉失敗：{e}")
+            failure_reason = type(e).__name__
+
+        finally:
+            end_to_end = time.time() - enqueued_at if enqueued_at else None
+            if end_to_end is not None:
+                timings["total"] = end_to_end
+            final_updates["timings"] = format_timings(timings)
+            try:
+                await finish_task(task_id, final_updates)
+            except Exception as redis_error:
+                logger.warning(f"任務 {task_id} 寫入完成狀態失敗：{redis_error}")
+            record_task_result(final_updates["status"], end_to_end, failure_reason)
+
+    return final_updates["status"] == "completed"
+
+
+@router.post("/face-swap/video")
+async def swap_face_video(
+    file: UploadFile = File(..., description="使用者上傳的照片 (提供臉部)"),
+    video: UploadFile = File(..., description="要換臉的影片或 GIF"),
+    source_face_index: int = Form(0, description="來源臉部索引"),
+    target_face_index: int = Form(0, description="影片中要替換的臉部索引 (由左到右)")
+):
+    """
+    影片 / GIF 換臉任務提交
+
+    提交至後台處理佇列，返回任務 ID 供狀態查詢；結果為 mp4 (不含音軌)
+
+    - **file**: 使用者上傳的照片檔案
+    - **video**: 影片 (mp4/mov/webm/mkv/avi) 或 GIF
+    - **source_face_index**: 來源圖片中的臉部索引 (預設: 0)
+    - **target_face_index**: 影片中第一次出現臉部時要替換的臉部索引 (預設: 0)，之後持續追蹤同一張臉
+    """
+    task_id = str(uuid.uuid4())
+    source_path: Optional[Path] = None
+    video_path: Optional[Path] = None
+    try:
+        validate_file(file)
+        validate_video_file(video)
+        file_content = await file.read()
+        if not file_content:
+            raise HTTPException(status_code=400, detail="檔案內容為空")
+
+        # 預估等待過久時直接拒絕，不必寫入影片暫存檔
+        await check_estimated_wait()
+        # 照片沒有臉時不必寫入影片暫存檔再排隊 (影片任務只需預檢結果，不使用臉部提示)
+        _, warnings = await prescreen_source(file_content, file.filename or "source.jpg", source_face_index)
+
+        ensure_directories()
+        video_path = PENDING_UPLOADS_DIR / f"{task_id}-video{Path(video.filename).suffix.lower()}"
+        if await asyncio.to_thread(copy_upload, video, video_path) == 0:
+            raise HTTPException(status_code=400, detail="影片內容為空")
+        source_path = await save_pending_file(task_id, "source", file.filename or "source.jpg", file_content)
+
+        created_at = datetime.now().isoformat()
+        initial_status = {
+            "task_id": task_id,
+            "kind": "video",
+            "status": "pending",
+            "progress": 0,
+            "message": "任務已提交，等待處理...",
+            "template_id": None,
+            "created_at": created_at,
+            "queued_at": created_at,
+            "result_url": None,
+            "template_name": None,
+            "template_description": None,
+            "error": None
+        }
+        job_payload = {
+            "task_id": task_id,
+            "kind": "video",
+            "file_path": str(source_path),
+            "video_path": str(video_path),
+            "template_id": None,
+            "source_face_index": source_face_index,
+            "target_face_index": target_face_index
+        }
+
+        max_queue_size = QUEUE_CONFIG["MAX_QUEUE_SIZE"] if QUEUE_CONFIG["ENABLE_QUEUE_LIMIT"] else 0
+        accepted, _, queue_ahead = await submit_task(task_id, initial_status, job_payload, max_queue_size)
+        if not accepted:
+            raise HTTPException(
+                status_code=503,
+                detail={
+                    "error": "queue_full",
+                    "message": QUEUE_CONFIG["QUEUE_FULL_MESSAGE"],
+                    "current_queue_size": queue_ahead,
+                    "max_queue_size": max_queue_size
+                }
+            )
+        # 已入列，暫存檔交由 worker 清理
+        source_path = video_path = None
+
+        logger.info(f"已提交影片換臉任務：{task_id}")
+        return {
+            "success": True,
+            "message": "任務已提交，請使用任務 ID 查詢處理狀態",
+            "task_id": task_id,
+            "status": "pending",
+            "queue_ahead": queue_ahead,
+            "warnings": warnings
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"影片任務提交失敗：{e}")
+        raise HTTPException(status_code=500, detail=f"影片任務提交失敗：{str(e)}")
+    finally:
+        for pending_path in (source_path, video_path):
+            if pending_path:
+                pending_path.unlink(missing_ok=True)
@@ -1,4 +1,4 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 import uvicorn
@@ -9,9 +9,14 @@ from pathlib import Path
 # 導入 API 路由
 from api.face_swap import router as face_swap_router
 from api.templates import router as templates_router
+from api.admin import router as admin_router
+from api.batch import router as batch_router
+from api.video import router as video_router
+from api.identities import router as identities_router
+from api.fanout import router as fanout_router
 
 # 導入配置和清理模組
-from core.config import ensure_directories, FILE_CLEANUP_CONFIG, LOGGING_CONFIG
+from core.config import ensure_directories, FILE_CLEANUP_CONFIG, LOGGING_CONFIG, MONITORING_CONFIG
 from core.file_cleanup import get_cleanup_manager, cleanup_now, get_storage_stats
 
 # 設定日誌
@@ -53,6 +58,11 @@ app.mount("/models", StaticFiles(directory="models"), name="models")
 # 註冊 API 路由
 app.include_router(face_swap_router, prefix="/api", tags=["Face Swap"])
 app.include_router(templates_router, prefix="/api", tags=["Templates"])
+app.include_router(batch_router, prefix="/api", tags=["Batch"])
+app.include_router(video_router, prefix="/api", tags=["Video"])
+app.include_router(identities_router, prefix="/api", tags=["Identities"])
+app.include_router(fanout_router, prefix="/api", tags=["Fan-out"])
+app.include_router(admin_router, prefix="/api", tags=["Admin"])
 
 # 健康檢查端點
 @app.get("/api/health")
@@ -64,6 +74,21 @@ async def health_check():
         "version": "1.0.0"
     }
 
+# Prometheus 指標端點
+@app.get(MONITORING_CONFIG["METRICS_PATH"], include_in_schema=False)
+async def metrics():
+    """Prometheus 指標 (抓取時一併更新佇列相關 gauge)"""
+    from core.metrics import METRICS_ENABLED, generate_metrics, update_queue_gauges
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="指標功能未啟用")
+    try:
+        from core.autoscale import get_autoscale_signals
+        update_queue_gauges(await get_autoscale_signals())
+    except Exception as e:
+        logging.getLogger(__name__).warning(f"更新佇列指標失敗：{e}")
+    content, content_type = generate_metrics()
+    return Response(content=content, headers={"Content-Type": content_type})
+
 # 檔案清理相關端點
 @app.post("/api/cleanup")
 async def manual_cleanup():
@@ -102,12 +127,21 @@ async def root():
         "storage_stats": "/api/storage/stats"
     }
 
+# 孤兒任務回收背景任務
+recovery_task = None
+# 取樣分析開關訂閱
+profiler_task = None
+
 # 啟動事件
 @app.on_event("startup")
 async def startup_event():
     """應用啟動時執行"""
     # 確保必要的目錄存在
     ensure_directories()
+
+    # kill -USR1 <pid> 切換此行程的取樣分析
+    from core.profiler import register_profiler_signal
+    register_profiler_signal(asyncio.get_running_loop())
     
     # 檔案清理初始化
     cleanup_manager = get_cleanup_manager()
@@ -127,72 +161,24 @@ async def startup_event():
     
     # 測試 Redis 連接
     try:
-        from core.redis_client import (
-            test_redis_connection,
-            redis_client,
-            TASK_KEY_PREFIX,
-            QUEUE_SIZE_KEY,
-            GPU_LOCK_KEY,
-        )
+        from core.redis_client import test_redis_connection
         if await test_redis_connection():
             print("✅ Redis 連接成功")
 
-            # 清理孤兒任務（pending/processing 狀態的任務）
-            print("🧹 正在檢查孤兒任務...")
-            try:
-                import json
-                from datetime import datetime
-
-                # 掃描所有任務
-                task_keys = await redis_client.keys(f"{TASK_KEY_PREFIX}*")
-                orphan_count = 0
-
-                for task_key in task_keys:
-                    task_data = await redis_client.get(task_key)
-                    if task_data:
-                        task = json.loads(task_data)
-                        status = task.get("status")
-
-                        # 如果任務是 pending 或 processing，標記為失敗
-                        if status in ["pending", "processing"]:
-                            task["status"] = "failed"
-                            task["progress"] = 0
-                            task["message"] = "系統重啟，任務已取消"
-                            task["error"] = "Backend restarted while task was in progress"
-                            task["failed_at"] = datetime.now().isoformat()
-
-                            # 更新任務狀態
-                            await redis_client.setex(
-                                task_key,
-                                172800,  # 保持原有 TTL (48小時)
-                                json.dumps(task, ensure_ascii=False)
-                            )
-                            orphan_count += 1
-
-                if orphan_count > 0:
-                    print(f"✅ 已清理 {orphan_count} 個孤兒任務")
-                else:
-                    print("✅ 沒有發現孤兒任務")
-
-                # 清除 Redis 任務隊列（清除所有待處理的任務）
-                from core.redis_client import TASK_QUEUE_KEY
-                queue_length = await redis_client.llen(TASK_QUEUE_KEY)
-                if queue_length > 0:
-                    await redis_client.delete(TASK_QUEUE_KEY)
-                    print(f"✅ 已清除 {queue_length} 個待處理任務")
-                else:
-                    print("✅ 任務隊列為空")
-
-                # 重置佇列大小計數器
-                await redis_client.set(QUEUE_SIZE_KEY, 0)
-                print("✅ 佇列大小計數器已重置")
-
-                # 清理 GPU 鎖 (避免舊鎖阻塞新任務)
-                await redis_client.delete(GPU_LOCK_KEY)
-                print("✅ GPU 鎖已清理")
-
-            except Exception as e:
-                print(f"⚠️  清理孤兒任務失敗: {e}")
+            # 定期回收孤兒任務：只處理心跳逾時 worker 的任務，不清空佇列也不動 GPU 鎖
+            # (每個行程都會啟動，但以 leader 鎖確保每個週期只有一個行程實際執行)
+            from core.task_recovery import run_recovery_loop
+            global recovery_task
+            recovery_task = asyncio.create_task(run_recovery_loop())
+            print("🧹 孤兒任務回收已啟動")
+
+            # 取樣分析開關 (POST /api/admin/profile 經 Pub/Sub 通知所有行程)
+            import socket
+            from core.profiler import run_profiler_listener
+            global profiler_task
+            profiler_task = asyncio.create_task(
+                run_profiler_listener(SERVICE_ROLE, f"{SERVICE_ROLE}-{socket.gethostname()}-{os.getpid()}")
+            )
         else:
             print("⚠️  Redis 連接失敗,部分功能可能無法使用")
     except Exception as e:
@@ -229,6 +215,24 @@ async def shutdown_event():
     # 停止定期清理任務
     cleanup_manager = get_cleanup_manager()
     cleanup_manager.stop_periodic_cleanup()
+
+    # 停止孤兒任務回收
+    if recovery_task is not None:
+        recovery_task.cancel()
+
+    # 停止取樣分析 (若正在取樣則寫出結果)
+    if profiler_task is not None:
+        profiler_task.cancel()
+    from core.profiler import get_profiler
+    get_profiler().stop()
+
+    # 關閉任務事件訂閱
+    from core.task_events import get_task_event_hub
+    await get_task_event_hub().close()
+
+    # 多行程指標：移除本行程的 live gauge
+    from core.metrics import mark_process_dead
+    mark_process_dead()
     
     print("👋 AI 頭像工作室 API 已關閉")
 
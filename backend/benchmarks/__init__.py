@@ -0,0 +1,6 @@
+"""
+效能基準測試
+
+在 backend 目錄下以模組方式執行，例如：
+    python -m benchmarks.face_processing --save-baseline cpu
+"""
@@ -0,0 +1,437 @@
+"""
+臉部處理熱路徑基準測試
+
+以 CPU 執行 FaceProcessor 的 detect_faces、detect_source_faces、swap_faces、process_image_file 與結果編碼儲存，
+輸入為內建模板與合成圖片 (多種解析度 × 臉數)，輸出吞吐量、p50/p95/p99 延遲，
+以及各案例執行期間的 RSS 峰值與增量 (背景執行緒取樣，不受前面案例的峰值影響)。
+結果可存成 JSON 基準檔，之後以 --compare 比對，延遲超過門檻即以非 0 結束碼返回。
+
+合成圖片是把模板中偵測到的臉部裁切後排列到雜訊背景上，確保偵測模型能找到臉，
+且同一組參數 (--seed) 每次產生的圖片相同。
+
+使用方式 (在 backend 目錄下)：
+    python -m benchmarks.face_processing --save-baseline cpu
+    python -m benchmarks.face_processing --compare cpu --threshold 0.15
+    python -m benchmarks.face_processing --cases detect --resolutions 640x480,1920x1080
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+BASELINES_DIR = Path(__file__).resolve().parent / "baselines"
+CASE_GROUPS = ("detect", "swap", "process", "save")
+
+# 換臉來源使用的合成圖片解析度
+SOURCE_RESOLUTION = (1280, 720)
+# 延遲增加量小於此值 (毫秒) 時視為量測雜訊，不判定為退化
+MIN_REGRESSION_MS = 1.0
+
+
+def _parse_resolutions(value: str) -> List[Tuple[int, int]]:
+    resolutions = []
+    for item in value.split(","):
+        width, height = item.lower().split("x")
+        resolutions.append((int(width), int(height)))
+    return resolutions
+
+
+def _parse_ints(value: str) -> List[int]:
+    return [int(item) for item in value.split(",")]
+
+
+def _peak_rss_mb() -> float:
+    """目前行程整個生命週期的峰值 RSS (MB)"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux 單位為 KB，macOS 為 bytes
+        return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1)
+    except ImportError:
+        import psutil
+        memory = psutil.Process().memory_info()
+        return round(getattr(memory, "peak_wset", memory.rss) / (1024 * 1024), 1)
+
+
+class RssSampler:
+    """
+    在背景執行緒定期取樣目前行程的 RSS，記錄區塊執行期間的最大值
+
+    ru_maxrss 是整個行程生命週期的峰值，無法區分各案例；這裡以進入區塊時的 RSS 為基準，
+    取樣間隔內的短暫尖峰可能漏測。
+    """
+
+    def __init__(self, interval: float = 0.005):
+        import psutil
+
+        self.interval = interval
+        self._process = psutil.Process()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.start_rss = 0
+        self.peak_rss = 0
+
+    def _rss(self) -> int:
+        return self._process.memory_info().rss
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.peak_rss = max(self.peak_rss, self._rss())
+
+    def __enter__(self) -> "RssSampler":
+        self.start_rss = self.peak_rss = self._rss()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.peak_rss = max(self.peak_rss, self._rss())
+
+    @property
+    def peak_mb(self) -> float:
+        return round(self.peak_rss / (1024 * 1024), 1)
+
+    @property
+    def growth_mb(self) -> float:
+        return round((self.peak_rss - self.start_rss) / (1024 * 1024), 1)
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).resolve().parent,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+    except Exception:
+        return None
+
+
+def _face_crops(processor, images: Dict[str, np.ndarray]) -> List[np.ndarray]:
+    """從模板中裁切臉部 (外擴為正方形)，作為合成圖片的素材"""
+    crops = []
+    for image in images.values():
+        height, width = image.shape[:2]
+        for face in processor.detect_faces(image):
+            x1, y1, x2, y2 = face.bbox.astype(float)
+            center_x, center_y = (x1 + x2) / 2, (y1 + y2) / 2
+            half = max(x2 - x1, y2 - y1) * 0.9
+            left, top = int(max(center_x - half, 0)), int(max(center_y - half, 0))
+            right, bottom = int(min(center_x + half, width)), int(min(center_y + half, height))
+            if right - left >= 32 and bottom - top >= 32:
+                crops.append(image[top:bottom, left:right].copy())
+    return crops
+
+
+def synthetic_image(
+    crops: List[np.ndarray],
+    width: int,
+    height: int,
+    face_count: int,
+    rng: np.random.Generator,
+) -> np.ndarray:
+    """在雜訊背景上以網格排列 face_count 張臉"""
+    import cv2
+
+    noise = rng.integers(60, 200, size=(max(height // 8, 1), max(width // 8, 1), 3), dtype=np.uint8)
+    canvas = cv2.resize(noise, (width, height), interpolation=cv2.INTER_CUBIC)
+
+    columns = math.ceil(math.sqrt(face_count))
+    rows = math.ceil(face_count / columns)
+    cell_width, cell_height = width // columns, height // rows
+    size = int(min(cell_width, cell_height) * 0.8)
+    for index in range(face_count):
+        crop = cv2.resize(crops[index % len(crops)], (size, size), interpolation=cv2.INTER_AREA)
+        row, column = divmod(index, columns)
+        left = column * cell_width + (cell_width - size) // 2
+        top = row * cell_height + (cell_height - size) // 2
+        canvas[top:top + size, left:left + size] = crop
+    return canvas
+
+
+def run_case(
+    name: str,
+    func: Callable[[], Optional[Dict[str, Any]]],
+    iterations: int,
+    warmup: int,
+) -> Dict[str, Any]:
+    """
+    重複執行 func 並統計延遲
+
+    func 可返回 dict，最後一次的內容會併入結果 (例如偵測到的臉數)。
+    RSS 只在測量期間取樣 (暖機之後)，peak_rss_mb 為本案例執行期間的峰值，
+    rss_growth_mb 為相對於案例開始時的增量。
+    """
+    for _ in range(warmup):
+        func()
+
+    latencies = []
+    info: Optional[Dict[str, Any]] = None
+    with RssSampler() as rss:
+        started = time.perf_counter()
+        for _ in range(iterations):
+            call_started = time.perf_counter()
+            info = func()
+            latencies.append(time.perf_counter() - call_started)
+        elapsed = time.perf_counter() - started
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    result = {
+        "name": name,
+        "iterations": iterations,
+        "throughput_per_sec": round(iterations / elapsed, 3) if elapsed else None,
+        "mean_ms": round(float(np.mean(latencies)) * 1000, 2),
+        "p50_ms": round(float(p50), 2),
+        "p95_ms": round(float(p95), 2),
+        "p99_ms": round(float(p99), 2),
+        "max_ms": round(max(latencies) * 1000, 2),
+        "peak_rss_mb": rss.peak_mb,
+        "rss_growth_mb": rss.growth_mb,
+    }
+    if info:
+        result.update(info)
+    return result
+
+
+def _remove_outputs(process_result: Dict[str, Any]) -> None:
+    for key in ("result_path", "original_path"):
+        path = process_result.get(key)
+        if path:
+            Path(path).unlink(missing_ok=True)
+
+
+def build_cases(args, processor) -> List[Tuple[str, Callable[[], Optional[Dict[str, Any]]]]]:
+    """依參數建立 (名稱, 待測函式) 列表"""
+    import cv2
+    from core.config import TEMPLATE_CONFIG, get_template_path
+
+    template_paths = {}
+    for template_id in TEMPLATE_CONFIG["TEMPLATES"]:
+        path = get_template_path(template_id)
+        if path.exists() and (not args.templates or template_id in args.templates):
+            template_paths[template_id] = path
+    template_images = {template_id: cv2.imread(str(path)) for template_id, path in template_paths.items()}
+    template_images = {template_id: image for template_id, image in template_images.items() if image is not None}
+    if not template_images:
+        raise SystemExit("找不到可用的模板圖片")
+
+    crops = _face_crops(processor, template_images)
+    if not crops:
+        raise SystemExit("模板中沒有偵測到臉部，無法產生合成圖片")
+
+    rng = np.random.default_rng(args.seed)
+    synthetic = {
+        (width, height, count): synthetic_image(crops, width, height, count, rng)
+        for width, height in args.resolutions
+        for count in args.face_counts
+    }
+    source_image = synthetic_image(crops, *SOURCE_RESOLUTION, 1, rng)
+    _, encoded_source = cv2.imencode(".jpg", source_image)
+    source_bytes = encoded_source.tobytes()
+
+    def detect(image):
+        return lambda: {"faces": len(processor.detect_faces(image))}
+
+    def detect_source(image):
+        return lambda: {"faces": len(processor.detect_source_faces(image))}
+
+    def swap(target):
+        def func():
+            processor.swap_faces(source_image, target)
+        return func
+
+    def process(template_path):
+        def func():
+            _remove_outputs(processor.process_image_file(source_bytes, template_path, task_id="benchmark"))
+        return func
+
+    def save(image):
+        return lambda: Path(processor._save_result(image)).unlink(missing_ok=True)
+
+    cases = []
+    if "detect" in args.cases:
+        for template_id, image in template_images.items():
+            cases.append((f"detect/template:{template_id}", detect(image)))
+        for (width, height, count), image in synthetic.items():
+            cases.append((f"detect/synthetic:{width}x{height}:{count}faces", detect(image)))
+            cases.append((f"detect_source/synthetic:{width}x{height}:{count}faces", detect_source(image)))
+    if "swap" in args.cases:
+        for template_id, image in template_images.items():
+            cases.append((f"swap/template:{template_id}", swap(image)))
+        for width, height in args.resolutions:
+            cases.append((f"swap/synthetic:{width}x{height}", swap(synthetic[(width, height, args.face_counts[0])])))
+    if "process" in args.cases:
+        for template_id, path in template_paths.items():
+            if template_id in template_images:
+                cases.append((f"process/template:{template_id}", process(path)))
+    if "save" in args.cases:
+        for width, height in args.resolutions:
+            cases.append((f"save/synthetic:{width}x{height}", save(synthetic[(width, height, args.face_counts[0])])))
+    return cases
+
+
+def compare_results(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """
+    比對基準檔，列出 p50 或 p95 延遲超過 (1 + threshold) 倍的案例
+
+    Returns:
+        List[退化描述]
+    """
+    baseline_cases = {case["name"]: case for case in baseline["results"]}
+    regressions = []
+    print(f"\n與基準比較 (commit {baseline['meta'].get('git_commit')}, 門檻 +{threshold:.0%})")
+    for case in current["results"]:
+        previous = baseline_cases.get(case["name"])
+        if previous is None:
+            print(f"  {case['name']:<48} 新增案例")
+            continue
+        changes = []
+        for metric in ("p50_ms", "p95_ms"):
+            if not previous[metric]:
+                continue
+            ratio = case[metric] / previous[metric]
+            changes.append(f"{metric} {ratio - 1:+.1%}")
+            if ratio > 1 + threshold and case[metric] - previous[metric] >= MIN_REGRESSION_MS:
+                regressions.append(f"{case['name']} {metric}: {previous[metric]} → {case[metric]} ms")
+        if "rss_growth_mb" in previous and "rss_growth_mb" in case:
+            # 記憶體只列出變化供參考 (取樣結果受配置器與 GC 影響，不判定退化)
+            changes.append(f"+RSS {case['rss_growth_mb'] - previous['rss_growth_mb']:+.1f} MB")
+        print(f"  {case['name']:<48} {', '.join(changes)}")
+    return regressions
+
+
+def _resolve_baseline(value: str) -> Path:
+    path = Path(value)
+    return path if path.suffix == ".json" else BASELINES_DIR / f"{value}.json"
+
+
+def _print_table(results: List[Dict[str, Any]]) -> None:
+    print(
+        f"\n{'案例':<48} {'次數':>5} {'吞吐/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+        f"{'RSS MB':>8} {'+RSS MB':>8}"
+    )
+    for case in results:
+        print(
+            f"{case['name']:<48} {case['iterations']:>5} {case['throughput_per_sec']:>8} "
+            f"{case['p50_ms']:>9} {case['p95_ms']:>9} {case['p99_ms']:>9} "
+            f"{case['peak_rss_mb']:>8} {case.get('rss_growth_mb', '-'):>8}"
+        )
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="臉部處理熱路徑基準測試")
+    parser.add_argument("--iterations", type=int, default=10, help="每個案例的測量次數")
+    parser.add_argument("--warmup", type=int, default=2, help="每個案例的暖機次數 (不計入統計)")
+    parser.add_argument("--cases", default=",".join(CASE_GROUPS), help=f"要執行的案例群組：{','.join(CASE_GROUPS)}")
+    parser.add_argument("--templates", default="", help="只測指定的模板 ID (逗號分隔，預設全部)")
+    parser.add_argument("--resolutions", default="640x480,1280x720,1920x1080", help="合成圖片解析度")
+    parser.add_argument("--face-counts", default="1,2,4", help="合成圖片的臉數")
+    parser.add_argument("--seed", type=int, default=0, help="合成圖片的亂數種子")
+    parser.add_argument("--gpu", action="store_true", help="允許使用 GPU (預設強制 CPU)")
+    parser.add_argument("--output", help="結果 JSON 輸出路徑")
+    parser.add_argument("--save-baseline", metavar="NAME", help=f"存為基準檔 {BASELINES_DIR.name}/NAME.json")
+    parser.add_argument("--compare", metavar="NAME_OR_PATH", help="與基準檔比較")
+    parser.add_argument("--threshold", type=float, default=0.15, help="判定退化的延遲增幅 (0.15 = 15%%)")
+    parser.add_argument("--verbose", action="store_true", help="顯示處理器 INFO 日誌")
+    args = parser.parse_args(argv)
+
+    args.cases = [case for case in args.cases.split(",") if case]
+    unknown = set(args.cases) - set(CASE_GROUPS)
+    if unknown:
+        parser.error(f"未知的案例群組：{', '.join(sorted(unknown))}")
+    args.templates = [template for template in args.templates.split(",") if template]
+    args.resolutions = _parse_resolutions(args.resolutions)
+    args.face_counts = _parse_ints(args.face_counts)
+    return args
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+    # 必須在匯入 core 前設定：強制 CPU，並關閉 Prometheus 指標避免影響量測
+    if not args.gpu:
+        os.environ["ENABLE_GPU"] = "false"
+    os.environ.setdefault("ENABLE_METRICS", "false")
+
+    from core.face_processor import get_face_processor
+    import insightface
+    import onnxruntime
+
+    load_started = time.perf_counter()
+    processor = get_face_processor()
+    load_seconds = time.perf_counter() - load_started
+
+    cases = build_cases(args, processor)
+    results = []
+    for name, func in cases:
+        result = run_case(name, func, args.iterations, args.warmup)
+        results.append(result)
+        print(f"{name:<48} p50 {result['p50_ms']:>9} ms  p95 {result['p95_ms']:>9} ms", flush=True)
+    _print_table(results)
+
+    report = {
+        "meta": {
+            "created_at": datetime.now().isoformat(),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "onnxruntime": onnxruntime.__version__,
+            "insightface": insightface.__version__,
+            "provider": getattr(processor, "provider", None),
+            "gpu_available": getattr(processor, "gpu_available", False),
+            "det_size": getattr(processor.face_app, "det_size", None),
+            "model_load_seconds": round(load_seconds, 2),
+            "peak_rss_mb": _peak_rss_mb(),
+            "args": {
+                "iterations": args.iterations,
+                "warmup": args.warmup,
+                "cases": args.cases,
+                "templates": args.templates,
+                "resolutions": [f"{width}x{height}" for width, height in args.resolutions],
+                "face_counts": args.face_counts,
+                "seed": args.seed,
+            },
+        },
+        "results": results,
+    }
+
+    outputs = []
+    if args.output:
+        outputs.append(Path(args.output))
+    if args.save_baseline:
+        outputs.append(_resolve_baseline(args.save_baseline))
+    for path in outputs:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"\n結果已儲存：{path}")
+
+    if args.compare:
+        baseline = json.loads(_resolve_baseline(args.compare).read_text(encoding="utf-8"))
+        regressions = compare_results(report, baseline, args.threshold)
+        if regressions:
+            print("\n偵測到效能退化：")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print("\n未偵測到效能退化")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,332 @@
+"""
+端到端壓力測試
+
+模擬前端 (frontend/assets/js/main.js) 的使用者行為，對 API + Redis + worker 整體施壓：
+- 開啟頁面：健康檢查、瀏覽模板列表與預覽圖
+- 提交換臉 (POST /api/face-swap)，部分使用者重複上傳同一張照片
+- 以前端相同的間隔 (POLL_INTERVAL 3 秒) 輪詢任務狀態直到完成、失敗或逾時 (10 分鐘)
+
+到達模式為泊松分布的背景流量加上週期性的突發。
+報告提交延遲、排隊等待、完成延遲，以及錯誤率與 503 (佇列已滿 / 等待過久) 比例。
+
+需要 httpx (pip install httpx)。建議以本機 Redis 與 CPU worker 執行 (見 README)：
+    python -m benchmarks.load --url http://localhost:3001 --duration 120 --rate 0.5 \\
+        --bursts 3 --burst-size 30 --output load.json
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+# 與 frontend/config.js 的 API_CONFIG.REQUEST 一致
+POLL_INTERVAL = 3.0
+MAX_POLL_TIME = 600.0
+SUBMIT_TIMEOUT = 120.0
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp"}
+DEFAULT_IMAGES_DIR = Path(__file__).resolve().parent.parent / "models" / "templates"
+
+
+class LoadStats:
+    """收集每個模擬使用者的結果"""
+
+    def __init__(self):
+        self.sessions: List[Dict[str, Any]] = []
+        self.browse_latencies: List[float] = []
+        self.poll_requests = 0
+        self.poll_errors = 0
+
+    def add(self, session: Dict[str, Any]) -> None:
+        self.sessions.append(session)
+
+    def summary(self, elapsed: float) -> Dict[str, Any]:
+        def outcome_count(outcome: str) -> int:
+            return sum(1 for session in self.sessions if session["outcome"] == outcome)
+
+        submitted = len(self.sessions)
+        rejected = outcome_count("rejected")
+        errors = outcome_count("submit_error")
+        completed = outcome_count("completed")
+
+        def collect(key: str) -> List[float]:
+            return [session[key] for session in self.sessions if session.get(key) is not None]
+
+        return {
+            "elapsed_seconds": round(elapsed, 1),
+            "submitted": submitted,
+            "accepted": submitted - rejected - errors,
+            "rejected_503": rejected,
+            "submit_errors": errors,
+            "completed": completed,
+            "failed": outcome_count("failed"),
+            "timed_out": outcome_count("timeout"),
+            "poll_errors": outcome_count("poll_error"),
+            "rate_503": round(rejected / submitted, 4) if submitted else 0.0,
+            "error_rate": round(
+                (errors + outcome_count("failed") + outcome_count("timeout") + outcome_count("poll_error")) / submitted, 4
+            )
+            if submitted else 0.0,
+            "completed_per_sec": round(completed / elapsed, 3) if elapsed else None,
+            "rejections": _count_by(self.sessions, "rejection"),
+            "submit_latency": summarize(collect("submit_seconds")),
+            "queue_wait": summarize(collect("queue_wait_seconds")),
+            "completion_latency": summarize(collect("completion_seconds")),
+            "server_total": summarize(collect("server_total_seconds")),
+            "browse_latency": summarize(self.browse_latencies),
+            "status_requests": self.poll_requests,
+            "status_request_errors": self.poll_errors,
+        }
+
+
+def _count_by(sessions: List[Dict[str, Any]], key: str) -> Dict[str, int]:
+    counts: Dict[str, int] = {}
+    for session in sessions:
+        value = session.get(key)
+        if value:
+            counts[value] = counts.get(value, 0) + 1
+    return counts
+
+
+def summarize(values: List[float]) -> Optional[Dict[str, float]]:
+    """p50/p95/p99/max (秒)"""
+    if not values:
+        return None
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        "count": len(values),
+        "p50": round(float(p50), 3),
+        "p95": round(float(p95), 3),
+        "p99": round(float(p99), 3),
+        "max": round(max(values), 3),
+    }
+
+
+def build_schedule(args, rng: random.Random) -> List[float]:
+    """產生到達時間 (相對開始的秒數)：泊松背景流量 + 平均分布在測試期間的突發"""
+    arrivals = []
+    if args.rate > 0:
+        offset = rng.expovariate(args.rate)
+        while offset < args.duration:
+            arrivals.append(offset)
+            offset += rng.expovariate(args.rate)
+    for burst in range(args.bursts):
+        start = args.duration * (burst + 0.5) / args.bursts
+        arrivals.extend(start + rng.uniform(0, args.burst_spread) for _ in range(args.burst_size))
+    return sorted(arrivals)
+
+
+def load_images(directory: Path) -> List[bytes]:
+    images = [path.read_bytes() for path in sorted(directory.iterdir()) if path.suffix.lower() in IMAGE_SUFFIXES]
+    if not images:
+        raise SystemExit(f"{directory} 中沒有可上傳的圖片")
+    return images
+
+
+def _rejection_reason(response) -> str:
+    try:
+        detail = response.json().get("detail")
+    except ValueError:
+        return "unknown"
+    if isinstance(detail, dict):
+        return detail.get("error", "unknown")
+    return "unknown"
+
+
+async def browse_templates(client, stats: LoadStats, rng: random.Random, template_ids: List[str]) -> None:
+    """開啟頁面：健康檢查、模板列表與一張預覽圖"""
+    paths = ["/api/health", "/api/templates"]
+    if template_ids:
+        paths.append(f"/api/templates/{rng.choice(template_ids)}/preview")
+    for path in paths:
+        started = time.perf_counter()
+        try:
+            await client.get(path)
+        except Exception:
+            continue
+        stats.browse_latencies.append(time.perf_counter() - started)
+
+
+async def wait_for_result(client, stats: LoadStats, task_id: str, session: Dict[str, Any], submitted_at: float) -> None:
+    """以前端相同的間隔輪詢任務狀態"""
+    while time.perf_counter() - submitted_at < MAX_POLL_TIME:
+        await asyncio.sleep(POLL_INTERVAL)
+        stats.poll_requests += 1
+        try:
+            response = await client.get(f"/api/face-swap/status/{task_id}")
+            response.raise_for_status()
+            status = response.json()["task_status"]
+        except Exception as e:
+            stats.poll_errors += 1
+            session["outcome"] = "poll_error"
+            session["error"] = str(e)
+            return
+
+        if status.get("status") == "processing" and session.get("started_seconds") is None:
+            session["started_seconds"] = time.perf_counter() - submitted_at
+        if status.get("status") in ("completed", "failed"):
+            session["outcome"] = status["status"]
+            session["completion_seconds"] = time.perf_counter() - submitted_at
+            timings = status.get("timings") or {}
+            # 伺服器端的排隊時間較準確；舊版沒有 timings 時以首次看到 processing 的時間近似
+            session["queue_wait_seconds"] = timings.get("queue_wait", session.get("started_seconds"))
+            session["server_total_seconds"] = timings.get("total")
+            if status["status"] == "failed":
+                session["error"] = status.get("error")
+            return
+    session["outcome"] = "timeout"
+
+
+async def run_session(
+    client,
+    stats: LoadStats,
+    rng: random.Random,
+    args,
+    images: List[bytes],
+    history: List[bytes],
+    template_ids: List[str],
+) -> None:
+    """單一使用者：瀏覽模板 → 上傳 → 輪詢結果"""
+    session: Dict[str, Any] = {"outcome": None}
+    await browse_templates(client, stats, rng, template_ids)
+
+    # 重複上傳：沿用先前使用者上傳過的照片
+    if history and rng.random() < args.repeat_ratio:
+        image = rng.choice(history)
+        session["repeat"] = True
+    else:
+        image = rng.choice(images)
+        history.append(image)
+
+    data = {"template_id": rng.choice(template_ids), "source_face_index": "0", "target_face_index": "0"}
+    submitted_at = time.perf_counter()
+    try:
+        response = await client.post(
+            "/api/face-swap",
+            files={"file": ("upload.jpg", image, "image/jpeg")},
+            data=data,
+            timeout=SUBMIT_TIMEOUT,
+        )
+    except Exception as e:
+        session.update(outcome="submit_error", error=str(e))
+        stats.add(session)
+        return
+    session["submit_seconds"] = time.perf_counter() - submitted_at
+
+    if response.status_code == 503:
+        session.update(outcome="rejected", rejection=_rejection_reason(response))
+    elif response.status_code != 200:
+        session.update(outcome="submit_error", error=f"HTTP {response.status_code}")
+    else:
+        await wait_for_result(client, stats, response.json()["task_id"], session, submitted_at)
+    stats.add(session)
+
+
+async def fetch_template_ids(client) -> List[str]:
+    response = await client.get("/api/templates")
+    response.raise_for_status()
+    return [template_id for template_id, info in response.json()["templates"].items() if info["available"]]
+
+
+def _print_summary(summary: Dict[str, Any]) -> None:
+    print(
+        f"\n提交 {summary['submitted']}，接受 {summary['accepted']}，503 {summary['rejected_503']} "
+        f"({summary['rate_503']:.1%})，提交錯誤 {summary['submit_errors']}"
+    )
+    print(
+        f"完成 {summary['completed']}，失敗 {summary['failed']}，逾時 {summary['timed_out']}，"
+        f"輪詢錯誤 {summary['poll_errors']}，錯誤率 {summary['error_rate']:.1%}"
+    )
+    if summary["rejections"]:
+        print(f"503 原因：{summary['rejections']}")
+    print(f"\n{'指標 (秒)':<20} {'筆數':>6} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+    for key, label in (
+        ("submit_latency", "提交延遲"),
+        ("queue_wait", "排隊等待"),
+        ("completion_latency", "完成延遲"),
+        ("server_total", "伺服器總耗時"),
+        ("browse_latency", "瀏覽請求"),
+    ):
+        values = summary[key]
+        if values:
+            print(f"{label:<20} {values['count']:>6} {values['p50']:>8} {values['p95']:>8} {values['p99']:>8} {values['max']:>8}")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="換臉 API 端到端壓力測試")
+    parser.add_argument("--url", default="http://localhost:3001", help="API 位址 (經 nginx 時為 http://localhost:8882)")
+    parser.add_argument("--duration", type=float, default=60.0, help="產生請求的期間 (秒)")
+    parser.add_argument("--rate", type=float, default=0.5, help="背景流量每秒到達數 (泊松分布)")
+    parser.add_argument("--bursts", type=int, default=1, help="突發次數")
+    parser.add_argument("--burst-size", type=int, default=20, help="每次突發的使用者數")
+    parser.add_argument("--burst-spread", type=float, default=2.0, help="單次突發的到達分布時間 (秒)")
+    parser.add_argument("--repeat-ratio", type=float, default=0.2, help="重複上傳先前照片的比例")
+    parser.add_argument("--images", type=Path, default=DEFAULT_IMAGES_DIR, help="上傳用照片目錄")
+    parser.add_argument("--seed", type=int, default=0, help="亂數種子")
+    parser.add_argument("--max-connections", type=int, default=1000, help="HTTP 連線上限")
+    parser.add_argument("--output", type=Path, help="結果 JSON 輸出路徑")
+    return parser.parse_args(argv)
+
+
+async def run(args) -> Dict[str, Any]:
+    try:
+        import httpx
+    except ImportError:
+        raise SystemExit("壓力測試需要 httpx：pip install httpx")
+
+    rng = random.Random(args.seed)
+    images = load_images(args.images)
+    schedule = build_schedule(args, rng)
+    stats = LoadStats()
+    history: List[bytes] = []
+
+    limits = httpx.Limits(max_connections=args.max_connections, max_keepalive_connections=args.max_connections)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=30.0) as client:
+        template_ids = await fetch_template_ids(client)
+        if not template_ids:
+            raise SystemExit("伺服器沒有可用的模板")
+        print(f"共 {len(schedule)} 個使用者，{len(template_ids)} 個模板，{len(images)} 張照片", flush=True)
+
+        started = time.perf_counter()
+
+        async def arrive(offset: float) -> None:
+            await asyncio.sleep(max(offset - (time.perf_counter() - started), 0))
+            await run_session(client, stats, rng, args, images, history, template_ids)
+
+        await asyncio.gather(*(arrive(offset) for offset in schedule))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "meta": {
+            "created_at": datetime.now().isoformat(),
+            "url": args.url,
+            "duration": args.duration,
+            "rate": args.rate,
+            "bursts": args.bursts,
+            "burst_size": args.burst_size,
+            "burst_spread": args.burst_spread,
+            "repeat_ratio": args.repeat_ratio,
+            "seed": args.seed,
+        },
+        "summary": stats.summary(elapsed),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    report = asyncio.run(run(args))
+    _print_summary(report["summary"])
+    if args.output:
+        args.output.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"\n結果已儲存：{args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
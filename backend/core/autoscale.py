@@ -0,0 +1,126 @@
+"""
+擴縮容訊號
+
+由佇列與 worker 心跳計算外部 autoscaler (KEDA metrics-api 或簡單腳本) 所需的指標：
+- 各通道等待中的工作數與最舊工作的等待時間
+- 多個滑動視窗的到達率與完成率
+- 在目標延遲與使用率下所需的 worker 數量
+
+所需 worker 數取以下兩者的較大值 (μ 為單一 worker 的服務速率)：
+- 穩態：到達率 / (μ × 目標使用率)
+- 清空積壓：(積壓量 / 目標延遲 + 到達率) / μ
+"""
+import json
+import math
+import time
+from typing import Optional, Dict, Any
+
+from core.config import QUEUE_CONFIG
+from core.redis_client import (
+    redis_client,
+    QUEUE_ORDER_KEY,
+    QUEUE_ARRIVALS_KEY_PREFIX,
+    QUEUE_COMPLETIONS_KEY_PREFIX,
+)
+from core.task_queue import QUEUE_LANES, get_windowed_rates
+from core.worker_registry import get_live_workers, summarize_capacity
+
+
+def _job_age(payload: Optional[str], now: float) -> Optional[float]:
+    """由佇列中的工作內容計算已等待秒數"""
+    if not payload:
+        return None
+    try:
+        enqueued_at = json.loads(payload).get("enqueued_at")
+    except (TypeError, AttributeError, json.JSONDecodeError):
+        return None
+    if not enqueued_at:
+        return None
+    return round(max(now - float(enqueued_at), 0.0), 1)
+
+
+def workers_needed(
+    arrival_rate: float,
+    backlog: int,
+    per_worker_rate: Optional[float],
+    target_latency: float,
+    target_utilization: float,
+) -> Optional[int]:
+    """在目標延遲與使用率下需要的 worker 數 (無法估計服務速率時返回 None)"""
+    if not per_worker_rate:
+        return None
+    steady = arrival_rate / (per_worker_rate * target_utilization)
+    drain = (backlog / target_latency + arrival_rate) / per_worker_rate
+    return math.ceil(max(steady, drain))
+
+
+async def get_autoscale_signals(target_latency: Optional[float] = None) -> Dict[str, Any]:
+    """
+    計算擴縮容訊號
+
+    Args:
+        target_latency: 目標等待時間 (秒)，None 表示使用設定值
+    """
+    target_latency = target_latency or QUEUE_CONFIG["AUTOSCALE_TARGET_LATENCY"]
+    target_utilization = QUEUE_CONFIG["AUTOSCALE_TARGET_UTILIZATION"]
+    windows = QUEUE_CONFIG["RATE_WINDOWS"]
+    now = time.time()
+
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for queue_key in QUEUE_LANES.values():
+            pipe.llen(queue_key)
+            pipe.lindex(queue_key, 0)
+        pipe.zcard(QUEUE_ORDER_KEY)
+        results = await pipe.execute()
+
+    lanes = {}
+    for index, lane in enumerate(QUEUE_LANES):
+        depth, head = results[index * 2], results[index * 2 + 1]
+        lanes[lane] = {
+            "waiting": int(depth),
+            "oldest_wait_seconds": _job_age(head, now),
+        }
+    outstanding = int(results[-1])
+    waiting = sum(lane["waiting"] for lane in lanes.values())
+
+    arrival_rates = await get_windowed_rates(QUEUE_ARRIVALS_KEY_PREFIX, windows)
+    completion_rates = await get_windowed_rates(QUEUE_COMPLETIONS_KEY_PREFIX, windows)
+    capacity = summarize_capacity(await get_live_workers())
+
+    # 單一 worker 的服務速率：優先使用心跳回報的平均處理時間，否則以最近完成率平均
+    per_worker_rate = None
+    if capacity["avg_job_seconds"]:
+        per_worker_rate = 1.0 / capacity["avg_job_seconds"]
+    elif capacity["live_workers"]:
+        observed = max(completion_rates.values())
+        per_worker_rate = observed / capacity["live_workers"] if observed else None
+
+    # 取各視窗到達率的最大值：短視窗反應突發流量，長視窗避免短暫空檔就縮容
+    arrival_rate = max(arrival_rates.values())
+    desired = workers_needed(
+        arrival_rate,
+        outstanding,
+        per_worker_rate,
+        target_latency,
+        target_utilization,
+    )
+    if desired is None:
+        # 尚無服務速率資料：有工作就至少保留一個 worker，完全閒置時可縮到 0
+        desired = max(capacity["live_workers"], 1) if (outstanding or arrival_rate) else 0
+
+    oldest_ages = [lane["oldest_wait_seconds"] for lane in lanes.values() if lane["oldest_wait_seconds"] is not None]
+    return {
+        "lanes": lanes,
+        "waiting": waiting,
+        "in_flight": max(outstanding - waiting, 0),
+        "outstanding": outstanding,
+        "oldest_wait_seconds": max(oldest_ages) if oldest_ages else None,
+        "arrival_rate": {f"{window}s": round(rate, 4) for window, rate in arrival_rates.items()},
+        "completion_rate": {f"{window}s": round(rate, 4) for window, rate in completion_rates.items()},
+        "workers": capacity,
+        "per_worker_rate": round(per_worker_rate, 4) if per_worker_rate else None,
+        "target_latency_seconds": target_latency,
+        "target_utilization": target_utilization,
+        "desired_workers": desired,
+        "timestamp": now,
+    }
@@ -0,0 +1,129 @@
+"""
+批次換臉任務
+
+一個批次由多個一般換臉子任務 (各自有狀態、可單獨查詢) 加上一筆批次紀錄 (batch:{id} hash) 組成：
+- 子任務依模板分組後依序入列，同一模板的任務會連續被 worker 取出，
+  模板的解碼與臉部偵測由 worker 的模板快取共用，整個批次每個模板只處理一次
+- 批次進度由子任務狀態即時彙總 (單次 pipeline)，不另外維護計數器
+- 全部子任務結束後，將成功的結果與 manifest.json 打包成單一 zip 供下載
+"""
+import json
+import logging
+import uuid
+import zipfile
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from core.config import RESULTS_DIR
+from core.redis_client import redis_client, BATCH_KEY_PREFIX, TASK_TTL_SECONDS
+from core.task_store import TASK_STATUSES, task_key, encode_fields, decode_fields
+
+logger = logging.getLogger(__name__)
+
+# 彙總進度時讀取的子任務欄位
+_CHILD_FIELDS = ("status", "result_url", "error", "template_id", "source_name")
+
+
+def batch_key(batch_id: str) -> str:
+    """批次紀錄 key"""
+    return f"{BATCH_KEY_PREFIX}{batch_id}"
+
+
+def archive_path(batch_id: str) -> Path:
+    """批次結果壓縮檔路徑"""
+    return RESULTS_DIR / f"{batch_id}.zip"
+
+
+async def create_batch(batch_id: str, record: Dict[str, Any]) -> None:
+    """建立批次紀錄 (與任務狀態相同保留 48 小時)"""
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.hset(batch_key(batch_id), mapping=encode_fields(record))
+        pipe.expire(batch_key(batch_id), TASK_TTL_SECONDS)
+        await pipe.execute()
+
+
+async def delete_batch(batch_id: str) -> None:
+    """刪除批次紀錄 (子任務未能入列時)"""
+    await redis_client.delete(batch_key(batch_id))
+
+
+async def get_batch(batch_id: str) -> Optional[Dict[str, Any]]:
+    """讀取批次紀錄"""
+    raw = await redis_client.hgetall(batch_key(batch_id))
+    return decode_fields(raw) if raw else None
+
+
+async def load_batch_items(batch: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """讀取所有子任務的狀態摘要 (單次 pipeline；已過期的子任務標記為 expired)"""
+    task_ids = batch.get("task_ids") or []
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for task_id in task_ids:
+            pipe.hmget(task_key(task_id), _CHILD_FIELDS)
+        rows = await pipe.execute()
+
+    items = []
+    for task_id, values in zip(task_ids, rows):
+        fields = decode_fields({name: value for name, value in zip(_CHILD_FIELDS, values) if value is not None})
+        items.append({"task_id": task_id, "status": "expired", **fields})
+    return items
+
+
+def summarize_batch(batch: Dict[str, Any], items: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """彙總批次進度"""
+    counts = {state: 0 for state in (*TASK_STATUSES, "expired")}
+    for item in items:
+        counts[item["status"]] = counts.get(item["status"], 0) + 1
+    total = len(items)
+    finished = counts["completed"] + counts["failed"] + counts["expired"]
+    if finished == total:
+        status = "completed"
+    elif counts["pending"] == total:
+        status = "pending"
+    else:
+        status = "processing"
+    return {
+        "batch_id": batch["batch_id"],
+        "status": status,
+        "total": total,
+        "counts": counts,
+        "progress": round(finished / total * 100, 1) if total else 100.0,
+        "template_ids": batch.get("template_ids"),
+        "created_at": batch.get("created_at"),
+    }
+
+
+def build_archive(batch_id: str, items: List[Dict[str, Any]]) -> Path:
+    """
+    將成功的結果打包成 zip (附 manifest.json 記錄每個子任務的結果)
+
+    壓縮檔已存在時直接返回 (批次結束後結果不再變動)。
+    """
+    path = archive_path(batch_id)
+    if path.exists():
+        return path
+
+    manifest = []
+    # 同時有多個下載請求時各自寫入暫存檔，最後以 rename 原子替換
+    tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+    with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_STORED) as archive:
+        for index, item in enumerate(items):
+            entry = {
+                "task_id": item["task_id"],
+                "source": item.get("source_name"),
+                "template_id": item.get("template_id"),
+                "status": item["status"],
+            }
+            result_url = item.get("result_url")
+            result_file = RESULTS_DIR / Path(result_url).name if result_url else None
+            if item["status"] == "completed" and result_file and result_file.is_file():
+                # JPEG 已壓縮，直接存放不再壓縮
+                source_stem = Path(item.get("source_name") or "source").stem
+                entry["file"] = f"{index + 1:04d}_{source_stem}_template{item.get('template_id')}.jpg"
+                archive.write(result_file, entry["file"])
+            elif item.get("error"):
+                entry["error"] = item["error"]
+            manifest.append(entry)
+        archive.writestr("manifest.json", json.dumps(manifest, ensure_ascii=False, indent=2))
+    tmp_path.replace(path)
+    logger.info(f"批次 {batch_id} 結果已打包：{path}")
+    return path
@@ -31,6 +31,7 @@ CORS_CONFIG = {
 # 檔案上傳配置
 UPLOAD_CONFIG = {
     "MAX_FILE_SIZE": 10 * 1024 * 1024,  # 10MB
+    "MAX_SOURCE_IMAGES": int(os.getenv("MAX_SOURCE_IMAGES", "5")),  # 同一人的來源照片上限 (特徵融合)
     "ALLOWED_EXTENSIONS": {".jpg", ".jpeg", ".png", ".webp"},
     "ALLOWED_MIME_TYPES": {
         "image/jpeg",
@@ -45,11 +46,20 @@ MODEL_CONFIG = {
     "FACE_ANALYSIS_MODEL": "buffalo_l",
     "FACE_SWAP_MODEL": "inswapper_128.onnx",
     "DETECTION_SIZE": (320, 320),  # 降低偵測尺寸提高成功率
+    "TEMPLATE_CACHE_SIZE": int(os.getenv("TEMPLATE_CACHE_SIZE", "16")),  # worker 快取的模板數 (解碼圖片與臉部偵測結果)
+    "IDENTITY_CACHE_TTL": int(os.getenv("IDENTITY_CACHE_TTL", "3600")),  # 來源臉部特徵快取時間 (秒)，同一組照片換不同模板時不再偵測
+    "IDENTITY_TTL": int(os.getenv("IDENTITY_TTL", "21600")),  # /api/identities 建立的身分保留時間 (秒，使用時延長)
+    "VALIDATION_TOKEN_TTL": int(os.getenv("VALIDATION_TOKEN_TTL", "600")),  # /api/validate-image 偵測結果保留時間 (秒)，提交換臉時以 validation_token 沿用
+    "IDENTITY_MIN_SIMILARITY": 0.3,  # 其他來源照片與主照片臉部的最低相似度，低於此值視為不同人不參與融合
     "CTX_ID": 0,  # CPU: -1, GPU: 0
     "DET_THRESH": 0.5,  # 降低偵測閾值
     "DET_SIZE": (640, 640),  # 備用偵測尺寸
+    # 來源照片兩段式處理：在縮小的副本上偵測，關鍵點與特徵只在原圖的臉部裁切上計算
+    "SOURCE_DETECT_MAX_SIZE": int(os.getenv("SOURCE_DETECT_MAX_SIZE", "1024")),  # 來源照片長邊超過此值時改用兩段式處理
+    "SOURCE_CROP_MARGIN": 0.5,  # 臉部裁切向外擴張的比例 (相對於臉部邊長)
+    "SOURCE_CROP_MAX_SIZE": 512,  # 臉部裁切的長邊上限 (超過時縮小，運算量只與臉數有關)
     # GPU 相關設定
-    "ENABLE_GPU": True,  # 是否啟用GPU支援
+    "ENABLE_GPU": os.getenv("ENABLE_GPU", "true").lower() == "true",  # 是否啟用GPU支援 (false 強制 CPU)
     "GPU_MEMORY_FRACTION": 0.8,  # GPU記憶體使用比例
     "GPU_PROVIDERS": [
         "CUDAExecutionProvider",
@@ -60,6 +70,40 @@ MODEL_CONFIG = {
     "GPU_FALLBACK_ENABLED": True,  # GPU失敗時是否自動切換CPU
 }
 
+# 提交時的照片預檢 (驗證 worker 以低解析度偵測 + 模糊/大小/亮度檢查，不必排隊就能拒絕無法使用的照片)
+PRESCREEN_CONFIG = {
+    "ENABLED": os.getenv("PRESCREEN_ENABLED", "true").lower() == "true",
+    "DET_SIZE": int(os.getenv("PRESCREEN_DET_SIZE", "256")),  # 預檢偵測的輸入尺寸 (32 的倍數，越小越快)
+    "TIMEOUT": int(os.getenv("PRESCREEN_TIMEOUT", "3")),  # 等待預檢的上限 (秒)，逾時直接入列不做預檢
+    "MIN_FACE_SIZE": 64,  # 臉部邊長下限 (原圖像素)，低於此值提出警告
+    "BLUR_THRESHOLD": 40.0,  # 臉部 Laplacian 變異數下限，低於此值視為模糊
+    "MIN_BRIGHTNESS": 40,  # 臉部平均亮度下限 (0-255)
+    "MAX_BRIGHTNESS": 220,  # 臉部平均亮度上限 (0-255)
+    "REJECT_NO_FACE": os.getenv("PRESCREEN_REJECT_NO_FACE", "true").lower() == "true",  # 沒有臉時直接拒絕 (false 只警告)
+    "REJECT_LOW_QUALITY": os.getenv("PRESCREEN_REJECT_LOW_QUALITY", "false").lower() == "true",  # 品質不足時拒絕 (預設只警告)
+}
+
+# 影片 / GIF 換臉配置
+VIDEO_CONFIG = {
+    "MAX_FILE_SIZE": int(os.getenv("VIDEO_MAX_FILE_SIZE_MB", "200")) * 1024 * 1024,
+    "MAX_DURATION": int(os.getenv("VIDEO_MAX_DURATION", "600")),  # 影片長度上限 (秒)
+    "ALLOWED_EXTENSIONS": {".mp4", ".mov", ".webm", ".mkv", ".avi", ".gif"},
+    "ALLOWED_MIME_TYPES": {
+        "video/mp4",
+        "video/quicktime",
+        "video/webm",
+        "video/x-matroska",
+        "video/x-msvideo",
+        "image/gif"
+    },
+    "KEYFRAME_INTERVAL": int(os.getenv("VIDEO_KEYFRAME_INTERVAL", "12")),  # 每隔幾張影格重新偵測臉部，其餘以光流追蹤
+    "CHUNK_SIZE": int(os.getenv("VIDEO_CHUNK_SIZE", "16")),  # 每個處理區段的影格數 (記憶體只保留一個區段)
+    "MIN_TRACKED_POINTS": 4,  # 5 個關鍵點中至少追蹤成功幾個，否則立即重新偵測
+    "REDETECT_IOU": 0.3,  # 關鍵影格與追蹤結果的最小重疊率，低於此值視為不同臉部
+    "DEFAULT_FPS": 10.0,  # 無法讀取影格率 (部分 GIF) 時使用
+    "OUTPUT_CODEC": "mp4v",  # 輸出 mp4 的編碼 (OpenCV 內建，不需額外套件)
+}
+
 # 模板配置
 TEMPLATE_CONFIG = {
     "TEMPLATES": {
@@ -377,6 +421,30 @@ QUEUE_CONFIG = {
     "MAX_QUEUE_SIZE": int(os.getenv("MAX_QUEUE_SIZE", "2000")),  # 最大佇列容量
     "ENABLE_QUEUE_LIMIT": os.getenv("ENABLE_QUEUE_LIMIT", "true").lower() == "true",  # 是否啟用佇列限制
     "QUEUE_FULL_MESSAGE": "系統繁忙，佇列已滿，請稍後再試",  # 佇列滿時的提示訊息
+    "SERVICE_RATE_WINDOW": int(os.getenv("SERVICE_RATE_WINDOW", "300")),  # 服務速率統計視窗（秒）
+    "RATE_BUCKET_SECONDS": 10,  # 速率統計分桶大小（秒）
+    "RATE_WINDOWS": (60, 300, 900),  # 擴縮容訊號的到達/完成速率統計視窗（秒）
+    "AUTOSCALE_TARGET_LATENCY": int(os.getenv("AUTOSCALE_TARGET_LATENCY", "60")),  # 擴縮容目標：新任務最長等待（秒）
+    "AUTOSCALE_TARGET_UTILIZATION": float(os.getenv("AUTOSCALE_TARGET_UTILIZATION", "0.8")),  # 擴縮容目標：worker 使用率上限
+    "WORKER_HEARTBEAT_INTERVAL": int(os.getenv("WORKER_HEARTBEAT_INTERVAL", "10")),  # worker 心跳間隔（秒）
+    "WORKER_LEASE_SECONDS": int(os.getenv("WORKER_LEASE_SECONDS", "30")),  # 心跳逾時即視為 worker 離線（秒）
+    "RECOVERY_INTERVAL": int(os.getenv("RECOVERY_INTERVAL", "15")),  # 孤兒任務回收間隔（秒）
+    "RECOVERY_BATCH_SIZE": 100,  # 每批回收的工作數量
+    "MAX_JOB_ATTEMPTS": int(os.getenv("MAX_JOB_ATTEMPTS", "3")),  # 重新排隊次數上限，超過即標記失敗
+    "THROUGHPUT_EWMA_ALPHA": 0.2,  # worker 吞吐量滾動估計的平滑係數
+    "CAPACITY_CACHE_SECONDS": 2,  # API 端 worker 容量彙總的快取時間（秒）
+    "MAX_ESTIMATED_WAIT": int(os.getenv("MAX_ESTIMATED_WAIT", "0")),  # 預估等待超過此秒數即拒絕新任務（0 表示不限）
+    "QUEUE_WAIT_MESSAGE": "目前等待時間過長，請稍後再試",  # 預估等待過長時的提示訊息
+    "AFFINITY_WINDOW": int(os.getenv("AFFINITY_WINDOW", "32")),  # worker 依模板親和性挑選工作時預看的佇列長度
+    "MAX_REORDER_DELAY": float(os.getenv("MAX_REORDER_DELAY", "10")),  # 佇列最前面的工作等待超過此秒數即不再重排
+    "AFFINITY_TTL": int(os.getenv("AFFINITY_TTL", "60")),  # worker 對模板的持有有效期（秒），期間內其他 worker 會避開
+    "MAX_BATCH_ITEMS": int(os.getenv("MAX_BATCH_ITEMS", "1000")),  # 單一批次最多的子任務數
+    "MAX_BATCH_UPLOAD_SIZE": int(os.getenv("MAX_BATCH_UPLOAD_SIZE_MB", "200")) * 1024 * 1024,  # 批次 zip 大小與來源照片總大小 (解壓後) 上限
+    "SYNC_SWAP_TIMEOUT": int(os.getenv("SYNC_SWAP_TIMEOUT", "120")),  # /api/swapper 等待任務完成的上限（秒）
+    "RPC_TIMEOUT": int(os.getenv("RPC_TIMEOUT", "30")),  # API 等待 worker 回應 RPC 的上限（秒）
+    "RPC_CONCURRENCY": int(os.getenv("RPC_CONCURRENCY", "2")),  # 每個 worker 同時處理的 RPC 數量
+    "VALIDATE_BATCH_SIZE": int(os.getenv("VALIDATE_BATCH_SIZE", "8")),  # 驗證 worker 單次 RPOP 最多取出的請求數
+    "VALIDATE_CONCURRENCY": int(os.getenv("VALIDATE_CONCURRENCY", "4")),  # 驗證 worker 同時處理的請求數 (執行緒數)
 }
 
 # 檔案清理配置
@@ -393,9 +461,20 @@ FILE_CLEANUP_CONFIG = {
 
 # 監控配置
 MONITORING_CONFIG = {
-    "ENABLE_METRICS": True,
+    "ENABLE_METRICS": os.getenv("ENABLE_METRICS", "true").lower() == "true",
     "METRICS_PATH": "/metrics",
-    "HEALTH_CHECK_PATH": "/health"
+    "HEALTH_CHECK_PATH": "/health",
+    # 管理端點 (取樣分析等) 的存取權杖，未設定時停用管理端點
+    "ADMIN_TOKEN": os.getenv("ADMIN_TOKEN", ""),
+    # 取樣分析 (folded stacks 輸出到 logs/profiles)
+    "PROFILE_DIR": LOGS_DIR / "profiles",
+    "PROFILE_SAMPLE_INTERVAL": 0.005,  # 手動開啟時的取樣間隔 (秒)
+    "PROFILE_DEFAULT_SECONDS": 30,  # 未指定時間或以 SIGUSR1 開啟時的長度
+    "PROFILE_MAX_SECONDS": 600,
+    # 慢任務分析：worker 每個任務都以較低頻率取樣，只保留最慢的幾份
+    "PROFILE_SLOW_JOBS": os.getenv("PROFILE_SLOW_JOBS", "true").lower() == "true",
+    "PROFILE_SLOW_JOB_INTERVAL": 0.02,
+    "PROFILE_KEEP_SLOWEST": int(os.getenv("PROFILE_KEEP_SLOWEST", "10")),
 }
 
 # 環境變數
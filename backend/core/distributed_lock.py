@@ -4,6 +4,7 @@ Redis 分散式鎖實現
 import asyncio
 import uuid
 import logging
+from typing import Optional
 from core.redis_client import redis_client, GPU_LOCK_KEY
 
 logger = logging.getLogger(__name__)
@@ -12,17 +13,18 @@ logger = logging.getLogger(__name__)
 class RedisLock:
     """Redis 分散式鎖 (用於 GPU 串行處理) - 使用 Pub/Sub 避免輪詢"""
 
-    def __init__(self, key: str = GPU_LOCK_KEY, timeout: int = 1800):
+    def __init__(self, key: str = GPU_LOCK_KEY, timeout: int = 1800, owner: Optional[str] = None):
         """
         初始化分散式鎖
 
         Args:
             key: Redis key 名稱
             timeout: 鎖超時時間 (秒) - 30 分鐘避免死鎖
+            owner: 持有者 ID (例如 worker ID)，持有者離線時回收流程可據此提前釋放
         """
         self.key = key
         self.timeout = timeout
-        self.identifier = str(uuid.uuid4())  # 唯一標識
+        self.identifier = f"{owner}:{uuid.uuid4()}" if owner else str(uuid.uuid4())  # 唯一標識
         self.channel = f"{key}:channel"
 
     async def acquire(self):
@@ -77,3 +79,20 @@ class RedisLock:
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         """Context manager 退出時釋放鎖"""
         await self.release()
+
+
+async def release_lock_of_owner(owner: str, key: str = GPU_LOCK_KEY) -> bool:
+    """若鎖由指定持有者持有則強制釋放 (持有者已離線時使用)"""
+    lua_script = """
+    local value = redis.call("get", KEYS[1])
+    if value and string.sub(value, 1, string.len(ARGV[1])) == ARGV[1] then
+        redis.call("del", KEYS[1])
+        redis.call("publish", KEYS[2], "released")
+        return 1
+    end
+    return 0
+    """
+    result = await redis_client.eval(lua_script, 2, key, f"{key}:channel", f"{owner}:")
+    if result:
+        logger.warning(f"已釋放離線持有者的鎖: {key} ({owner})")
+    return bool(result)
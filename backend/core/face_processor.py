@@ -17,16 +17,22 @@ import numpy as np
 from PIL import Image
 import insightface
 from insightface.app import FaceAnalysis
+from insightface.app.common import Face
 import uuid
+from collections import OrderedDict
 from typing import Optional, Tuple, Union
 import logging
 import subprocess
 import sys
 
 from .config import MODEL_CONFIG, get_model_path, RESULTS_DIR, UPLOADS_DIR
+from .metrics import DETECT_ATTEMPT_SECONDS, time_stage, record_fallback, collect_timings, record_cache_lookup
+from .identity import build_identity, analyze_identity, identity_face, encode_embedding, decode_embedding
+from .prescreen import screen_faces
 import gc
 import threading
 import shutil
+import time
 
 # 設定日誌
 logger = logging.getLogger(__name__)
@@ -52,6 +58,9 @@ def _reset_insightface_cache():
 
 def check_gpu_availability():
     """檢查GPU是否可用"""
+    if not MODEL_CONFIG["ENABLE_GPU"]:
+        logger.info("已停用GPU支援 (ENABLE_GPU=false)，將使用CPU")
+        return False, 'CPUExecutionProvider'
     try:
         import onnxruntime as ort
         # 檢查ONNX Runtime GPU支援
@@ -72,13 +81,59 @@ def check_gpu_availability():
         logger.warning(f"GPU檢測失敗: {e}，將使用CPU")
         return False, 'CPUExecutionProvider'
 
+def _resolution(image: np.ndarray) -> str:
+    """圖片解析度字串 (寬x高)"""
+    height, width = image.shape[:2]
+    return f"{width}x{height}"
+
+
+def _paste_back(target_image: np.ndarray, bgr_fake: np.ndarray, affine_matrix: np.ndarray) -> np.ndarray:
+    """
+    將換臉結果貼回原圖 (與 InsightFace INSwapper paste_back=True 的遮罩與羽化相同)
+
+    Args:
+        target_image: 原始目標圖片
+        bgr_fake: 對齊座標下的換臉結果
+        affine_matrix: 原圖到對齊座標的仿射矩陣
+    """
+    height, width = target_image.shape[:2]
+    inverse_matrix = cv2.invertAffineTransform(affine_matrix)
+    img_white = np.full(bgr_fake.shape[:2], 255, dtype=np.float32)
+    bgr_fake = cv2.warpAffine(bgr_fake, inverse_matrix, (width, height), borderValue=0.0)
+    img_mask = cv2.warpAffine(img_white, inverse_matrix, (width, height), borderValue=0.0)
+    img_mask[img_mask > 20] = 255
+
+    # 依臉部區域大小決定侵蝕與羽化範圍
+    mask_h_inds, mask_w_inds = np.where(img_mask == 255)
+    mask_h = np.max(mask_h_inds) - np.min(mask_h_inds)
+    mask_w = np.max(mask_w_inds) - np.min(mask_w_inds)
+    mask_size = int(np.sqrt(mask_h * mask_w))
+    k = max(mask_size // 10, 10)
+    img_mask = cv2.erode(img_mask, np.ones((k, k), np.uint8), iterations=1)
+    k = max(mask_size // 20, 5)
+    img_mask = cv2.GaussianBlur(img_mask, (2 * k + 1, 2 * k + 1), 0)
+
+    img_mask = (img_mask / 255)[:, :, np.newaxis]
+    merged = img_mask * bgr_fake + (1 - img_mask) * target_image.astype(np.float32)
+    return merged.astype(np.uint8)
+
+
 class FaceProcessor:
     """臉部處理器"""
 
-    def __init__(self):
-        """初始化臉部處理器 (GPU模式)"""
+    def __init__(self, detection_only: bool = False):
+        """
+        初始化臉部處理器 (GPU模式)
+
+        Args:
+            detection_only: 只載入臉部偵測模型 (驗證 worker 使用，不能換臉)
+        """
         self.face_app = None
         self.swapper = None
+        self.detection_only = detection_only
+        # 預設模板的 LRU 快取：(路徑, 修改時間) -> {"image": 解碼後圖片 (唯讀), "faces": 偵測結果}
+        self._template_cache = OrderedDict()
+        self._template_lock = threading.Lock()
         self._cache_reset_done = False
         self._initialize_models()
     
@@ -93,6 +148,7 @@ class FaceProcessor:
             # 檢查GPU可用性
             gpu_available, provider = check_gpu_availability()
 
+            self.provider = provider
             if gpu_available:
                 self.gpu_available = True
                 ctx_id = 0  # GPU
@@ -103,7 +159,7 @@ class FaceProcessor:
                 logger.info("GPU 不可用,使用 CPU 模式")
             
             # 初始化臉部分析模型
-            self.face_app = FaceAnalysis(name=MODEL_CONFIG["FACE_ANALYSIS_MODEL"])
+            self.face_app = self._create_face_app()
             
             # 根據可用記憶體調整檢測尺寸
             import psutil
@@ -124,17 +180,7 @@ class FaceProcessor:
             )
             
             # 初始化換臉模型
-            model_path = get_model_path(MODEL_CONFIG["FACE_SWAP_MODEL"])
-            if model_path.exists():
-                self.swapper = insightface.model_zoo.get_model(str(model_path))
-            else:
-                # 如果本地沒有模型，嘗試下載
-                logger.info("本地模型不存在，嘗試下載...")
-                self.swapper = insightface.model_zoo.get_model(
-                    MODEL_CONFIG["FACE_SWAP_MODEL"], 
-                    download=True, 
-                    download_zip=True
-                )
+            self._load_swapper()
             
             logger.info(f"AI 模型載入完成！(使用{'GPU' if gpu_available else 'CPU'}模式)")
             
@@ -149,18 +195,41 @@ class FaceProcessor:
             if hasattr(self, 'gpu_available') and self.gpu_available:
                 logger.warning(f"GPU模式初始化失敗：{e}，嘗試CPU模式...")
                 self.gpu_available = False
+                record_fallback("gpu_to_cpu")
                 self._initialize_cpu_fallback()
             else:
                 logger.error(f"模型初始化失敗：{e}")
                 raise RuntimeError(f"無法初始化 AI 模型：{e}")
     
+    def _create_face_app(self) -> FaceAnalysis:
+        """建立臉部分析模型 (偵測模式只載入偵測模組，省下關鍵點、性別年齡與特徵模型)"""
+        if self.detection_only:
+            return FaceAnalysis(name=MODEL_CONFIG["FACE_ANALYSIS_MODEL"], allowed_modules=["detection"])
+        return FaceAnalysis(name=MODEL_CONFIG["FACE_ANALYSIS_MODEL"])
+
+    def _load_swapper(self):
+        """載入換臉模型 (偵測模式略過)"""
+        if self.detection_only:
+            return
+        model_path = get_model_path(MODEL_CONFIG["FACE_SWAP_MODEL"])
+        if model_path.exists():
+            self.swapper = insightface.model_zoo.get_model(str(model_path))
+        else:
+            # 如果本地沒有模型，嘗試下載
+            logger.info("本地模型不存在，嘗試下載...")
+            self.swapper = insightface.model_zoo.get_model(
+                MODEL_CONFIG["FACE_SWAP_MODEL"], 
+                download=True, 
+                download_zip=True
+            )
+
     def _initialize_cpu_fallback(self):
         """CPU模式初始化（GPU失敗時的備用方案）"""
         try:
             logger.info("正在切換至CPU模式...")
             
             # 重新初始化臉部分析模型 (CPU模式)
-            self.face_app = FaceAnalysis(name=MODEL_CONFIG["FACE_ANALYSIS_MODEL"])
+            self.face_app = self._create_face_app()
             
             # 根據可用記憶體調整檢測尺寸
             import psutil
@@ -181,17 +250,10 @@ class FaceProcessor:
             )
             
             # 重新初始化換臉模型
-            model_path = get_model_path(MODEL_CONFIG["FACE_SWAP_MODEL"])
-            if model_path.exists():
-                self.swapper = insightface.model_zoo.get_model(str(model_path))
-            else:
-                logger.info("本地模型不存在，嘗試下載...")
-                self.swapper = insightface.model_zoo.get_model(
-                    MODEL_CONFIG["FACE_SWAP_MODEL"], 
-                    download=True, 
-                    download_zip=True
-                )
+            self._load_swapper()
             
+            self.gpu_available = False
+            self.provider = 'CPUExecutionProvider'
             logger.info("CPU模式初始化完成！")
             
         except Exception as e:
@@ -216,7 +278,7 @@ class FaceProcessor:
         """
         try:
             # 第一次嘗試：使用原始圖片
-            faces = self.face_app.get(image)
+            faces, _ = self._detect_attempt("original", image)
             if len(faces) > 0:
                 # 按照臉部位置排序（從左到右）
                 faces = sorted(faces, key=lambda x: x.bbox[0])
@@ -225,8 +287,8 @@ class FaceProcessor:
             
             # 第二次嘗試：調整圖片亮度和對比度
             logger.info("第一次偵測失敗，嘗試調整圖片亮度...")
-            enhanced_image = self._enhance_image(image)
-            faces = self.face_app.get(enhanced_image)
+            record_fallback("clahe")
+            faces, _ = self._detect_attempt("clahe", image, self._enhance_image)
             if len(faces) > 0:
                 faces = sorted(faces, key=lambda x: x.bbox[0])
                 logger.info(f"調整亮度後偵測到 {len(faces)} 張臉部")
@@ -234,8 +296,8 @@ class FaceProcessor:
             
             # 第三次嘗試：縮放圖片
             logger.info("第二次偵測失敗，嘗試縮放圖片...")
-            resized_image = self._resize_image(image)
-            faces = self.face_app.get(resized_image)
+            record_fallback("resize")
+            faces, resized_image = self._detect_attempt("resize", image, self._resize_image)
             if len(faces) > 0:
                 # 將座標縮放回原始尺寸
                 scale_factor = image.shape[0] / resized_image.shape[0]
@@ -253,7 +315,132 @@ class FaceProcessor:
         except Exception as e:
             logger.error(f"臉部偵測失敗：{e}")
             raise RuntimeError(f"臉部偵測失敗：{e}")
+
+    def _detect_attempt(self, strategy: str, image: np.ndarray, preprocess=None) -> Tuple[list, np.ndarray]:
+        """
+        執行單次偵測嘗試 (含前處理) 並記錄耗時
+
+        Returns:
+            Tuple[偵測到的臉部列表, 實際用於偵測的圖片]
+        """
+        started = time.perf_counter()
+        faces = []
+        try:
+            if preprocess is not None:
+                image = preprocess(image)
+            faces = self.face_app.get(image)
+            return faces, image
+        finally:
+            DETECT_ATTEMPT_SECONDS.labels(
+                strategy=strategy,
+                found="true" if len(faces) > 0 else "false",
+            ).observe(time.perf_counter() - started)
     
+    def detect_source_faces(self, image: np.ndarray) -> list:
+        """
+        偵測來源照片中的臉部 (大圖使用兩段式處理)
+
+        長邊超過 SOURCE_DETECT_MAX_SIZE 時，偵測模型先在縮小的副本上找出臉部範圍，
+        再於原圖的臉部裁切上重新偵測取得精確的關鍵點，性別年齡與特徵模型也只在裁切上執行；
+        原圖除了裁切之外不經過任何模型，運算量由臉數決定而非照片像素數。
+        縮小副本或原圖裁切上找不到臉時改用 detect_faces 的多重策略。
+        """
+        height, width = image.shape[:2]
+        max_size = MODEL_CONFIG["SOURCE_DETECT_MAX_SIZE"]
+        if self.detection_only or max(height, width) <= max_size:
+            return self.detect_faces(image)
+
+        scale = max_size / max(height, width)
+        with time_stage("downscale"):
+            small = cv2.resize(image, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+        started = time.perf_counter()
+        bboxes, kpss = self.face_app.det_model.detect(small, max_num=0, metric="default")
+        found = kpss is not None and len(bboxes) > 0
+        DETECT_ATTEMPT_SECONDS.labels(strategy="downscaled", found="true" if found else "false").observe(
+            time.perf_counter() - started
+        )
+        if not found:
+            logger.info("縮小副本上沒有偵測到臉部，改用多重策略偵測...")
+            return self.detect_faces(image)
+
+        faces = []
+        for bbox in bboxes:
+            # 縮小副本的關鍵點精度不足以對齊，只作為範圍：在原圖的臉部裁切上重新偵測
+            face = self._detect_in_region(image, bbox[:4] / scale)
+            if face is None:
+                logger.info("原圖裁切上沒有偵測到臉部，改用多重策略偵測...")
+                return self.detect_faces(image)
+            faces.append(self._analyze_face_crop(image, face.bbox, face.kps, face.det_score))
+        faces = sorted(faces, key=lambda x: x.bbox[0])
+        logger.info(f"兩段式偵測到 {len(faces)} 張臉部")
+        return faces
+
+    def _face_region(self, image: np.ndarray, bbox: np.ndarray) -> Tuple[int, int, int, int]:
+        """臉部周圍加上 SOURCE_CROP_MARGIN 邊界的裁切範圍 (限制在圖片內)"""
+        height, width = image.shape[:2]
+        margin = max(bbox[2] - bbox[0], bbox[3] - bbox[1]) * MODEL_CONFIG["SOURCE_CROP_MARGIN"]
+        x1, y1 = max(int(bbox[0] - margin), 0), max(int(bbox[1] - margin), 0)
+        x2, y2 = min(int(np.ceil(bbox[2] + margin)), width), min(int(np.ceil(bbox[3] + margin)), height)
+        return x1, y1, x2, y2
+
+    def _detect_in_region(self, image: np.ndarray, bbox: np.ndarray) -> Optional[Face]:
+        """
+        在原圖的臉部裁切上重新偵測，取得原圖解析度的臉部位置與關鍵點
+
+        裁切內有多張臉時取中心最接近 bbox 的一張；沒有偵測到臉時返回 None
+        """
+        x1, y1, x2, y2 = self._face_region(image, bbox)
+        if x2 <= x1 or y2 <= y1:
+            return None
+        with time_stage("detect_region"):
+            bboxes, kpss = self.face_app.det_model.detect(image[y1:y2, x1:x2], max_num=0, metric="default")
+        if kpss is None or len(bboxes) == 0:
+            return None
+
+        offset = np.array([x1, y1], dtype=np.float32)
+        centers = (bboxes[:, 0:2] + bboxes[:, 2:4]) / 2 + offset
+        target = (bbox[0:2] + bbox[2:4]) / 2
+        best = int(np.argmin(np.linalg.norm(centers - target, axis=1)))
+        return Face(
+            bbox=(bboxes[best, :4].reshape(2, 2) + offset).reshape(-1).astype(np.float32),
+            kps=(kpss[best] + offset).astype(np.float32),
+            det_score=float(bboxes[best, 4])
+        )
+
+    def _analyze_face_crop(self, image: np.ndarray, bbox: np.ndarray, kps: np.ndarray, det_score: float) -> Face:
+        """在原圖的臉部裁切上執行偵測以外的模型，結果座標換算回原圖"""
+        x1, y1, x2, y2 = self._face_region(image, bbox)
+        crop = image[y1:y2, x1:x2]
+
+        # 臉部很大時縮小裁切：關鍵點已是原圖精度並依相同比例換算，縮小只影響取樣；
+        # 特徵 / 關鍵點模型的輸入只有 112 / 192 像素，先以 INTER_AREA 縮小可避免對齊時直接從大圖取樣的鋸齒
+        crop_scale = min(MODEL_CONFIG["SOURCE_CROP_MAX_SIZE"] / max(crop.shape[:2]), 1.0)
+        if crop_scale < 1.0:
+            crop = cv2.resize(crop, (round(crop.shape[1] * crop_scale), round(crop.shape[0] * crop_scale)), interpolation=cv2.INTER_AREA)
+
+        offset = np.array([x1, y1], dtype=np.float32)
+        face = Face(
+            bbox=((bbox.reshape(2, 2) - offset) * crop_scale).reshape(-1).astype(np.float32),
+            kps=((kps - offset) * crop_scale).astype(np.float32),
+            det_score=det_score
+        )
+        with time_stage("analyze_crop"):
+            for taskname, model in self.face_app.models.items():
+                if taskname != "detection":
+                    model.get(crop, face)
+
+        for name in ("landmark_3d_68", "landmark_2d_106"):
+            points = face.get(name)
+            if points is not None:
+                points = points.astype(np.float32)
+                points[:, :2] = points[:, :2] / crop_scale + offset
+                if points.shape[1] > 2:
+                    points[:, 2:] /= crop_scale
+                face[name] = points
+        face.bbox = np.asarray(bbox, dtype=np.float32)
+        face.kps = np.asarray(kps, dtype=np.float32)
+        return face
+
     def _enhance_image(self, image: np.ndarray) -> np.ndarray:
         """增強圖片亮度和對比度"""
         try:
@@ -301,7 +488,9 @@ class FaceProcessor:
         source_image: np.ndarray,
         target_image: np.ndarray,
         source_face_index: int = 0,
-        target_face_index: int = 0
+        target_face_index: int = 0,
+        timings: Optional[dict] = None,
+        source_face=None
     ) -> np.ndarray:
         """
         執行換臉操作
@@ -311,23 +500,49 @@ class FaceProcessor:
             target_image: 目標圖片（被替換臉部）
             source_face_index: 來源臉部索引
             target_face_index: 目標臉部索引
+            timings: 各階段耗時 (秒) 會累加到此 dict，None 表示不收集
+            source_face: 已偵測 (或多張照片融合) 的來源臉部，提供時不再偵測來源圖片
 
         Returns:
             np.ndarray: 換臉後的圖片
         """
+        with collect_timings(timings):
+            return self._swap_faces(source_image, target_image, source_face_index, target_face_index, source_face)
+
+    def _swap_faces(
+        self,
+        source_image: np.ndarray,
+        target_image: np.ndarray,
+        source_face_index: int,
+        target_face_index: int,
+        source_face=None
+    ) -> np.ndarray:
+        """swap_faces 的實作"""
         try:
             # 偵測來源圖片中的臉部
-            source_faces = self.detect_faces(source_image)
-            if len(source_faces) == 0:
-                raise ValueError("在來源圖片中沒有偵測到臉部，請上傳清晰的正面照片")
+            provided_source = source_face is not None
+            if not provided_source:
+                with time_stage("detect_source"):
+                    source_faces = self.detect_source_faces(source_image)
+                if len(source_faces) == 0:
+                    raise ValueError("在來源圖片中沒有偵測到臉部，請上傳清晰的正面照片")
 
-            if source_face_index >= len(source_faces):
-                raise ValueError(f"來源圖片只有 {len(source_faces)} 張臉，但指定了第 {source_face_index + 1} 張臉")
-            
-            source_face = source_faces[source_face_index]
+                if source_face_index >= len(source_faces):
+                    raise ValueError(f"來源圖片只有 {len(source_faces)} 張臉，但指定了第 {source_face_index + 1} 張臉")
+
+                source_face = source_faces[source_face_index]
             
-            # 偵測目標圖片中的臉部
-            target_faces = self.detect_faces(target_image)
+            # 偵測目標圖片中的臉部 (快取的模板只偵測一次)
+            template_entry = self._template_entry(target_image)
+            if template_entry is not None and template_entry["faces"] is not None:
+                record_cache_lookup("template_faces", True)
+                target_faces = template_entry["faces"]
+            else:
+                with time_stage("detect_template"):
+                    target_faces = self.detect_faces(target_image)
+                if template_entry is not None:
+                    record_cache_lookup("template_faces", False)
+                    template_entry["faces"] = target_faces
             if len(target_faces) == 0:
                 raise ValueError("在目標圖片中沒有偵測到臉部")
             
@@ -337,13 +552,7 @@ class FaceProcessor:
             target_face = target_faces[target_face_index]
             
             try:
-                # GPU處理需要鎖保護,避免CUDA並發衝突
-                if self.gpu_available:
-                    with _gpu_lock:  # CUDA不支持多線程並發,強制串行
-                        result = self.swapper.get(target_image, target_face, source_face, paste_back=True)
-                else:
-                    # CPU fallback
-                    result = self.swapper.get(target_image, target_face, source_face, paste_back=True)
+                result = self._run_swapper(target_image, target_face, source_face)
 
                 # 計數器
                 global _process_counter
@@ -363,17 +572,18 @@ class FaceProcessor:
                 # 如果GPU模式失敗，嘗試切換到CPU模式重試
                 if hasattr(self, 'gpu_available') and self.gpu_available:
                     logger.warning(f"GPU換臉失敗: {swap_error}，嘗試使用CPU模式...")
+                    record_fallback("gpu_to_cpu")
                     try:
                         # 重新初始化為CPU模式
                         self._initialize_cpu_fallback()
-                        # 重新偵測臉部（因為模型已切換）
-                        source_faces = self.detect_faces(source_image)
+                        # 重新偵測臉部（因為模型已切換；已提供的來源特徵沿用）
+                        source_faces = [source_face] * (source_face_index + 1) if provided_source else self.detect_source_faces(source_image)
                         target_faces = self.detect_faces(target_image)
                         
                         if len(source_faces) > source_face_index and len(target_faces) > target_face_index:
                             source_face = source_faces[source_face_index]
                             target_face = target_faces[target_face_index]
-                            result = self.swapper.get(target_image, target_face, source_face, paste_back=True)
+                            result = self._run_swapper(target_image, target_face, source_face)
                             logger.info("CPU模式換臉處理完成")
                             return result
                         else:
@@ -388,13 +598,35 @@ class FaceProcessor:
             logger.error(f"換臉處理失敗：{e}")
             raise RuntimeError(f"換臉處理失敗：{e}")
     
+    def _run_swapper(self, target_image: np.ndarray, target_face, source_face) -> np.ndarray:
+        """
+        執行換臉推論並貼回原圖
+
+        推論與貼回分開執行 (paste_back=False 再自行貼回)，以便分別計時；
+        只有推論需要 GPU 鎖，貼回為 CPU 運算，不佔用鎖。
+        """
+        with time_stage("swap_inference"):
+            if self.gpu_available:
+                with _gpu_lock:  # CUDA不支持多線程並發,強制串行
+                    swapped = self.swapper.get(target_image, target_face, source_face, paste_back=False)
+            else:
+                # CPU fallback
+                swapped = self.swapper.get(target_image, target_face, source_face, paste_back=False)
+
+        if not isinstance(swapped, tuple):
+            return swapped  # 模型已自行貼回
+        bgr_fake, affine_matrix = swapped
+        with time_stage("paste_back"):
+            return _paste_back(target_image, bgr_fake, affine_matrix)
+
     def process_image_file(
         self, 
         user_image_data: bytes, 
         template_image_path: Union[str, Path],
         source_face_index: int = 0,
         target_face_index: int = 0,
-        task_id: str = None
+        task_id: str = None,
+        timings: Optional[dict] = None
     ) -> dict:
         """
         處理圖片檔案並執行換臉
@@ -405,34 +637,33 @@ class FaceProcessor:
             source_face_index: 來源臉部索引
             target_face_index: 目標臉部索引
             task_id: 任務ID（用於命名原圖）
+            timings: 各階段耗時 (秒) 會累加到此 dict，失敗時保留已完成的階段
             
         Returns:
-            dict: 包含結果圖片和原圖路徑的字典
+            dict: 包含結果圖片路徑、原圖路徑與來源、模板圖片解析度的字典
         """
         try:
-            # 儲存原圖
-            original_path = self._save_original_image(user_image_data, task_id)
-            
-            # 解析使用者圖片
-            user_image = self._decode_image(user_image_data)
-            
-            # 載入模板圖片
-            template_image = self._load_template_image(template_image_path)
-            
-            # 執行換臉
-            result_image = self.swap_faces(
-                source_image=user_image,
-                target_image=template_image,
-                source_face_index=source_face_index,
-                target_face_index=target_face_index
-            )
-            
-            # 儲存結果
-            result_path = self._save_result(result_image)
+            with collect_timings(timings):
+                # 儲存原圖
+                original_path = self._save_original_image(user_image_data, task_id)
+
+                # 解析使用者圖片
+                user_image = self._decode_image(user_image_data)
+
+                # 載入模板圖片 (快取)
+                template_image = self.load_template(template_image_path)
+
+                # 執行換臉
+                result_image = self._swap_faces(user_image, template_image, source_face_index, target_face_index)
+
+                # 儲存結果
+                result_path = self._save_result(result_image)
             
             return {
                 "result_path": result_path,
-                "original_path": original_path
+                "original_path": original_path,
+                "source_resolution": _resolution(user_image),
+                "template_resolution": _resolution(template_image),
             }
             
         except Exception as e:
@@ -445,7 +676,8 @@ class FaceProcessor:
         template_image_data: bytes,
         source_face_index: int = 0,
         target_face_index: int = 0,
-        task_id: str = None
+        task_id: str = None,
+        timings: Optional[dict] = None
     ) -> dict:
         """
         處理圖片資料並執行換臉（用於自訂模板）
@@ -456,46 +688,149 @@ class FaceProcessor:
             source_face_index: 來源臉部索引
             target_face_index: 目標臉部索引
             task_id: 任務ID（用於命名原圖）
+            timings: 各階段耗時 (秒) 會累加到此 dict，失敗時保留已完成的階段
             
         Returns:
-            dict: 包含結果圖片和原圖路徑的字典
+            dict: 包含結果圖片路徑、原圖路徑與來源、模板圖片解析度的字典
         """
         try:
-            # 儲存原圖
-            original_path = self._save_original_image(user_image_data, task_id)
-            
-            # 解析使用者圖片
-            user_image = self._decode_image(user_image_data)
-            
-            # 解析模板圖片
-            template_image = self._decode_image(template_image_data)
-            
-            # 執行換臉
-            result_image = self.swap_faces(
-                source_image=user_image,
-                target_image=template_image,
-                source_face_index=source_face_index,
-                target_face_index=target_face_index
-            )
-            
-            # 儲存結果
-            result_path = self._save_result(result_image)
+            with collect_timings(timings):
+                # 儲存原圖
+                original_path = self._save_original_image(user_image_data, task_id)
+
+                # 解析使用者圖片
+                user_image = self._decode_image(user_image_data)
+
+                # 解析模板圖片
+                template_image = self._decode_image(template_image_data)
+
+                # 執行換臉
+                result_image = self._swap_faces(user_image, template_image, source_face_index, target_face_index)
+
+                # 儲存結果
+                result_path = self._save_result(result_image)
             
             return {
                 "result_path": result_path,
-                "original_path": original_path
+                "original_path": original_path,
+                "source_resolution": _resolution(user_image),
+                "template_resolution": _resolution(template_image),
             }
             
         except Exception as e:
             logger.error(f"圖片處理失敗：{e}")
             raise
     
+    def load_images(
+        self,
+        user_image_data: bytes,
+        template_image_path: Optional[Union[str, Path]] = None,
+        template_image_data: Optional[bytes] = None,
+        task_id: str = None,
+        timings: Optional[dict] = None,
+        save_original: bool = True
+    ) -> Tuple[Optional[str], np.ndarray, np.ndarray]:
+        """
+        儲存原圖並解碼來源與模板圖片 (不需 GPU，可在取得 GPU 鎖之前執行)
+
+        Args:
+            user_image_data: 使用者圖片的二進位資料
+            template_image_path: 模板圖片路徑 (未提供 template_image_data 時使用)
+            template_image_data: 自訂模板的二進位資料
+            task_id: 任務ID（用於命名原圖）
+            timings: 各階段耗時 (秒) 會累加到此 dict
+            save_original: 是否儲存原圖 (來源為已儲存的身分照片時不需要)
+
+        Returns:
+            Tuple[原圖路徑 (未儲存時為 None), 使用者圖片, 模板圖片]
+        """
+        with collect_timings(timings):
+            original_path = self._save_original_image(user_image_data, task_id) if save_original else None
+            user_image = self._decode_image(user_image_data)
+            if template_image_data is not None:
+                template_image = self._decode_image(template_image_data)
+            else:
+                template_image = self.load_template(template_image_path)
+        return original_path, user_image, template_image
+
+    def load_source(
+        self,
+        user_image_data: bytes,
+        task_id: str = None,
+        timings: Optional[dict] = None,
+        save_original: bool = True
+    ) -> Tuple[Optional[str], np.ndarray]:
+        """儲存原圖並解碼來源圖片 (影片與全模板換臉使用，模板另外載入)"""
+        with collect_timings(timings):
+            original_path = self._save_original_image(user_image_data, task_id) if save_original else None
+            user_image = self._decode_image(user_image_data)
+        return original_path, user_image
+
+    def build_source_face(
+        self,
+        source_image: np.ndarray,
+        extra_image_data: Optional[list] = None,
+        source_face_index: int = 0,
+        timings: Optional[dict] = None,
+        hints: Optional[list] = None
+    ) -> Tuple[object, int]:
+        """
+        偵測來源臉部；提供其他同一人的照片時平行偵測並融合特徵
+
+        hints 為提交時預檢 / 驗證找到的主照片臉部，提供時主照片不再偵測整張照片 (見 face_from_hint)。
+
+        Returns:
+            Tuple[來源臉部, 實際參與融合的照片數]
+        """
+        with collect_timings(timings):
+            images = [source_image] + [self._decode_image(data) for data in extra_image_data or []]
+            return build_identity(self, images, source_face_index, hints)
+
+    def face_from_hint(self, image: np.ndarray, hint: dict) -> Optional[Face]:
+        """
+        以預檢 / 驗證提供的臉部建立臉部 (不偵測整張照片)
+
+        驗證提示帶有在原圖解析度計算的特徵，直接使用；預檢提示來自低解析度偵測，
+        關鍵點不夠精確，只作為範圍：在原圖的臉部裁切上重新偵測後再執行特徵模型。
+        裁切內偵測不到臉時返回 None，由呼叫端改為完整偵測。
+        """
+        if hint.get("embedding"):
+            face = Face(
+                bbox=np.asarray(hint["bbox"], dtype=np.float32),
+                kps=np.asarray(hint["kps"], dtype=np.float32),
+                det_score=hint.get("det_score")
+            )
+            return identity_face(decode_embedding(hint["embedding"]), face)
+
+        face = self._detect_in_region(image, np.asarray(hint["bbox"], dtype=np.float32))
+        if face is None:
+            logger.info("預檢範圍內沒有偵測到臉部，改為完整偵測來源照片")
+            return None
+        with time_stage("embed_source"):
+            self.face_app.models["recognition"].get(image, face)
+        return face
+
+    def prescreen_image(self, image_data: bytes, source_face_index: int = 0) -> dict:
+        """提交時的照片預檢：低解析度偵測臉部並檢查品質 (只需偵測模型)"""
+        return screen_faces(self, self._decode_image(image_data), source_face_index)
+
+    def create_identity(self, identity_id: str, image_data_list: list) -> dict:
+        """解碼身分照片並建立身分紀錄 (正規化圖片、臉部與特徵)"""
+        images = [self._decode_image(data) for data in image_data_list]
+        return analyze_identity(self, identity_id, images)
+
+    def save_result(self, result_image: np.ndarray, timings: Optional[dict] = None) -> str:
+        """編碼並儲存換臉結果 (不需 GPU，可在釋放 GPU 鎖之後執行)"""
+        with collect_timings(timings):
+            return self._save_result(result_image)
+
     def _decode_image(self, image_data: bytes) -> np.ndarray:
         """解碼圖片資料"""
         try:
             # 從 bytes 轉換為 numpy array
             nparr = np.frombuffer(image_data, np.uint8)
-            image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+            with time_stage("decode"):
+                image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
             
             if image is None:
                 raise ValueError("無法解析圖片資料")
@@ -505,6 +840,48 @@ class FaceProcessor:
         except Exception as e:
             raise ValueError(f"圖片解碼失敗：{e}")
     
+    def load_template(self, template_path: Union[str, Path], timings: Optional[dict] = None) -> np.ndarray:
+        """
+        載入模板圖片 (LRU 快取，同一模板只解碼一次)
+
+        返回的圖片為唯讀，其臉部偵測結果也會在第一次換臉時快取，後續任務不再重新偵測。
+        """
+        with collect_timings(timings):
+            return self._load_cached_template(Path(template_path))
+
+    def _load_cached_template(self, template_path: Path) -> np.ndarray:
+        """從模板快取取得圖片，未命中時解碼並加入快取"""
+        try:
+            key = (str(template_path), template_path.stat().st_mtime_ns)
+        except OSError:
+            # 交給 _load_template_image 回報不存在
+            return self._load_template_image(template_path)
+
+        with self._template_lock:
+            entry = self._template_cache.get(key)
+            if entry is not None:
+                self._template_cache.move_to_end(key)
+        record_cache_lookup("template_image", entry is not None)
+        if entry is not None:
+            return entry["image"]
+
+        image = self._load_template_image(template_path)
+        # 共用的快取圖片設為唯讀，避免被就地修改
+        image.setflags(write=False)
+        with self._template_lock:
+            self._template_cache[key] = {"image": image, "faces": None}
+            while len(self._template_cache) > MODEL_CONFIG["TEMPLATE_CACHE_SIZE"]:
+                self._template_cache.popitem(last=False)
+        return image
+
+    def _template_entry(self, image: np.ndarray) -> Optional[dict]:
+        """若圖片來自模板快取，返回其快取項目"""
+        with self._template_lock:
+            for entry in self._template_cache.values():
+                if entry["image"] is image:
+                    return entry
+        return None
+
     def _load_template_image(self, template_path: Union[str, Path]) -> np.ndarray:
         """載入模板圖片"""
         try:
@@ -512,7 +889,8 @@ class FaceProcessor:
             if not template_path.exists():
                 raise FileNotFoundError(f"模板圖片不存在：{template_path}")
             
-            image = cv2.imread(str(template_path))
+            with time_stage("load_template"):
+                image = cv2.imread(str(template_path))
             if image is None:
                 raise ValueError(f"無法載入模板圖片：{template_path}")
             
@@ -531,19 +909,21 @@ class FaceProcessor:
             # 確保結果目錄存在
             RESULTS_DIR.mkdir(parents=True, exist_ok=True)
             
-            # 儲存圖片
-            success = cv2.imwrite(str(result_path), result_image)
+            # 編碼圖片
+            with time_stage("encode"):
+                success, encoded = cv2.imencode(".jpg", result_image)
             if not success:
-                raise RuntimeError("圖片儲存失敗")
+                raise RuntimeError("圖片編碼失敗")
 
-            # 確保檔案已寫入並可讀
-            import os
-            if not result_path.exists() or result_path.stat().st_size == 0:
-                raise RuntimeError("圖片儲存後檔案不存在或大小為0")
+            # 寫入並強制同步到磁碟，確保其他服務讀取時檔案已完整
+            with time_stage("fsync"):
+                with open(result_path, 'wb') as f:
+                    f.write(encoded)
+                    f.flush()
+                    os.fsync(f.fileno())
 
-            # 強制同步到磁碟
-            with open(result_path, 'rb') as f:
-                os.fsync(f.fileno())
+            if result_path.stat().st_size == 0:
+                raise RuntimeError("圖片儲存後檔案大小為0")
 
             logger.info(f"結果已儲存並同步：{result_path}")
             return str(result_path)
@@ -565,8 +945,9 @@ class FaceProcessor:
             UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
             
             # 儲存原始圖片
-            with open(original_path, 'wb') as f:
-                f.write(image_data)
+            with time_stage("save_original"):
+                with open(original_path, 'wb') as f:
+                    f.write(image_data)
             
             logger.info(f"原圖已儲存：{original_path}")
             return str(original_path)
@@ -588,7 +969,7 @@ class FaceProcessor:
         """驗證圖片並返回資訊"""
         try:
             image = self._decode_image(image_data)
-            faces = self.detect_faces(image)
+            faces = self.detect_source_faces(image)
             
             height, width = image.shape[:2]
             
@@ -601,7 +982,10 @@ class FaceProcessor:
                     {
                         "index": i,
                         "bbox": face.bbox.tolist(),
-                        "confidence": float(face.det_score)
+                        "confidence": float(face.det_score),
+                        # 關鍵點與特徵供 validation_token 使用 (偵測模式沒有特徵)
+                        "kps": face.kps.tolist() if face.kps is not None else None,
+                        "embedding": encode_embedding(face.normed_embedding) if face.embedding is not None else None
                     }
                     for i, face in enumerate(faces)
                 ]
@@ -624,6 +1008,17 @@ def get_face_processor() -> FaceProcessor:
     return _processor_instance
 
 
+# 只含偵測模型的處理器實例 (驗證 worker 使用)
+_detector_instance = None
+
+def get_face_detector() -> FaceProcessor:
+    """獲取只載入偵測模型的處理器實例（單例模式）"""
+    global _detector_instance
+    if _detector_instance is None:
+        _detector_instance = FaceProcessor(detection_only=True)
+    return _detector_instance
+
+
 def get_system_info() -> dict:
     """獲取系統資訊，包括GPU狀態"""
     try:
@@ -666,18 +1061,3 @@ def get_system_info() -> dict:
             "gpu_info": "獲取失敗",
             "error": str(e)
         }
-
-def cleanup_old_results(max_age_hours: int = 24):
-    """清理舊的結果檔案"""
-    try:
-        import time
-        current_time = time.time()
-        max_age_seconds = max_age_hours * 3600
-        
-        for file_path in RESULTS_DIR.glob("result_*.jpg"):
-            if current_time - file_path.stat().st_mtime > max_age_seconds:
-                file_path.unlink()
-                logger.info(f"已清理舊檔案：{file_path}")
-                
-    except Exception as e:
-        logger.error(f"清理舊檔案失敗：{e}")
@@ -290,3 +290,18 @@ def get_storage_stats() -> dict:
         },
         "config": FILE_CLEANUP_CONFIG
     }
+
+
+def cleanup_old_results(max_age_hours: int = 24):
+    """清理舊的結果檔案"""
+    try:
+        current_time = time.time()
+        max_age_seconds = max_age_hours * 3600
+        
+        for file_path in RESULTS_DIR.glob("result_*.*"):
+            if current_time - file_path.stat().st_mtime > max_age_seconds:
+                file_path.unlink()
+                logger.info(f"已清理舊檔案：{file_path}")
+                
+    except Exception as e:
+        logger.error(f"清理舊檔案失敗：{e}")
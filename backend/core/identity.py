@@ -0,0 +1,294 @@
+"""
+來源身分：多張照片融合與臉部特徵快取
+
+同一人上傳多張照片時，各張照片的臉部偵測平行執行，辨識特徵 (normed embedding) 平均後
+再正規化為單一身分，換臉模型只使用此特徵，畫質比只用一張照片穩定。
+
+融合結果依「來源照片內容摘要」快取在 Redis (IDENTITY_CACHE_TTL)：
+同一組照片換其他模板 (或批次的其他子任務) 時，任何 worker 都不必重新偵測來源臉部。
+摘要在 API 端計算 (不需模型)，融合在 worker 執行。
+
+身分 (identity:{id})：使用者上傳一次照片，由 worker 正規化圖片、偵測所有臉部並計算 (融合) 特徵，
+API 將結果存入 Redis (IDENTITY_TTL)；之後的換臉任務以 identity_id 引用，不再上傳、暫存與偵測來源照片。
+
+驗證結果 (validation:{token})：/api/validate-image 的偵測結果 (臉部位置、關鍵點，worker 驗證時另含特徵)
+短暫保存 (VALIDATION_TOKEN_TTL)；提交同一張照片時帶上 validation_token，worker 直接沿用這些臉部。
+"""
+import json
+import base64
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from core.config import MODEL_CONFIG, UPLOAD_CONFIG, UPLOADS_DIR
+from core.metrics import time_stage
+from core.redis_client import redis_client, IDENTITY_CACHE_KEY_PREFIX, IDENTITY_KEY_PREFIX, VALIDATION_KEY_PREFIX
+from core.task_store import encode_fields, decode_fields
+
+logger = logging.getLogger(__name__)
+
+# 多張來源照片的偵測平行執行 (ONNX Runtime session 可多執行緒呼叫)
+_detect_executor: Optional[ThreadPoolExecutor] = None
+
+
+def identity_digest(contents: Sequence[bytes], source_face_index: int = 0) -> str:
+    """
+    來源照片組合的內容摘要 (快取 key)
+
+    主照片 (第一張) 決定使用哪張臉，其餘照片的順序不影響融合結果。
+    """
+    hashes = [hashlib.sha256(content).hexdigest() for content in contents]
+    material = "|".join([MODEL_CONFIG["FACE_ANALYSIS_MODEL"], str(source_face_index), hashes[0], *sorted(hashes[1:])])
+    return hashlib.sha256(material.encode()).hexdigest()
+
+
+def identity_cache_key(digest: str) -> str:
+    """臉部特徵快取 key"""
+    return f"{IDENTITY_CACHE_KEY_PREFIX}{digest}"
+
+
+def identity_key(identity_id: str) -> str:
+    """身分紀錄 key"""
+    return f"{IDENTITY_KEY_PREFIX}{identity_id}"
+
+
+def validation_key(token: str) -> str:
+    """驗證結果 key"""
+    return f"{VALIDATION_KEY_PREFIX}{token}"
+
+
+def encode_embedding(embedding: np.ndarray) -> str:
+    """特徵向量編碼為 base64 (float32)"""
+    return base64.b64encode(np.asarray(embedding, dtype=np.float32).tobytes()).decode("ascii")
+
+
+def decode_embedding(encoded: str) -> np.ndarray:
+    """base64 解碼回特徵向量"""
+    return np.frombuffer(base64.b64decode(encoded), dtype=np.float32)
+
+
+async def load_identity_embedding(digest: str) -> Optional[np.ndarray]:
+    """讀取快取的融合特徵 (命中時延長 TTL)"""
+    key = identity_cache_key(digest)
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.get(key)
+        pipe.expire(key, MODEL_CONFIG["IDENTITY_CACHE_TTL"])
+        raw, _ = await pipe.execute()
+    return decode_embedding(raw) if raw else None
+
+
+async def save_identity_embedding(digest: str, embedding: np.ndarray) -> None:
+    """快取融合特徵"""
+    await redis_client.set(identity_cache_key(digest), encode_embedding(embedding), ex=MODEL_CONFIG["IDENTITY_CACHE_TTL"])
+
+
+async def save_identity(record: Dict[str, Any]) -> None:
+    """儲存身分紀錄 (IDENTITY_TTL 後過期)"""
+    key = identity_key(record["identity_id"])
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.delete(key)
+        pipe.hset(key, mapping=encode_fields(record))
+        pipe.expire(key, MODEL_CONFIG["IDENTITY_TTL"])
+        await pipe.execute()
+
+
+async def get_identity(identity_id: str, touch: bool = True) -> Optional[Dict[str, Any]]:
+    """讀取身分紀錄；touch 時延長 TTL (仍在使用中的身分不會過期)"""
+    key = identity_key(identity_id)
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.hgetall(key)
+        if touch:
+            pipe.expire(key, MODEL_CONFIG["IDENTITY_TTL"])
+        raw = (await pipe.execute())[0]
+    return decode_fields(raw) if raw else None
+
+
+async def delete_identity(identity_id: str) -> Optional[Dict[str, Any]]:
+    """刪除身分紀錄，返回被刪除的紀錄 (不存在時為 None)"""
+    record = await get_identity(identity_id, touch=False)
+    if record:
+        await redis_client.delete(identity_key(identity_id))
+    return record
+
+
+async def save_validation(token: str, content: bytes, faces: List[Dict[str, Any]]) -> None:
+    """保存驗證的偵測結果 (照片內容摘要 + 臉部)，VALIDATION_TOKEN_TTL 後過期"""
+    record = {"digest": hashlib.sha256(content).hexdigest(), "faces": faces}
+    await redis_client.set(validation_key(token), json.dumps(record), ex=MODEL_CONFIG["VALIDATION_TOKEN_TTL"])
+
+
+async def load_validation(token: str, content: bytes) -> Optional[List[Dict[str, Any]]]:
+    """
+    讀取驗證的臉部偵測結果
+
+    Returns:
+        臉部列表；token 不存在或已過期時為 None
+
+    Raises:
+        ValueError: 上傳的照片與驗證時的照片不同
+    """
+    raw = await redis_client.get(validation_key(token))
+    if not raw:
+        return None
+    record = json.loads(raw)
+    if record["digest"] != hashlib.sha256(content).hexdigest():
+        raise ValueError("validation_token 與上傳的照片不符，請重新驗證")
+    return record["faces"]
+
+
+def public_identity(record: Dict[str, Any]) -> Dict[str, Any]:
+    """對外回應的身分資訊 (不含特徵向量)"""
+    public = {key: value for key, value in record.items() if key != "image_path"}
+    public["faces"] = [
+        {key: value for key, value in face.items() if key != "embedding"}
+        for face in record.get("faces", [])
+    ]
+    return public
+
+
+def identity_source_face(record: Dict[str, Any], source_face_index: int):
+    """由身分紀錄建立指定索引的來源臉部"""
+    faces = record.get("faces") or []
+    if source_face_index >= len(faces):
+        raise ValueError(f"身分照片只有 {len(faces)} 張臉，但指定了第 {source_face_index + 1} 張臉")
+    return identity_face(decode_embedding(faces[source_face_index]["embedding"]))
+
+
+def identity_face(embedding: np.ndarray, face=None):
+    """
+    以融合特徵建立來源臉部
+
+    換臉模型只讀取來源臉部的 normed_embedding；提供 face 時沿用其 bbox / kps 等屬性。
+    """
+    from insightface.app.common import Face
+    fused = Face(face or {})
+    fused.embedding = np.asarray(embedding, dtype=np.float32)
+    return fused
+
+
+def _get_detect_executor() -> ThreadPoolExecutor:
+    global _detect_executor
+    if _detect_executor is None:
+        _detect_executor = ThreadPoolExecutor(
+            max_workers=max(UPLOAD_CONFIG["MAX_SOURCE_IMAGES"], 1), thread_name_prefix="identity"
+        )
+    return _detect_executor
+
+
+def detect_sources(processor, images: List[np.ndarray]) -> List[list]:
+    """偵測所有來源照片的臉部 (多張時平行執行)"""
+    with time_stage("detect_source"):
+        if len(images) > 1:
+            return list(_get_detect_executor().map(processor.detect_source_faces, images))
+        return [processor.detect_source_faces(images[0])]
+
+
+def fuse_face(primary, others: List[list]) -> Tuple[object, int]:
+    """
+    將主照片的臉部與其他照片中最相似的臉融合
+
+    相似度低於 IDENTITY_MIN_SIMILARITY 的照片 (沒有臉或不是同一人) 不參與融合。
+
+    Returns:
+        Tuple[融合後的來源臉部, 實際參與融合的照片數]
+    """
+    if not others:
+        return primary, 1
+
+    embeddings = [primary.normed_embedding]
+    for index, faces in enumerate(others, start=2):
+        if not faces:
+            logger.warning(f"第 {index} 張來源照片沒有偵測到臉部，不參與融合")
+            continue
+        similarities = [float(np.dot(face.normed_embedding, primary.normed_embedding)) for face in faces]
+        best = int(np.argmax(similarities))
+        if similarities[best] < MODEL_CONFIG["IDENTITY_MIN_SIMILARITY"]:
+            logger.warning(f"第 {index} 張來源照片與主照片不像同一人 (相似度 {similarities[best]:.2f})，不參與融合")
+            continue
+        embeddings.append(faces[best].normed_embedding)
+
+    fused = np.mean(embeddings, axis=0)
+    fused /= np.linalg.norm(fused)
+    return identity_face(fused, primary), len(embeddings)
+
+
+def build_identity(
+    processor,
+    images: List[np.ndarray],
+    source_face_index: int = 0,
+    hints: Optional[List[Dict[str, Any]]] = None
+) -> Tuple[object, int]:
+    """
+    偵測所有來源照片並融合為單一身分
+
+    Args:
+        processor: 臉部處理器
+        images: 來源圖片 (第一張為主照片)
+        source_face_index: 主照片中的臉部索引
+        hints: 提交時預檢 / 驗證找到的主照片臉部 (由左到右)，提供時主照片只在指定臉部周圍處理
+
+    Returns:
+        Tuple[融合後的來源臉部, 實際參與融合的照片數]
+    """
+    if hints and source_face_index < len(hints):
+        primary = processor.face_from_hint(images[0], hints[source_face_index])
+        if primary is not None:
+            return fuse_face(primary, detect_sources(processor, images[1:]) if len(images) > 1 else [])
+
+    detected = detect_sources(processor, images)
+    primary_faces = detected[0]
+    if len(primary_faces) == 0:
+        raise ValueError("在來源圖片中沒有偵測到臉部，請上傳清晰的正面照片")
+    if source_face_index >= len(primary_faces):
+        raise ValueError(f"來源圖片只有 {len(primary_faces)} 張臉，但指定了第 {source_face_index + 1} 張臉")
+    return fuse_face(primary_faces[source_face_index], detected[1:])
+
+
+def analyze_identity(processor, identity_id: str, images: List[np.ndarray]) -> Dict[str, Any]:
+    """
+    建立身分紀錄 (worker 執行)：正規化並儲存主照片，偵測所有臉部並計算每張臉的 (融合) 特徵
+
+    主照片重新編碼為 JPEG (去除 EXIF 等中繼資料) 存於 uploads，換臉任務直接讀取，不再經過 pending 暫存。
+
+    Returns:
+        dict: 身分紀錄 (由 API 寫入 Redis)
+    """
+    import cv2  # API 行程不載入 cv2，只在 worker 執行
+
+    detected = detect_sources(processor, images)
+    if len(detected[0]) == 0:
+        raise ValueError("在來源圖片中沒有偵測到臉部，請上傳清晰的正面照片")
+
+    faces = []
+    for index, face in enumerate(detected[0]):
+        fused, fused_sources = fuse_face(face, detected[1:])
+        faces.append({
+            "index": index,
+            "bbox": [round(float(value), 1) for value in face.bbox],
+            "det_score": round(float(face.det_score), 4) if face.det_score is not None else None,
+            "fused_sources": fused_sources,
+            "embedding": encode_embedding(fused.normed_embedding),
+        })
+
+    image_path = UPLOADS_DIR / f"original_identity-{identity_id}.jpg"
+    UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
+    with time_stage("encode"):
+        success, encoded = cv2.imencode(".jpg", images[0], [cv2.IMWRITE_JPEG_QUALITY, 95])
+    if not success:
+        raise RuntimeError("圖片編碼失敗")
+    image_path.write_bytes(encoded.tobytes())
+
+    height, width = images[0].shape[:2]
+    return {
+        "identity_id": identity_id,
+        "created_at": datetime.now().isoformat(),
+        "image_path": str(image_path),
+        "original_url": f"/uploads/{image_path.name}",
+        "resolution": f"{width}x{height}",
+        "source_images": len(images),
+        "faces": faces,
+    }
@@ -0,0 +1,273 @@
+"""
+Prometheus 指標
+
+換臉流程各階段的直方圖與計數器。prometheus_client 為選用依賴：未安裝或
+MONITORING_CONFIG["ENABLE_METRICS"] 關閉時，所有指標皆為 no-op，不影響處理流程。
+
+API 以多個 uvicorn worker 執行時，需設定 PROMETHEUS_MULTIPROC_DIR，
+/metrics 會彙總所有行程的數值；獨立 worker 則以 WORKER_METRICS_PORT 啟動 HTTP 服務。
+目錄內的 .db 檔以 PID 區分，不會自動清除：啟動 uvicorn 前必須清空 (見 docker-compose 的 api command)，
+否則已結束行程的數值會持續被加總；worker 行程結束時以 mark_process_dead 移除其 live gauge。
+"""
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+from core.config import MONITORING_CONFIG
+
+logger = logging.getLogger(__name__)
+
+_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+if _MULTIPROC_DIR:
+    # 必須在匯入 prometheus_client 前建立目錄
+    os.makedirs(_MULTIPROC_DIR, exist_ok=True)
+
+try:
+    import prometheus_client
+    from prometheus_client import Counter, Gauge, Histogram
+except ImportError:  # pragma: no cover - 選用依賴
+    prometheus_client = None
+
+METRICS_ENABLED = bool(MONITORING_CONFIG["ENABLE_METRICS"] and prometheus_client is not None)
+
+# 階段耗時 (毫秒到數十秒)
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# 排隊與端到端 (秒到數十分鐘)
+WAIT_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+
+
+class _NoopMetric:
+    """指標停用時的替代物件"""
+
+    def labels(self, *args, **kwargs) -> "_NoopMetric":
+        return self
+
+    def observe(self, *args, **kwargs) -> None:
+        pass
+
+    def inc(self, *args, **kwargs) -> None:
+        pass
+
+    def set(self, *args, **kwargs) -> None:
+        pass
+
+
+def _histogram(name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets=STAGE_BUCKETS):
+    if not METRICS_ENABLED:
+        return _NoopMetric()
+    return Histogram(name, documentation, labelnames, buckets=buckets)
+
+
+def _counter(name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+    if not METRICS_ENABLED:
+        return _NoopMetric()
+    return Counter(name, documentation, labelnames)
+
+
+def _gauge(name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+    if not METRICS_ENABLED:
+        return _NoopMetric()
+    # 佇列類指標只在抓取時更新，多行程下取最近一次寫入的值
+    return Gauge(name, documentation, labelnames, multiprocess_mode="mostrecent")
+
+
+QUEUE_WAIT_SECONDS = _histogram(
+    "faceswap_queue_wait_seconds",
+    "任務從提交到被 worker 取出的等待時間",
+    buckets=WAIT_BUCKETS,
+)
+END_TO_END_SECONDS = _histogram(
+    "faceswap_end_to_end_seconds",
+    "任務從提交到完成 (成功或失敗) 的總時間",
+    ("status",),
+    buckets=WAIT_BUCKETS,
+)
+STAGE_SECONDS = _histogram(
+    "faceswap_stage_seconds",
+    "換臉流程各階段耗時",
+    ("stage",),
+)
+DETECT_ATTEMPT_SECONDS = _histogram(
+    "faceswap_detect_attempt_seconds",
+    "detect_faces 每次偵測嘗試的耗時",
+    ("strategy", "found"),
+)
+FALLBACK_TOTAL = _counter(
+    "faceswap_fallback_total",
+    "備援路徑使用次數 (clahe / resize / gpu_to_cpu)",
+    ("kind",),
+)
+CACHE_LOOKUPS_TOTAL = _counter(
+    "faceswap_cache_lookups_total",
+    "處理器快取查詢次數 (依快取與命中結果)",
+    ("cache", "result"),
+)
+PRESCREEN_TOTAL = _counter(
+    "faceswap_prescreen_total",
+    "提交時照片預檢結果 (passed / warned / rejected / skipped)",
+    ("result",),
+)
+CLAIMS_TOTAL = _counter(
+    "faceswap_claims_total",
+    "worker 取出工作的次數 (依取出原因：priority / affinity / unowned / head / aged)",
+    ("reason",),
+)
+TASKS_TOTAL = _counter(
+    "faceswap_tasks_total",
+    "已結束的換臉任務數",
+    ("status",),
+)
+FAILURES_TOTAL = _counter(
+    "faceswap_failures_total",
+    "換臉失敗次數 (依錯誤類型)",
+    ("reason",),
+)
+QUEUE_DEPTH = _gauge(
+    "faceswap_queue_depth",
+    "各通道等待中的工作數",
+    ("lane",),
+)
+QUEUE_OLDEST_WAIT_SECONDS = _gauge(
+    "faceswap_queue_oldest_wait_seconds",
+    "最舊等待中工作的等待時間",
+)
+QUEUE_OUTSTANDING = _gauge(
+    "faceswap_queue_outstanding",
+    "未完成任務數 (等待中 + 處理中)",
+)
+LIVE_WORKERS = _gauge(
+    "faceswap_live_workers",
+    "存活的 worker 數",
+)
+DESIRED_WORKERS = _gauge(
+    "faceswap_desired_workers",
+    "依目標延遲估算的建議 worker 數",
+)
+
+
+# 目前執行緒正在收集的單一任務耗時 (處理器在 executor 執行緒中執行，無法使用 contextvars)
+_local_timings = threading.local()
+
+
+@contextmanager
+def collect_timings(timings: Optional[Dict[str, float]]):
+    """
+    在區塊內把目前執行緒的階段耗時同時累加到 timings
+
+    timings 為 None 時不收集；巢狀使用時以內層為準，離開後恢復外層。
+    """
+    if timings is None:
+        yield timings
+        return
+    outer = getattr(_local_timings, "current", None)
+    _local_timings.current = timings
+    try:
+        yield timings
+    finally:
+        _local_timings.current = outer
+
+
+def observe_stage(stage: str, seconds: float, timings: Optional[Dict[str, float]] = None) -> None:
+    """
+    記錄單一階段耗時
+
+    除了 Prometheus 直方圖，也會累加到 timings (未指定時使用 collect_timings 設定的 dict)。
+    同一階段執行多次 (例如 CPU 備援後重新偵測) 時耗時相加。
+    """
+    STAGE_SECONDS.labels(stage=stage).observe(seconds)
+    if timings is None:
+        timings = getattr(_local_timings, "current", None)
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def time_stage(stage: str, timings: Optional[Dict[str, float]] = None):
+    """計時區塊並記錄為指定階段 (例外時同樣記錄)"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started, timings)
+
+
+def format_timings(timings: Dict[str, float]) -> Dict[str, float]:
+    """將耗時 (秒) 四捨五入到毫秒，用於寫入任務狀態或 API 回應"""
+    return {stage: round(seconds, 3) for stage, seconds in timings.items()}
+
+
+def record_fallback(kind: str) -> None:
+    """記錄備援路徑使用"""
+    FALLBACK_TOTAL.labels(kind=kind).inc()
+
+
+def record_cache_lookup(cache: str, hit: bool) -> None:
+    """記錄快取查詢結果"""
+    CACHE_LOOKUPS_TOTAL.labels(cache=cache, result="hit" if hit else "miss").inc()
+
+
+def record_prescreen(result: str) -> None:
+    """記錄照片預檢結果"""
+    PRESCREEN_TOTAL.labels(result=result).inc()
+
+
+def record_claim(reason: str) -> None:
+    """記錄 worker 取出工作的原因"""
+    CLAIMS_TOTAL.labels(reason=reason).inc()
+
+
+def record_task_result(status: str, end_to_end_seconds: Optional[float] = None, reason: Optional[str] = None) -> None:
+    """記錄任務結束 (成功或失敗)"""
+    TASKS_TOTAL.labels(status=status).inc()
+    if end_to_end_seconds is not None:
+        END_TO_END_SECONDS.labels(status=status).observe(end_to_end_seconds)
+    if status == "failed":
+        FAILURES_TOTAL.labels(reason=reason or "unknown").inc()
+
+
+def update_queue_gauges(signals: dict) -> None:
+    """以擴縮容訊號更新佇列相關 gauge"""
+    for lane, lane_signals in signals["lanes"].items():
+        QUEUE_DEPTH.labels(lane=lane).set(lane_signals["waiting"])
+    QUEUE_OLDEST_WAIT_SECONDS.set(signals["oldest_wait_seconds"] or 0)
+    QUEUE_OUTSTANDING.set(signals["outstanding"])
+    LIVE_WORKERS.set(signals["workers"]["live_workers"])
+    DESIRED_WORKERS.set(signals["desired_workers"] or 0)
+
+
+def generate_metrics() -> Tuple[bytes, str]:
+    """
+    產生 Prometheus 文字格式內容
+
+    Returns:
+        Tuple[內容, Content-Type]
+    """
+    if not METRICS_ENABLED:
+        return b"", "text/plain; charset=utf-8"
+    if _MULTIPROC_DIR:
+        from prometheus_client import CollectorRegistry, multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
+
+
+def mark_process_dead() -> None:
+    """多行程模式下，行程結束時移除本行程的 live gauge 檔案"""
+    if not METRICS_ENABLED or not _MULTIPROC_DIR:
+        return
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(os.getpid(), _MULTIPROC_DIR)
+
+
+def start_metrics_server(port: int) -> bool:
+    """為獨立 worker 啟動 /metrics HTTP 服務"""
+    if not METRICS_ENABLED or port <= 0:
+        return False
+    prometheus_client.start_http_server(port)
+    logger.info(f"Prometheus 指標服務已啟動：port={port}")
+    return True
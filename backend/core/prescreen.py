@@ -0,0 +1,105 @@
+"""
+提交時的照片預檢
+
+換臉任務入列前，由驗證 worker (或一般 worker 的 RPC 通道) 以低解析度跑一次偵測模型，
+並檢查臉部大小、模糊與亮度：低解析度找不到臉時改用 worker 的多重策略偵測，仍找不到才拒絕，
+不必排在換臉任務後面才失敗；品質不足時回傳警告。找到的臉部位置 (原圖座標) 隨任務交給 worker 作為提示，
+worker 只在指定臉部周圍的原圖裁切上重新偵測並計算特徵，不必偵測整張來源照片。
+
+只在 worker 執行 (需要 cv2 與偵測模型)。
+"""
+import logging
+from typing import Any, Dict, List
+
+import cv2
+import numpy as np
+
+from core.config import PRESCREEN_CONFIG
+from core.metrics import time_stage
+
+logger = logging.getLogger(__name__)
+
+
+def _face_issues(image: np.ndarray, bbox: np.ndarray) -> List[Dict[str, str]]:
+    """檢查單張臉的大小、模糊與亮度"""
+    height, width = image.shape[:2]
+    x1, y1 = max(int(bbox[0]), 0), max(int(bbox[1]), 0)
+    x2, y2 = min(int(bbox[2]), width), min(int(bbox[3]), height)
+    if x2 <= x1 or y2 <= y1:
+        return [{"code": "face_out_of_frame", "message": "臉部超出照片範圍"}]
+
+    issues = []
+    if min(x2 - x1, y2 - y1) < PRESCREEN_CONFIG["MIN_FACE_SIZE"]:
+        issues.append({"code": "face_too_small", "message": "臉部太小，請上傳臉部較大的照片"})
+
+    # 統一縮放到固定大小再計算，模糊程度不受臉部大小影響
+    gray = cv2.cvtColor(image[y1:y2, x1:x2], cv2.COLOR_BGR2GRAY)
+    gray = cv2.resize(gray, (112, 112), interpolation=cv2.INTER_AREA)
+    if cv2.Laplacian(gray, cv2.CV_64F).var() < PRESCREEN_CONFIG["BLUR_THRESHOLD"]:
+        issues.append({"code": "face_blurry", "message": "臉部模糊，請上傳清晰的照片"})
+
+    brightness = float(gray.mean())
+    if brightness < PRESCREEN_CONFIG["MIN_BRIGHTNESS"]:
+        issues.append({"code": "face_too_dark", "message": "臉部過暗，請在光線充足處拍攝"})
+    elif brightness > PRESCREEN_CONFIG["MAX_BRIGHTNESS"]:
+        issues.append({"code": "face_too_bright", "message": "臉部過亮，請避免強光直射"})
+    return issues
+
+
+def _face_entry(bbox: np.ndarray, kps: np.ndarray, det_score: float) -> Dict[str, Any]:
+    """臉部位置轉為可序列化的 dict"""
+    return {
+        "bbox": [round(float(value), 1) for value in bbox[:4]],
+        "kps": [[round(float(x), 2), round(float(y), 2)] for x, y in kps],
+        "det_score": round(float(det_score), 4),
+    }
+
+
+def _detect_faces(processor, image: np.ndarray) -> List[Dict[str, Any]]:
+    """
+    偵測臉部：先以 DET_SIZE 的低解析度輸入跑一次偵測模型 (座標由模型換算回原圖)；
+    找不到臉時 (臉部很小或光線不足) 改用 processor.detect_faces 的多重策略，
+    與換臉任務的偵測結果一致，避免把 worker 偵測得到臉的照片拒絕
+    """
+    det_size = PRESCREEN_CONFIG["DET_SIZE"]
+    with time_stage("prescreen"):
+        bboxes, kpss = processor.face_app.det_model.detect(
+            image, input_size=(det_size, det_size), max_num=0, metric="default"
+        )
+    if kpss is not None and len(bboxes) > 0:
+        return [_face_entry(bbox, kps, bbox[4]) for bbox, kps in zip(bboxes, kpss)]
+
+    logger.info("預檢低解析度偵測沒有找到臉部，改用多重策略偵測...")
+    with time_stage("prescreen_fallback"):
+        faces = processor.detect_faces(image)
+    return [_face_entry(face.bbox, face.kps, face.det_score) for face in faces]
+
+
+def screen_faces(processor, image: np.ndarray, source_face_index: int = 0) -> Dict[str, Any]:
+    """
+    偵測臉部並檢查指定臉部的品質
+
+    Returns:
+        dict: 照片尺寸、臉部位置 (由左到右，含關鍵點) 與品質問題
+    """
+    faces = sorted(_detect_faces(processor, image), key=lambda face: face["bbox"][0])
+    for index, face in enumerate(faces):
+        face["index"] = index
+
+    issues = []
+    if faces and source_face_index >= len(faces):
+        issues.append({
+            "code": "face_index_out_of_range",
+            "message": f"照片中只找到 {len(faces)} 張臉，但指定了第 {source_face_index + 1} 張臉"
+        })
+    elif faces:
+        issues.extend(_face_issues(image, np.asarray(faces[source_face_index]["bbox"])))
+
+    height, width = image.shape[:2]
+    return {
+        "width": width,
+        "height": height,
+        "face_count": len(faces),
+        "faces": faces,
+        "issues": issues,
+    }
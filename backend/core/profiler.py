@@ -0,0 +1,332 @@
+"""
+取樣式效能分析 (執行期間開關)
+
+背景執行緒以固定間隔讀取 sys._current_frames()，把每個執行緒的呼叫堆疊累計為
+folded stacks 格式 (每行「執行緒;frame;frame 次數」)，可直接交給 flamegraph.pl、
+speedscope 或 inferno 產生火焰圖。只在開啟期間取樣，平時沒有額外負擔。
+
+開啟方式：
+- POST /api/admin/profile：透過 Redis Pub/Sub 通知 API / worker 行程
+- SIGUSR1：切換收到訊號的行程 (開始 PROFILE_DEFAULT_SECONDS 秒 / 提早結束)
+- 慢任務分析：worker 每個任務都以較低頻率取樣，只保留最慢的 PROFILE_KEEP_SLOWEST 份
+"""
+import asyncio
+import heapq
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from core.config import BASE_DIR, MONITORING_CONFIG
+from core.redis_client import redis_client, PROFILER_CONTROL_CHANNEL
+
+logger = logging.getLogger(__name__)
+
+SLOW_JOBS_DIR = "slow"
+
+
+@lru_cache(maxsize=4096)
+def _short_path(filename: str) -> str:
+    """專案內的檔案顯示相對路徑，其餘 (標準函式庫、套件) 只保留最後兩層"""
+    try:
+        return str(Path(filename).resolve().relative_to(BASE_DIR.resolve()))
+    except ValueError:
+        return "/".join(Path(filename).parts[-2:])
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    # folded 格式以 ; 分隔 frame
+    return f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+
+
+class SamplingProfiler:
+    """以背景執行緒定期取樣所有執行緒的堆疊"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.started_at: Optional[float] = None
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _run(self) -> None:
+        own_ident = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            self._sample(own_ident)
+
+    def _sample(self, own_ident: int) -> None:
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            stack.append(thread_names.get(ident, f"thread-{ident}"))
+            self.stacks[";".join(reversed(stack))] += 1
+        self.samples += 1
+
+    def write(self, path: Path) -> Path:
+        """寫出 folded stacks"""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
+
+
+class ProfilerController:
+    """行程內的手動取樣開關 (依時間或任務數自動結束)"""
+
+    def __init__(self, role: str):
+        self.role = role
+        self._lock = threading.Lock()
+        self._profiler: Optional[SamplingProfiler] = None
+        self._timer: Optional[threading.Timer] = None
+        self._jobs_remaining: Optional[int] = None
+        self._reason: Optional[str] = None
+        self.last_output: Optional[Path] = None
+
+    @property
+    def active(self) -> bool:
+        return self._profiler is not None
+
+    def start(self, seconds: Optional[float] = None, jobs: Optional[int] = None, reason: str = "manual") -> Dict[str, Any]:
+        """
+        開始取樣
+
+        Args:
+            seconds: 取樣秒數 (上限 PROFILE_MAX_SECONDS)；未指定且未指定 jobs 時使用預設值
+            jobs: 取樣到完成指定數量的任務為止 (僅 worker)，同時受 seconds 或上限時間限制
+            reason: 觸發來源，寫入日誌
+        """
+        with self._lock:
+            if self._profiler is not None:
+                return self.status()
+            if seconds is None:
+                seconds = MONITORING_CONFIG["PROFILE_MAX_SECONDS"] if jobs else MONITORING_CONFIG["PROFILE_DEFAULT_SECONDS"]
+            seconds = min(float(seconds), MONITORING_CONFIG["PROFILE_MAX_SECONDS"])
+
+            self._profiler = SamplingProfiler(MONITORING_CONFIG["PROFILE_SAMPLE_INTERVAL"])
+            self._profiler.start()
+            self._jobs_remaining = jobs
+            self._reason = reason
+            self._timer = threading.Timer(seconds, self.stop)
+            self._timer.daemon = True
+            self._timer.start()
+            logger.info(f"取樣分析已開始：{seconds:.0f} 秒" + (f" / {jobs} 個任務" if jobs else "") + f" ({reason})")
+            return self.status()
+
+    def stop(self) -> Optional[Path]:
+        """結束取樣並寫出結果，返回輸出檔路徑"""
+        with self._lock:
+            profiler, self._profiler = self._profiler, None
+            if profiler is None:
+                return None
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self._jobs_remaining = None
+        profiler.stop()
+
+        timestamp = datetime.fromtimestamp(profiler.started_at).strftime("%Y%m%d-%H%M%S")
+        filename = f"{self.role}-{socket.gethostname()}-{os.getpid()}-{timestamp}.folded"
+        path = profiler.write(MONITORING_CONFIG["PROFILE_DIR"] / filename)
+        self.last_output = path
+        logger.info(f"取樣分析已結束：{profiler.samples} 次取樣，輸出 {path}")
+        return path
+
+    def toggle(self) -> None:
+        """SIGUSR1：未開啟則開始，已開啟則提早結束"""
+        if self.active:
+            self.stop()
+        else:
+            self.start(reason="SIGUSR1")
+
+    def job_finished(self) -> None:
+        """worker 每完成一個任務呼叫一次，達到指定任務數時結束取樣"""
+        with self._lock:
+            if self._jobs_remaining is None:
+                return
+            self._jobs_remaining -= 1
+            done = self._jobs_remaining <= 0
+        if done:
+            self.stop()
+
+    def status(self) -> Dict[str, Any]:
+        profiler = self._profiler
+        return {
+            "active": profiler is not None,
+            "samples": profiler.samples if profiler else 0,
+            "jobs_remaining": self._jobs_remaining,
+            "reason": self._reason if profiler else None,
+            "last_output": str(self.last_output) if self.last_output else None,
+        }
+
+
+class SlowJobProfiler:
+    """
+    逐任務取樣，只保留最慢的幾份
+
+    worker 一次只處理一個任務，行程內所有執行緒的取樣即代表該任務。
+    檔名以耗時開頭 ({毫秒}ms-{task_id}.folded)，重啟後由檔名還原目前保留的清單。
+    """
+
+    def __init__(self, keep: Optional[int] = None, interval: Optional[float] = None):
+        self.keep = keep or MONITORING_CONFIG["PROFILE_KEEP_SLOWEST"]
+        self.interval = interval or MONITORING_CONFIG["PROFILE_SLOW_JOB_INTERVAL"]
+        self.directory = MONITORING_CONFIG["PROFILE_DIR"] / SLOW_JOBS_DIR
+        self._kept: List[Tuple[float, str]] = self._load_existing()
+        self._profiler: Optional[SamplingProfiler] = None
+
+    def _load_existing(self) -> List[Tuple[float, str]]:
+        kept = []
+        if self.directory.exists():
+            for path in self.directory.glob("*.folded"):
+                try:
+                    kept.append((int(path.name.split("ms-", 1)[0]) / 1000, str(path)))
+                except ValueError:
+                    continue
+        heapq.heapify(kept)
+        return kept
+
+    def begin(self) -> None:
+        self._profiler = SamplingProfiler(self.interval)
+        self._profiler.start()
+
+    def end(self, task_id: str, duration: float) -> Optional[Path]:
+        """結束取樣；屬於目前最慢的 keep 份時寫出並淘汰最快的一份"""
+        profiler, self._profiler = self._profiler, None
+        if profiler is None:
+            return None
+        profiler.stop()
+        if len(self._kept) >= self.keep and duration <= self._kept[0][0]:
+            return None
+
+        path = profiler.write(self.directory / f"{int(duration * 1000):08d}ms-{task_id}.folded")
+        heapq.heappush(self._kept, (duration, str(path)))
+        while len(self._kept) > self.keep:
+            _, evicted = heapq.heappop(self._kept)
+            Path(evicted).unlink(missing_ok=True)
+        logger.info(f"任務 {task_id} 耗時 {duration:.2f} 秒，已保留取樣結果：{path}")
+        return path
+
+
+# 全域實例
+_controller_instance: Optional[ProfilerController] = None
+
+
+def get_profiler() -> ProfilerController:
+    """獲取行程內的取樣開關（單例模式）"""
+    global _controller_instance
+    if _controller_instance is None:
+        _controller_instance = ProfilerController(os.getenv("SERVICE_ROLE", "api").lower())
+    return _controller_instance
+
+
+def _matches_target(target: str, role: str, instance_id: str) -> bool:
+    return target in ("all", role, instance_id)
+
+
+async def publish_profiler_command(action: str, target: str = "all", **params) -> int:
+    """
+    發布取樣開關指令
+
+    Returns:
+        int: 收到指令的行程數
+    """
+    message = json.dumps({"action": action, "target": target, **params})
+    return await redis_client.publish(PROFILER_CONTROL_CHANNEL, message)
+
+
+def handle_profiler_command(command: Dict[str, Any], role: str, instance_id: str) -> None:
+    """執行單一開關指令 (不屬於本行程的指令直接略過)"""
+    if not _matches_target(command.get("target", "all"), role, instance_id):
+        return
+    controller = get_profiler()
+    if command.get("action") == "start":
+        controller.start(command.get("seconds"), command.get("jobs"), reason="admin")
+    elif command.get("action") == "stop":
+        # 寫檔為同步 I/O，交給執行緒避免卡住事件迴圈
+        threading.Thread(target=controller.stop, daemon=True).start()
+
+
+async def run_profiler_listener(role: str, instance_id: str) -> None:
+    """訂閱取樣開關頻道 (行程生命週期內持續執行，斷線時自動重連)"""
+    backoff = 0.5
+    while True:
+        pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(PROFILER_CONTROL_CHANNEL)
+            backoff = 0.5
+            while True:
+                message = await pubsub.get_message(timeout=1.0)
+                if message is None:
+                    continue
+                try:
+                    handle_profiler_command(json.loads(message["data"]), role, instance_id)
+                except (TypeError, ValueError) as err:
+                    logger.warning(f"解析取樣開關指令失敗：{err}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:  # noqa: BLE001
+            logger.warning(f"取樣開關訂閱中斷，{backoff:.1f} 秒後重新連線：{exc}")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 10.0)
+        finally:
+            try:
+                await pubsub.aclose()
+            except Exception:  # noqa: BLE001
+                pass
+
+
+def register_profiler_signal(loop: asyncio.AbstractEventLoop) -> None:
+    """註冊 SIGUSR1 切換取樣 (Windows 無此訊號時略過)"""
+    import signal
+    sigusr1 = getattr(signal, "SIGUSR1", None)
+    if sigusr1 is None:
+        return
+    try:
+        # 結束時會寫檔，放到執行緒避免卡住事件迴圈
+        loop.add_signal_handler(
+            sigusr1, lambda: threading.Thread(target=get_profiler().toggle, daemon=True).start()
+        )
+    except (NotImplementedError, RuntimeError):
+        pass
+
+
+def list_profiles() -> List[Dict[str, Any]]:
+    """列出 logs/profiles 下的取樣結果 (新到舊)"""
+    directory = MONITORING_CONFIG["PROFILE_DIR"]
+    if not directory.exists():
+        return []
+    profiles = []
+    for path in directory.rglob("*.folded"):
+        stat = path.stat()
+        profiles.append({
+            "name": str(path.relative_to(directory)),
+            "size_bytes": stat.st_size,
+            "modified_at": datetime.fromtimestamp(stat.st_mtime).isoformat(),
+        })
+    return sorted(profiles, key=lambda profile: profile["modified_at"], reverse=True)
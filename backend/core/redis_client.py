@@ -37,7 +37,30 @@ async def test_redis_connection() -> bool:
 
 
 # Redis Key 前綴
-TASK_KEY_PREFIX = "task:"
-QUEUE_SIZE_KEY = "queue_size"
+TASK_KEY_PREFIX = "task:"  # hash：任務狀態
+TASK_TTL_SECONDS = 172800  # 任務狀態保留 48 小時
+TASK_INDEX_KEY = "task_index"  # sorted set：task_id -> 建立時間 (timestamp)
+BATCH_KEY_PREFIX = "batch:"  # hash：批次換臉紀錄 (子任務 ID 列表等)
+IDENTITY_KEY_PREFIX = "identity:"  # hash：使用者上傳的身分 (正規化圖片路徑、臉部與特徵，帶 TTL)
+IDENTITY_CACHE_KEY_PREFIX = "identity_cache:"  # string：來源照片內容摘要 -> 融合後的臉部特徵 (帶 TTL)
+VALIDATION_KEY_PREFIX = "validation:"  # string：/api/validate-image 的偵測結果 (照片摘要、臉部位置與特徵，帶 TTL)
+TASK_STATUS_INDEX_PREFIX = "task_index:"  # sorted set：各狀態的任務索引 (task_index:pending ...)
 GPU_LOCK_KEY = "gpu_lock"
 TASK_QUEUE_KEY = "face_swap_queue"
+TASK_PRIORITY_QUEUE_KEY = "face_swap_queue:priority"  # 同步請求 (/api/swapper) 的優先通道
+QUEUE_SEQ_KEY = "queue_seq"  # 入列序號 (只增不減)
+QUEUE_ORDER_KEY = "queue_order"  # sorted set: task_id -> 入列序號
+QUEUE_COMPLETIONS_KEY_PREFIX = "queue_completions:"  # 完成事件分桶計數
+QUEUE_ARRIVALS_KEY_PREFIX = "queue_arrivals:"  # 提交事件分桶計數
+WORKERS_KEY = "workers"  # set：已註冊的 worker ID
+WORKER_KEY_PREFIX = "worker:"  # hash：worker 心跳 (帶 TTL)；worker:{id}:inflight 為處理中的工作
+TEMPLATE_OWNERS_KEY = "template_owners"  # hash：template_id -> 最近處理該模板的 worker ("worker_id|時間")
+RECOVERY_LEADER_KEY = "recovery_leader"  # 孤兒任務回收的 leader 鎖
+RPC_QUEUE_KEY = "rpc_queue"  # list：API 轉交 worker 的輕量請求 (驗證圖片、系統資訊)
+VALIDATE_QUEUE_KEY = "validate_queue"  # list：只由驗證 worker 處理的圖片驗證請求
+RPC_REPLY_KEY_PREFIX = "rpc_reply:"  # list：單一 RPC 的回覆 (帶 TTL)
+
+# Pub/Sub 頻道
+TASK_EVENTS_CHANNEL_PREFIX = "task_events:"  # 單一任務狀態變更
+QUEUE_EVENTS_CHANNEL = "queue_events"  # 佇列前進 (有任務完成)
+PROFILER_CONTROL_CHANNEL = "profiler_control"  # 開關各行程的取樣分析
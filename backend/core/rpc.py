@@ -0,0 +1,206 @@
+"""
+API → worker 的 RPC 通道
+
+API 行程不載入模型，需要模型的輕量請求 (驗證圖片、系統資訊) 經 Redis 轉交 worker：
+- API 將請求 LPUSH 到 rpc_queue，於 rpc_reply:{id} 以 BLPOP 等待回覆
+- worker 以獨立的 asyncio task 取出請求 (不排在換臉任務後面)，在執行緒中執行後回覆
+
+請求帶有截止時間，worker 取出時已逾時就直接丟棄，避免處理已無人等待的請求。
+圖片等大型參數以共用目錄的檔案路徑傳遞 (與換臉任務相同)，不放進 Redis。
+
+圖片驗證與預檢另有 validate_queue：由只載入偵測模型的驗證 worker (validator.py) 處理，
+有存活的驗證 worker 時優先使用，否則退回 rpc_queue 交給一般 worker。
+"""
+import asyncio
+import json
+import logging
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from core.config import QUEUE_CONFIG
+from core.redis_client import redis_client, RPC_QUEUE_KEY, RPC_REPLY_KEY_PREFIX, VALIDATE_QUEUE_KEY
+from core.worker_registry import get_worker_capacity
+
+logger = logging.getLogger(__name__)
+
+# 單次阻塞讀取的上限 (秒)：必須小於 redis_client 的 socket_timeout，否則讀取會在回覆前逾時
+BLOCK_SLICE_SECONDS = 5
+
+
+class RpcError(Exception):
+    """worker 執行 RPC 失敗"""
+
+
+class NoWorkerAvailableError(RpcError):
+    """沒有存活的 worker 可處理 RPC"""
+
+
+class RpcTimeoutError(RpcError):
+    """等待 worker 回覆逾時"""
+
+
+def reply_key(request_id: str) -> str:
+    """RPC 回覆 key"""
+    return f"{RPC_REPLY_KEY_PREFIX}{request_id}"
+
+
+async def call_worker(
+    method: str,
+    params: Optional[Dict[str, Any]] = None,
+    timeout: Optional[float] = None,
+    prefer_validator: bool = False,
+) -> Any:
+    """
+    呼叫 worker 上的方法並等待結果
+
+    Args:
+        prefer_validator: 有存活的驗證 worker 時改走 validate_queue (只支援 validate_image / prescreen_image)
+
+    Raises:
+        NoWorkerAvailableError: 沒有存活的 worker
+        RpcTimeoutError: 逾時未收到回覆
+        RpcError: worker 端執行失敗
+    """
+    timeout = timeout or QUEUE_CONFIG["RPC_TIMEOUT"]
+    capacity = await get_worker_capacity()
+    if prefer_validator and capacity.get("validators"):
+        lane = VALIDATE_QUEUE_KEY
+    elif capacity["live_workers"]:
+        lane = RPC_QUEUE_KEY
+    else:
+        raise NoWorkerAvailableError("目前沒有可用的 worker")
+
+    request_id = uuid.uuid4().hex
+    request = {
+        "id": request_id,
+        "method": method,
+        "params": params or {},
+        "deadline": time.time() + timeout,
+    }
+    await redis_client.lpush(lane, json.dumps(request))
+
+    key = reply_key(request_id)
+    deadline = time.monotonic() + timeout
+    reply = None
+    try:
+        # 分段等待回覆直到截止時間 (單次 BLPOP 不超過 socket_timeout)
+        while reply is None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            reply = await redis_client.blpop([key], timeout=min(BLOCK_SLICE_SECONDS, max(remaining, 0.1)))
+    finally:
+        await redis_client.delete(key)
+    if reply is None:
+        raise RpcTimeoutError(f"worker 在 {timeout:.0f} 秒內沒有回應")
+
+    payload = json.loads(reply[1])
+    if not payload.get("ok"):
+        raise RpcError(payload.get("error") or "worker 執行失敗")
+    return payload.get("result")
+
+
+def _parse_request(raw: str) -> Optional[Dict[str, Any]]:
+    """解析 RPC 請求，格式錯誤或已逾時返回 None"""
+    try:
+        request = json.loads(raw)
+    except (TypeError, json.JSONDecodeError) as err:
+        logger.warning(f"解析 RPC 請求失敗：{err}")
+        return None
+    if request.get("deadline", 0) <= time.time():
+        logger.info(f"RPC {request.get('method')} 已逾時，略過")
+        return None
+    return request
+
+
+def _execute(request: Dict[str, Any], handlers: Dict[str, Callable[..., Any]]) -> Dict[str, Any]:
+    """在執行緒中執行單一請求，返回回覆內容"""
+    handler = handlers.get(request.get("method"))
+    if handler is None:
+        return {"ok": False, "error": f"未知的 RPC 方法：{request.get('method')}"}
+    try:
+        return {"ok": True, "result": handler(**request.get("params", {}))}
+    except Exception as exc:  # noqa: BLE001
+        logger.warning(f"RPC {request['method']} 執行失敗：{exc}")
+        return {"ok": False, "error": str(exc)}
+
+
+async def _handle_request(
+    raw: str,
+    handlers: Dict[str, Callable[..., Any]],
+    executor: ThreadPoolExecutor,
+) -> None:
+    request = _parse_request(raw)
+    if request is None:
+        return
+
+    loop = asyncio.get_running_loop()
+    payload = await loop.run_in_executor(executor, _execute, request, handlers)
+
+    key = reply_key(request["id"])
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.lpush(key, json.dumps(payload, ensure_ascii=False))
+        # 呼叫端已放棄時回覆不會被讀取，保留到截止時間後自動清除
+        pipe.expire(key, max(int(request["deadline"] - time.time()), 1) + 5)
+        await pipe.execute()
+
+
+async def serve_rpc(
+    handlers: Dict[str, Callable[..., Any]],
+    concurrency: Optional[int] = None,
+    queue_key: str = RPC_QUEUE_KEY,
+    batch_size: int = 1,
+) -> None:
+    """
+    worker 端：持續處理 RPC 請求 (最多同時執行 concurrency 筆)
+
+    batch_size > 1 時，取得一筆請求後會以單次 RPOP 一併取出佇列中已在等待的請求
+    (最多 batch_size 筆，且不超過空閒的執行緒數)，減少 Redis 往返；
+    每筆請求仍各自在執行緒中平行執行，完成後立即回覆，不必等待同批其他請求。
+    """
+    concurrency = concurrency or QUEUE_CONFIG["RPC_CONCURRENCY"]
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="rpc")
+    slots = asyncio.Semaphore(concurrency)
+    pending = set()
+
+    async def run(raw: str) -> None:
+        try:
+            await _handle_request(raw, handlers, executor)
+        finally:
+            slots.release()
+
+    try:
+        while True:
+            await slots.acquire()
+            reserved = 1
+            raws = []
+            try:
+                item = await redis_client.brpop([queue_key], timeout=BLOCK_SLICE_SECONDS)
+                if item:
+                    raws.append(item[1])
+                    # 只取出空閒執行緒處理得了的數量 (Semaphore 有空位時 acquire 不會等待)
+                    while reserved < batch_size and not slots.locked():
+                        await slots.acquire()
+                        reserved += 1
+                    if reserved > 1:
+                        # RPOP count 需要 Redis 6.2+
+                        raws.extend(await redis_client.rpop(queue_key, reserved - 1) or [])
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:  # noqa: BLE001
+                logger.warning(f"讀取 RPC 請求失敗：{exc}")
+                await asyncio.sleep(1)
+            finally:
+                # 歸還沒有取到請求的名額
+                for _ in range(reserved - len(raws)):
+                    slots.release()
+            for raw in raws:
+                task = asyncio.create_task(run(raw))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+    finally:
+        for task in pending:
+            task.cancel()
+        executor.shutdown(wait=False)
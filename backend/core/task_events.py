@@ -0,0 +1,172 @@
+"""
+任務事件推播 (Redis Pub/Sub)
+
+update_task_status 於每次狀態變更時 (同一個 Lua script 內) 發布變更欄位到 task_events:{task_id}；
+任務完成時發布 queue_events，通知等待中的任務重新計算排隊位置。
+
+每個行程只建立一條 Pub/Sub 連線，依本地連線中的任務動態 SUBSCRIBE/UNSUBSCRIBE，
+再分發給 SSE / WebSocket 連線各自的 asyncio.Queue。
+"""
+import asyncio
+import json
+import logging
+from contextlib import asynccontextmanager
+from typing import Dict, Set, Optional, Any
+
+from core.redis_client import (
+    redis_client,
+    TASK_EVENTS_CHANNEL_PREFIX,
+    QUEUE_EVENTS_CHANNEL,
+)
+
+logger = logging.getLogger(__name__)
+
+# 特殊事件標記
+QUEUE_ADVANCED = "queue_advanced"  # 佇列前進，需重新計算位置
+RESYNC = "resync"  # Pub/Sub 重新連線，可能漏掉事件，需重新讀取快照
+
+
+def task_channel(task_id: str) -> str:
+    """任務事件頻道名稱"""
+    return f"{TASK_EVENTS_CHANNEL_PREFIX}{task_id}"
+
+
+class TaskSubscription:
+    """單一連線的事件佇列 (佇列前進事件會合併，避免大量完成時塞爆)"""
+
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self._queue_marker_pending = False
+
+    def push(self, event: Any) -> None:
+        if event == QUEUE_ADVANCED:
+            if self._queue_marker_pending:
+                return
+            self._queue_marker_pending = True
+        self.queue.put_nowait(event)
+
+    async def get(self) -> Any:
+        event = await self.queue.get()
+        if event == QUEUE_ADVANCED:
+            self._queue_marker_pending = False
+        return event
+
+
+class TaskEventHub:
+    """行程內共用的任務事件訂閱中心"""
+
+    def __init__(self):
+        self._subscriptions: Dict[str, Set[TaskSubscription]] = {}
+        self._pubsub = None
+        self._reader: Optional[asyncio.Task] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    def _get_lock(self) -> asyncio.Lock:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def _connect(self) -> None:
+        """建立 Pub/Sub 連線並重新訂閱所有本地任務頻道"""
+        self._pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+        channels = [QUEUE_EVENTS_CHANNEL] + [task_channel(task_id) for task_id in self._subscriptions]
+        await self._pubsub.subscribe(*channels)
+
+    async def _ensure_started(self) -> None:
+        if self._reader is not None and not self._reader.done():
+            return
+        await self._connect()
+        self._reader = asyncio.create_task(self._read_loop())
+
+    async def _read_loop(self) -> None:
+        backoff = 0.5
+        while True:
+            try:
+                message = await self._pubsub.get_message(timeout=1.0)
+                backoff = 0.5
+                if message is not None:
+                    self._dispatch(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:  # noqa: BLE001
+                logger.warning(f"任務事件訂閱中斷，{backoff:.1f} 秒後重新連線：{exc}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 10.0)
+                try:
+                    async with self._get_lock():
+                        await self._pubsub.aclose()
+                        await self._connect()
+                    # 重新連線期間可能漏掉事件，通知所有連線重新讀取
+                    for subscriptions in self._subscriptions.values():
+                        for subscription in subscriptions:
+                            subscription.push(RESYNC)
+                except Exception as reconnect_error:  # noqa: BLE001
+                    logger.warning(f"任務事件重新連線失敗：{reconnect_error}")
+
+    def _dispatch(self, message: Dict[str, Any]) -> None:
+        channel = message.get("channel")
+        if channel == QUEUE_EVENTS_CHANNEL:
+            for subscriptions in self._subscriptions.values():
+                for subscription in subscriptions:
+                    subscription.push(QUEUE_ADVANCED)
+            return
+
+        task_id = channel[len(TASK_EVENTS_CHANNEL_PREFIX):]
+        subscriptions = self._subscriptions.get(task_id)
+        if not subscriptions:
+            return
+        try:
+            updates = json.loads(message["data"])
+        except (TypeError, json.JSONDecodeError) as err:
+            logger.warning(f"解析任務事件失敗：channel={channel}，原因: {err}")
+            return
+        for subscription in subscriptions:
+            subscription.push(updates)
+
+    @asynccontextmanager
+    async def listen(self, task_id: str):
+        """訂閱單一任務的事件，離開 context 時自動取消訂閱"""
+        subscription = TaskSubscription()
+        async with self._get_lock():
+            await self._ensure_started()
+            subscriptions = self._subscriptions.setdefault(task_id, set())
+            if not subscriptions:
+                await self._pubsub.subscribe(task_channel(task_id))
+            subscriptions.add(subscription)
+        try:
+            yield subscription
+        finally:
+            async with self._get_lock():
+                subscriptions = self._subscriptions.get(task_id, set())
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    self._subscriptions.pop(task_id, None)
+                    try:
+                        await self._pubsub.unsubscribe(task_channel(task_id))
+                    except Exception as exc:  # noqa: BLE001
+                        logger.debug(f"取消訂閱任務事件失敗：{exc}")
+
+    async def close(self) -> None:
+        """關閉訂閱 (應用關閉時呼叫)"""
+        if self._reader is not None:
+            self._reader.cancel()
+            try:
+                await self._reader
+            except (asyncio.CancelledError, Exception):  # noqa: BLE001
+                pass
+            self._reader = None
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+            self._pubsub = None
+
+
+# 全域事件中心實例
+_hub_instance: Optional[TaskEventHub] = None
+
+
+def get_task_event_hub() -> TaskEventHub:
+    """獲取事件中心實例（單例模式）"""
+    global _hub_instance
+    if _hub_instance is None:
+        _hub_instance = TaskEventHub()
+    return _hub_instance
@@ -0,0 +1,355 @@
+"""
+任務佇列位置追蹤與提交 / 完成流程
+
+以 Redis sorted set 記錄每個未完成任務的入列序號 (score)：
+- 排隊位置 = ZRANK(task_id)，O(log n)，任務完成時 ZREM，不會因重啟或重複扣減而漂移
+- queue_ahead 為比自己早提交、尚未完成的任務數 (含 worker 處理中的任務)；ETA 以完成速率估算，
+  這些任務都要先完成，因此不區分等待中與處理中。priority 通道與模板親和性會讓 worker 不依序取出，
+  此時位置只是近似值
+提交與完成事件以時間分桶計數 (每桶一個帶 TTL 的 key)，用來估算到達率、即時服務速率與 ETA；
+最近沒有完成事件時 (剛啟動或閒置後)，改用存活 worker 心跳回報的吞吐量估計。
+
+提交 (容量檢查 + 建立狀態 + 入列)、開始處理、完成 各自由一個 Lua script 原子完成，
+每個關鍵路徑只需一次 Redis round trip。
+"""
+import json
+import time
+import logging
+from typing import Optional, Dict, Any, Tuple, Iterable, List
+
+from core.config import QUEUE_CONFIG
+from core.redis_client import (
+    redis_client,
+    TASK_QUEUE_KEY,
+    TASK_PRIORITY_QUEUE_KEY,
+    TASK_TTL_SECONDS,
+    TASK_INDEX_KEY,
+    QUEUE_SEQ_KEY,
+    QUEUE_ORDER_KEY,
+    QUEUE_COMPLETIONS_KEY_PREFIX,
+    QUEUE_ARRIVALS_KEY_PREFIX,
+    QUEUE_EVENTS_CHANNEL,
+)
+from core.task_store import task_key, status_index_key, encode_fields, STATUS_INDEX_LUA
+from core.task_events import task_channel
+from core.worker_registry import get_worker_capacity
+
+logger = logging.getLogger(__name__)
+
+# 提交任務 (可一次多個)：整批容量檢查 → 逐一取得序號、建立狀態並登記索引、推入佇列 → 記錄到達事件
+# 容量不足以放下整批時全部拒絕，不會只入列一部分
+# KEYS: 順序集合, 序號, 佇列, 任務索引, 到達分桶, 之後每個任務各兩個：任務 key, 狀態索引
+# ARGV: 容量上限 (0 表示不限), TTL, 建立時間, 分桶 TTL, 之後每個任務：task_id, 工作內容, 欄位參數數量, field/value 配對...
+_SUBMIT_SCRIPT = """
+local count = math.floor((#KEYS - 5) / 2)
+local size = redis.call("zcard", KEYS[1])
+local max_size = tonumber(ARGV[1])
+if max_size > 0 and size + count > max_size then
+    return {0, size}
+end
+local result = {1}
+local pos = 5
+for i = 1, count do
+    local task_id = ARGV[pos]
+    local task = KEYS[4 + i * 2]
+    local field_count = tonumber(ARGV[pos + 2])
+    local seq = redis.call("incr", KEYS[2])
+    redis.call("zadd", KEYS[1], seq, task_id)
+    local ahead = redis.call("zrank", KEYS[1], task_id)
+    redis.call("hset", task, unpack(ARGV, pos + 3, pos + 2 + field_count))
+    redis.call("hset", task, "queue_seq", seq, "queue_ahead", ahead)
+    redis.call("expire", task, ARGV[2])
+    redis.call("zadd", KEYS[4], ARGV[3], task_id)
+    redis.call("zadd", KEYS[5 + i * 2], ARGV[3], task_id)
+    local job = cjson.decode(ARGV[pos + 1])
+    job["queue_seq"] = seq
+    job["initial_queue_position"] = ahead + 1
+    redis.call("rpush", KEYS[3], cjson.encode(job))
+    result[#result + 1] = seq
+    result[#result + 1] = ahead
+    pos = pos + 3 + field_count
+end
+redis.call("incrby", KEYS[5], count)
+redis.call("expire", KEYS[5], ARGV[4])
+return result
+"""
+
+# 開始處理：更新狀態與狀態索引 → 發布事件
+# KEYS: 任務 key, 事件頻道
+# ARGV: task_id, TTL, 事件內容, 新狀態, field/value 配對...
+_START_SCRIPT = STATUS_INDEX_LUA + """
+if redis.call("exists", KEYS[1]) == 1 then
+    reindex_status(ARGV[1], ARGV[4])
+    redis.call("hset", KEYS[1], unpack(ARGV, 5))
+    redis.call("expire", KEYS[1], ARGV[2])
+    redis.call("publish", KEYS[2], ARGV[3])
+end
+return 1
+"""
+
+# 完成任務：移出佇列 → 記錄完成事件 → 寫入最終狀態 → 發布任務與佇列事件
+# KEYS: 順序集合, 完成分桶, 任務 key, 任務事件頻道, 佇列事件頻道
+# ARGV: task_id, 分桶 TTL, 任務 TTL, 事件內容, 新狀態, field/value 配對...
+_FINISH_SCRIPT = STATUS_INDEX_LUA + """
+redis.call("zrem", KEYS[1], ARGV[1])
+redis.call("incr", KEYS[2])
+redis.call("expire", KEYS[2], ARGV[2])
+local remaining = redis.call("zcard", KEYS[1])
+if redis.call("exists", KEYS[3]) == 1 then
+    reindex_status(ARGV[1], ARGV[5])
+    redis.call("hset", KEYS[3], unpack(ARGV, 6))
+    redis.call("hset", KEYS[3], "queue_remaining", remaining)
+    redis.call("expire", KEYS[3], ARGV[3])
+    local event = cjson.decode(ARGV[4])
+    event["queue_remaining"] = remaining
+    redis.call("publish", KEYS[4], cjson.encode(event))
+end
+redis.call("publish", KEYS[5], ARGV[1])
+return remaining
+"""
+
+_submit_script = redis_client.register_script(_SUBMIT_SCRIPT)
+_start_script = redis_client.register_script(_START_SCRIPT)
+_finish_script = redis_client.register_script(_FINISH_SCRIPT)
+
+
+def _field_args(fields: Dict[str, Any]) -> list:
+    """將欄位展開為 HSET 所需的 field/value 配對"""
+    args = []
+    for name, value in encode_fields(fields).items():
+        args.extend((name, value))
+    return args
+
+
+# 佇列通道名稱 -> 佇列 key (worker 依 worker_registry.CLAIM_ORDER 的順序取出，priority 優先)
+QUEUE_LANES = {
+    "face_swap": TASK_QUEUE_KEY,
+    "priority": TASK_PRIORITY_QUEUE_KEY,
+}
+
+
+def _bucket_keys(prefix: str, now: float, window: int) -> list:
+    """視窗內所有分桶的 key (由舊到新)"""
+    bucket_seconds = QUEUE_CONFIG["RATE_BUCKET_SECONDS"]
+    bucket_count = max(1, window // bucket_seconds)
+    current = int(now // bucket_seconds)
+    return [
+        f"{prefix}{bucket}"
+        for bucket in range(current - bucket_count + 1, current + 1)
+    ]
+
+
+def _current_bucket(prefix: str, now: float) -> str:
+    """目前時間所屬分桶的 key"""
+    return f"{prefix}{int(now // QUEUE_CONFIG['RATE_BUCKET_SECONDS'])}"
+
+
+def _bucket_ttl() -> int:
+    """分桶 key 的存活時間 (涵蓋最長的統計視窗)"""
+    longest = max(QUEUE_CONFIG["SERVICE_RATE_WINDOW"], *QUEUE_CONFIG["RATE_WINDOWS"])
+    return longest + QUEUE_CONFIG["RATE_BUCKET_SECONDS"]
+
+
+def _completion_buckets(now: float) -> list:
+    """服務速率視窗內所有分桶的 key (由舊到新)"""
+    return _bucket_keys(QUEUE_COMPLETIONS_KEY_PREFIX, now, QUEUE_CONFIG["SERVICE_RATE_WINDOW"])
+
+
+def _rate_from_buckets(counts: list, now: float) -> Optional[float]:
+    """由分桶計數計算每秒事件數，視窗內沒有事件時返回 None"""
+    total = sum(int(count) for count in counts if count)
+    if total == 0:
+        return None
+    bucket_seconds = QUEUE_CONFIG["RATE_BUCKET_SECONDS"]
+    window_start = (int(now // bucket_seconds) - len(counts) + 1) * bucket_seconds
+    return total / max(now - window_start, 1.0)
+
+
+async def get_windowed_rates(prefix: str, windows: Iterable[int]) -> Dict[int, float]:
+    """
+    以單次 MGET 計算多個滑動視窗的每秒事件數
+
+    Returns:
+        dict: 視窗秒數 -> 每秒事件數 (沒有事件時為 0)
+    """
+    windows = sorted(windows)
+    now = time.time()
+    keys = _bucket_keys(prefix, now, windows[-1])
+    counts = await redis_client.mget(keys)
+    bucket_seconds = QUEUE_CONFIG["RATE_BUCKET_SECONDS"]
+    rates = {}
+    for window in windows:
+        bucket_count = max(1, window // bucket_seconds)
+        rates[window] = _rate_from_buckets(counts[-bucket_count:], now) or 0.0
+    return rates
+
+
+def _submit_call(
+    tasks: List[Tuple[str, Dict[str, Any], Dict[str, Any]]],
+    max_queue_size: int,
+    lane: str,
+) -> Dict[str, list]:
+    """提交 script 的 keys / args"""
+    now = time.time()
+    keys = [
+        QUEUE_ORDER_KEY,
+        QUEUE_SEQ_KEY,
+        QUEUE_LANES[lane],
+        TASK_INDEX_KEY,
+        _current_bucket(QUEUE_ARRIVALS_KEY_PREFIX, now),
+    ]
+    args = [max_queue_size, TASK_TTL_SECONDS, now, _bucket_ttl()]
+    for task_id, status, job in tasks:
+        keys.extend((task_key(task_id), status_index_key(status.get("status", "pending"))))
+        fields = _field_args(status)
+        args.extend((
+            task_id,
+            json.dumps({**job, "enqueued_at": now, "lane": lane}, ensure_ascii=False),
+            len(fields),
+            *fields,
+        ))
+    return {"keys": keys, "args": args}
+
+
+async def submit_task(
+    task_id: str,
+    status: Dict[str, Any],
+    job: Dict[str, Any],
+    max_queue_size: int = 0,
+    lane: str = "face_swap",
+) -> Tuple[bool, int, int]:
+    """
+    原子地提交任務：容量檢查、登記序號、建立狀態並推入佇列
+
+    Args:
+        task_id: 任務 ID
+        status: 初始任務狀態
+        job: 佇列工作內容 (會附加 enqueued_at / queue_seq / initial_queue_position / lane)
+        max_queue_size: 容量上限，0 表示不限制
+        lane: 佇列通道 (QUEUE_LANES 的名稱)
+
+    Returns:
+        Tuple[是否受理, 入列序號 (拒絕時為 0), 前方未完成任務數 (拒絕時為目前佇列大小)]
+    """
+    result = await _submit_script(**_submit_call([(task_id, status, job)], max_queue_size, lane))
+    if not result[0]:
+        return False, 0, int(result[1])
+    return True, int(result[1]), int(result[2])
+
+
+async def submit_tasks(
+    tasks: Iterable[Tuple[str, Dict[str, Any], Dict[str, Any]]],
+    max_queue_size: int = 0,
+    lane: str = "face_swap",
+) -> Tuple[bool, int, List[int]]:
+    """
+    原子地依序提交多個任務 (單次 round trip)：佇列放不下整批時全部拒絕
+
+    Args:
+        tasks: (task_id, 初始任務狀態, 佇列工作內容) 的序列，依此順序入列
+        max_queue_size: 容量上限，0 表示不限制
+        lane: 佇列通道 (QUEUE_LANES 的名稱)
+
+    Returns:
+        Tuple[是否受理, 拒絕時的目前佇列大小 (受理時為 0), 各任務前方未完成任務數 (拒絕時為空)]
+    """
+    result = await _submit_script(**_submit_call(list(tasks), max_queue_size, lane))
+    if not result[0]:
+        return False, int(result[1]), []
+    return True, 0, [int(ahead) for ahead in result[2::2]]
+
+
+async def start_task(task_id: str, updates: Dict[str, Any]) -> None:
+    """worker 開始處理任務：更新狀態並通知訂閱者 (單次 round trip)"""
+    await _start_script(
+        keys=[task_key(task_id), task_channel(task_id)],
+        args=[
+            task_id,
+            TASK_TTL_SECONDS,
+            json.dumps(updates, ensure_ascii=False),
+            updates.get("status") or "",
+            *_field_args(updates),
+        ],
+    )
+
+
+async def finish_task(task_id: str, updates: Dict[str, Any]) -> int:
+    """
+    任務結束 (成功或失敗)：寫入最終狀態、移出佇列、記錄完成事件並通知等待者 (單次 round trip)
+
+    Returns:
+        int: 剩餘未完成任務數
+    """
+    bucket_key = _current_bucket(QUEUE_COMPLETIONS_KEY_PREFIX, time.time())
+    remaining = await _finish_script(
+        keys=[
+            QUEUE_ORDER_KEY,
+            bucket_key,
+            task_key(task_id),
+            task_channel(task_id),
+            QUEUE_EVENTS_CHANNEL,
+        ],
+        args=[
+            task_id,
+            _bucket_ttl(),
+            TASK_TTL_SECONDS,
+            json.dumps(updates, ensure_ascii=False),
+            updates.get("status") or "",
+            *_field_args(updates),
+        ],
+    )
+    return int(remaining)
+
+
+async def get_queue_size() -> int:
+    """獲取未完成任務數 (等待中 + 處理中)"""
+    return int(await redis_client.zcard(QUEUE_ORDER_KEY))
+
+
+async def get_service_rate() -> Optional[float]:
+    """獲取最近視窗內的每秒完成任務數"""
+    now = time.time()
+    counts = await redis_client.mget(_completion_buckets(now))
+    return _rate_from_buckets(counts, now)
+
+
+async def estimate_wait_seconds(queue_size: int) -> Optional[float]:
+    """預估新任務需等待的秒數 (無法估計時返回 None)"""
+    service_rate = await get_service_rate()
+    if not service_rate:
+        service_rate = (await get_worker_capacity())["throughput"]
+    if not service_rate:
+        return None
+    return (queue_size + 1) / service_rate
+
+
+async def get_task_position(task_id: str) -> Dict[str, Any]:
+    """
+    查詢任務的即時排隊位置與預估等待時間 (通常只需單次 round trip)
+
+    Returns:
+        dict: queue_ahead / queue_size / service_rate / eta_seconds
+    """
+    now = time.time()
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.zrank(QUEUE_ORDER_KEY, task_id)
+        pipe.zcard(QUEUE_ORDER_KEY)
+        pipe.mget(_completion_buckets(now))
+        rank, queue_size, counts = await pipe.execute()
+
+    service_rate = _rate_from_buckets(counts, now)
+    eta_rate = service_rate
+    if rank is not None and not eta_rate:
+        # 最近沒有完成事件，改用 worker 回報的吞吐量
+        eta_rate = (await get_worker_capacity())["throughput"]
+    eta_seconds = None
+    if rank is not None and eta_rate:
+        # 前方任務加上自己本身都需要被服務
+        eta_seconds = round((rank + 1) / eta_rate, 1)
+
+    return {
+        "queue_ahead": int(rank) if rank is not None else 0,
+        "queue_size": int(queue_size),
+        "service_rate": round(service_rate, 4) if service_rate else None,
+        "eta_seconds": eta_seconds,
+    }
@@ -0,0 +1,221 @@
+"""
+孤兒任務回收
+
+依 worker 心跳判斷哪些任務失去了處理者，只回收這些任務，不影響其他 worker 與佇列：
+- 心跳過期 worker 的 inflight 工作：重新排到佇列最前面 (超過重試上限則標記失敗)
+- 處理中但處理者已離線、且沒有留下工作內容的任務：標記失敗
+
+回收流程由各 API 行程定期觸發，但以 leader 鎖 (SET NX EX) 確保每個週期整個叢集只執行一次，
+所有 key 皆分批處理，不會因積壓量大而長時間阻塞 Redis。
+"""
+import asyncio
+import json
+import uuid
+import logging
+from datetime import datetime
+from typing import Dict, Any, List, Set
+
+from core.config import QUEUE_CONFIG
+from core.redis_client import (
+    redis_client,
+    TASK_QUEUE_KEY,
+    TASK_PRIORITY_QUEUE_KEY,
+    TASK_KEY_PREFIX,
+    TASK_TTL_SECONDS,
+    TASK_EVENTS_CHANNEL_PREFIX,
+    QUEUE_ORDER_KEY,
+    QUEUE_EVENTS_CHANNEL,
+    WORKERS_KEY,
+    RECOVERY_LEADER_KEY,
+)
+from core.task_store import STATUS_INDEX_LUA, list_task_ids, load_tasks_by_ids
+from core.task_queue import finish_task
+from core.distributed_lock import release_lock_of_owner
+from core.worker_registry import get_worker_liveness, inflight_key
+
+logger = logging.getLogger(__name__)
+
+# 將離線 worker 的 inflight 工作分批移回佇列最前面
+# KEYS: inflight 清單, 佇列, 順序集合, 佇列事件頻道, 優先佇列 (同步請求的工作排回原通道)
+# ARGV: 批次大小, 任務 TTL, 重試上限, 重新排隊欄位 (JSON), 失敗欄位 (JSON)
+_REQUEUE_SCRIPT = STATUS_INDEX_LUA + """
+local function apply_fields(task_id, fields_json, attempts)
+    local task_key = "%(task_prefix)s" .. task_id
+    local fields = cjson.decode(fields_json)
+    fields["attempts"] = attempts
+    for name, value in pairs(fields) do
+        redis.call("hset", task_key, name, cjson.encode(value))
+    end
+    redis.call("expire", task_key, ARGV[2])
+    redis.call("publish", "%(channel_prefix)s" .. task_id, cjson.encode(fields))
+end
+
+local requeued, failed, dropped = 0, 0, 0
+for _ = 1, tonumber(ARGV[1]) do
+    local payload = redis.call("rpop", KEYS[1])
+    if not payload then
+        break
+    end
+    local ok, job = pcall(cjson.decode, payload)
+    if not ok or type(job) ~= "table" or type(job["task_id"]) ~= "string" then
+        dropped = dropped + 1
+    else
+        local task_id = job["task_id"]
+        local status = redis.call("hget", "%(task_prefix)s" .. task_id, "status")
+        if status then
+            status = cjson.decode(status)
+        end
+        if status ~= "pending" and status ~= "processing" then
+            -- 任務已結束 (完成後來不及確認) 或已過期，只需移出佇列順序
+            redis.call("zrem", KEYS[3], task_id)
+            dropped = dropped + 1
+        else
+            local attempts = (tonumber(job["attempts"]) or 0) + 1
+            if attempts >= tonumber(ARGV[3]) then
+                reindex_status(task_id, "failed")
+                apply_fields(task_id, ARGV[5], attempts)
+                redis.call("zrem", KEYS[3], task_id)
+                redis.call("publish", KEYS[4], task_id)
+                failed = failed + 1
+            else
+                job["attempts"] = attempts
+                reindex_status(task_id, "pending")
+                apply_fields(task_id, ARGV[4], attempts)
+                local queue = KEYS[2]
+                if job["lane"] == "priority" then
+                    queue = KEYS[5]
+                end
+                redis.call("lpush", queue, cjson.encode(job))
+                requeued = requeued + 1
+            end
+        end
+    end
+end
+return {requeued, failed, dropped, redis.call("llen", KEYS[1])}
+""" % {"task_prefix": TASK_KEY_PREFIX, "channel_prefix": TASK_EVENTS_CHANNEL_PREFIX}
+
+_requeue_script = redis_client.register_script(_REQUEUE_SCRIPT)
+
+
+async def _acquire_leadership() -> bool:
+    """取得本週期的回收執行權 (鎖不主動釋放，到期前其他行程都會略過)"""
+    interval = QUEUE_CONFIG["RECOVERY_INTERVAL"]
+    return bool(await redis_client.set(
+        RECOVERY_LEADER_KEY,
+        uuid.uuid4().hex,
+        nx=True,
+        ex=max(1, interval - 1),
+    ))
+
+
+async def requeue_worker_jobs(worker_id: str) -> Dict[str, int]:
+    """將離線 worker 的 inflight 工作分批重新排隊"""
+    now = datetime.now().isoformat()
+    requeue_fields = {
+        "status": "pending",
+        "progress": 0,
+        "message": "處理節點中斷，任務已重新排隊",
+        "requeued_at": now,
+    }
+    failed_fields = {
+        "status": "failed",
+        "progress": 0,
+        "message": "處理節點多次中斷，任務已取消",
+        "error": f"Worker {worker_id} stopped responding",
+        "failed_at": now,
+    }
+    totals = {"requeued": 0, "failed": 0, "dropped": 0}
+    while True:
+        requeued, failed, dropped, remaining = await _requeue_script(
+            keys=[
+                inflight_key(worker_id),
+                TASK_QUEUE_KEY,
+                QUEUE_ORDER_KEY,
+                QUEUE_EVENTS_CHANNEL,
+                TASK_PRIORITY_QUEUE_KEY,
+            ],
+            args=[
+                QUEUE_CONFIG["RECOVERY_BATCH_SIZE"],
+                TASK_TTL_SECONDS,
+                QUEUE_CONFIG["MAX_JOB_ATTEMPTS"],
+                json.dumps(requeue_fields, ensure_ascii=False),
+                json.dumps(failed_fields, ensure_ascii=False),
+            ],
+        )
+        totals["requeued"] += int(requeued)
+        totals["failed"] += int(failed)
+        totals["dropped"] += int(dropped)
+        if not remaining:
+            break
+    # 離線 worker 可能還持有 GPU 鎖，不必等到鎖逾時
+    await release_lock_of_owner(worker_id)
+    await redis_client.srem(WORKERS_KEY, worker_id)
+    return totals
+
+
+async def fail_abandoned_tasks(live_workers: Set[str]) -> int:
+    """將處理者已離線、且沒有可重新排隊工作內容的處理中任務標記為失敗"""
+    batch_size = QUEUE_CONFIG["RECOVERY_BATCH_SIZE"]
+    failed = 0
+    offset = 0
+    while True:
+        task_ids = await list_task_ids(offset, offset + batch_size - 1, status="processing", newest_first=False)
+        if not task_ids:
+            break
+        abandoned: List[Dict[str, Any]] = [
+            task for task in await load_tasks_by_ids(task_ids)
+            if task.get("worker_id") and task["worker_id"] not in live_workers
+        ]
+        for task in abandoned:
+            await finish_task(task["task_id"], {
+                "status": "failed",
+                "progress": 0,
+                "message": "處理節點中斷，任務已取消",
+                "error": f"Worker {task['worker_id']} stopped responding",
+                "failed_at": datetime.now().isoformat(),
+            })
+        failed += len(abandoned)
+        # 標記失敗的任務已移出 processing 索引
+        offset += len(task_ids) - len(abandoned)
+    return failed
+
+
+async def recover_orphaned_tasks() -> Dict[str, int]:
+    """
+    執行一次孤兒任務回收 (整個叢集每個週期只會有一個行程實際執行)
+
+    Returns:
+        dict: 回收統計，未取得執行權時返回空 dict
+    """
+    if not await _acquire_leadership():
+        return {}
+
+    live_workers, dead_workers = await get_worker_liveness()
+    summary = {"dead_workers": len(dead_workers), "requeued": 0, "failed": 0, "dropped": 0}
+    for worker_id in dead_workers:
+        totals = await requeue_worker_jobs(worker_id)
+        for name, count in totals.items():
+            summary[name] += count
+        if totals["requeued"] or totals["failed"]:
+            logger.warning(
+                f"worker {worker_id} 已離線，重新排隊 {totals['requeued']} 個任務，"
+                f"{totals['failed']} 個任務超過重試上限"
+            )
+
+    summary["failed"] += await fail_abandoned_tasks(set(live_workers))
+    return summary
+
+
+async def run_recovery_loop() -> None:
+    """定期執行孤兒任務回收"""
+    interval = QUEUE_CONFIG["RECOVERY_INTERVAL"]
+    while True:
+        try:
+            summary = await recover_orphaned_tasks()
+            if summary.get("failed") or summary.get("requeued"):
+                logger.info(f"孤兒任務回收完成：{summary}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:  # noqa: BLE001
+            logger.warning(f"孤兒任務回收失敗：{exc}")
+        await asyncio.sleep(interval)
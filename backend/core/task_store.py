@@ -0,0 +1,261 @@
+"""
+任務狀態儲存 (Redis Hash)
+
+每個任務存成一個 hash，欄位值以 JSON 編碼 (保留 int / None / dict 等型別)。
+更新時只 HSET 變更的欄位，並在同一個 Lua script 內刷新 TTL 與發布事件，
+每次進度更新只需一次 round trip，也不會因並行更新而互相覆蓋欄位。
+
+另以 sorted set 維護依建立時間排序的任務索引 (全部 + 各狀態)，
+列表、分頁與孤兒任務掃描只需 O(log n + k)，不必 SCAN 全部任務。
+"""
+import json
+import time
+import logging
+from typing import Optional, Dict, Any, Iterable, List
+
+from redis.exceptions import ResponseError
+
+from core.redis_client import (
+    redis_client,
+    TASK_KEY_PREFIX,
+    TASK_TTL_SECONDS,
+    TASK_INDEX_KEY,
+    TASK_STATUS_INDEX_PREFIX,
+)
+from core.task_events import task_channel
+
+logger = logging.getLogger(__name__)
+
+TASK_STATUSES = ("pending", "processing", "completed", "failed")
+
+# 狀態索引維護 (內嵌於各 Lua script)：從其他狀態索引移除，加入新狀態索引
+STATUS_INDEX_LUA = """
+local function reindex_status(task_id, new_status)
+    if new_status == "" then
+        return
+    end
+    local score = redis.call("zscore", "%(index)s", task_id)
+    if not score then
+        return
+    end
+    for _, state in ipairs({%(statuses)s}) do
+        if state ~= new_status then
+            redis.call("zrem", "%(prefix)s" .. state, task_id)
+        end
+    end
+    redis.call("zadd", "%(prefix)s" .. new_status, score, task_id)
+end
+""" % {
+    "index": TASK_INDEX_KEY,
+    "prefix": TASK_STATUS_INDEX_PREFIX,
+    "statuses": ", ".join(f'"{state}"' for state in TASK_STATUSES),
+}
+
+# 僅在任務存在時更新欄位、維護狀態索引、刷新 TTL 並發布變更
+# KEYS[1]: 任務 key, KEYS[2]: 事件頻道
+# ARGV[1]: TTL, ARGV[2]: 事件內容, ARGV[3]: task_id, ARGV[4]: 新狀態 (無則為空字串), ARGV[5..]: field/value 配對
+_UPDATE_SCRIPT = STATUS_INDEX_LUA + """
+local key_type = redis.call("type", KEYS[1])["ok"]
+if key_type == "none" then
+    return 0
+end
+if key_type ~= "hash" then
+    return -1
+end
+reindex_status(ARGV[3], ARGV[4])
+redis.call("hset", KEYS[1], unpack(ARGV, 5))
+redis.call("expire", KEYS[1], ARGV[1])
+redis.call("publish", KEYS[2], ARGV[2])
+return 1
+"""
+
+_update_script = redis_client.register_script(_UPDATE_SCRIPT)
+
+
+def task_key(task_id: str) -> str:
+    """任務狀態 key"""
+    return f"{TASK_KEY_PREFIX}{task_id}"
+
+
+def status_index_key(status: Optional[str] = None) -> str:
+    """任務索引 key (未指定狀態時為全部任務索引)"""
+    return f"{TASK_STATUS_INDEX_PREFIX}{status}" if status else TASK_INDEX_KEY
+
+
+def encode_fields(fields: Dict[str, Any]) -> Dict[str, str]:
+    """將欄位值編碼為 JSON 字串"""
+    return {name: json.dumps(value, ensure_ascii=False) for name, value in fields.items()}
+
+
+def decode_fields(raw: Dict[str, str]) -> Dict[str, Any]:
+    """將 hash 欄位解碼回 Python 值"""
+    decoded = {}
+    for name, value in raw.items():
+        try:
+            decoded[name] = json.loads(value)
+        except (TypeError, json.JSONDecodeError):
+            decoded[name] = value
+    return decoded
+
+
+async def _migrate_legacy_task(key: str) -> Optional[Dict[str, Any]]:
+    """將舊版 JSON 字串格式的任務轉換為 hash (保留剩餘 TTL)"""
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.get(key)
+        pipe.ttl(key)
+        data, ttl = await pipe.execute()
+    if not data:
+        return None
+    try:
+        task = json.loads(data)
+    except json.JSONDecodeError as err:
+        logger.warning(f"解析舊版任務資料失敗：key={key}，原因: {err}")
+        return None
+
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.delete(key)
+        if task:
+            pipe.hset(key, mapping=encode_fields(task))
+            pipe.expire(key, ttl if ttl and ttl > 0 else TASK_TTL_SECONDS)
+        await pipe.execute()
+    logger.info(f"已將舊版任務資料轉換為 hash：{key}")
+    return task
+
+
+async def get_task_status(task_id: str, fields: Optional[Iterable[str]] = None) -> Optional[Dict[str, Any]]:
+    """
+    從 Redis 獲取任務狀態
+
+    Args:
+        task_id: 任務 ID
+        fields: 只讀取指定欄位 (HMGET)，None 表示讀取全部 (HGETALL)
+    """
+    key = task_key(task_id)
+    try:
+        if fields is None:
+            raw = await redis_client.hgetall(key)
+        else:
+            fields = list(fields)
+            values = await redis_client.hmget(key, fields)
+            raw = {name: value for name, value in zip(fields, values) if value is not None}
+    except ResponseError as err:
+        if "WRONGTYPE" not in str(err):
+            raise
+        task = await _migrate_legacy_task(key)
+        if task is None or fields is None:
+            return task
+        return {name: task[name] for name in fields if name in task} or None
+
+    if not raw:
+        return None
+    return decode_fields(raw)
+
+
+async def set_task_status(task_id: str, status: Dict[str, Any]) -> None:
+    """設置完整任務狀態到 Redis (TTL 48 小時) 並登記索引"""
+    key = task_key(task_id)
+    created_score = time.time()
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.delete(key)
+        pipe.hset(key, mapping=encode_fields(status))
+        pipe.expire(key, TASK_TTL_SECONDS)
+        pipe.zadd(TASK_INDEX_KEY, {task_id: created_score}, nx=True)
+        for state in TASK_STATUSES:
+            pipe.zrem(status_index_key(state), task_id)
+        if status.get("status"):
+            pipe.zadd(status_index_key(status["status"]), {task_id: created_score})
+        await pipe.execute()
+
+
+async def update_task_status(task_id: str, updates: Dict[str, Any]) -> bool:
+    """
+    更新任務狀態 (只寫入變更欄位) 並推播變更
+
+    Returns:
+        bool: 任務存在且已更新
+    """
+    if not updates:
+        return False
+    key = task_key(task_id)
+    args = [
+        TASK_TTL_SECONDS,
+        json.dumps(updates, ensure_ascii=False),
+        task_id,
+        updates.get("status") or "",
+    ]
+    for name, value in encode_fields(updates).items():
+        args.extend((name, value))
+
+    keys = [key, task_channel(task_id)]
+    result = await _update_script(keys=keys, args=args)
+    if result == -1:
+        # 舊版字串格式，轉換後重試一次
+        if await _migrate_legacy_task(key) is None:
+            return False
+        result = await _update_script(keys=keys, args=args)
+    return result == 1
+
+
+async def delete_tasks(task_ids: List[str]) -> None:
+    """刪除任務狀態並移出所有索引"""
+    if not task_ids:
+        return
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.delete(*[task_key(task_id) for task_id in task_ids])
+        pipe.zrem(TASK_INDEX_KEY, *task_ids)
+        for state in TASK_STATUSES:
+            pipe.zrem(status_index_key(state), *task_ids)
+        await pipe.execute()
+
+
+async def prune_task_index() -> None:
+    """移除建立時間超過 TTL 的索引項目 (對應的任務 hash 已過期)"""
+    cutoff = time.time() - TASK_TTL_SECONDS
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.zremrangebyscore(TASK_INDEX_KEY, "-inf", cutoff)
+        for state in TASK_STATUSES:
+            pipe.zremrangebyscore(status_index_key(state), "-inf", cutoff)
+        await pipe.execute()
+
+
+async def count_tasks(status: Optional[str] = None) -> int:
+    """任務數量 (O(1))"""
+    return int(await redis_client.zcard(status_index_key(status)))
+
+
+async def list_task_ids(
+    start: int = 0,
+    stop: int = -1,
+    status: Optional[str] = None,
+    newest_first: bool = True,
+) -> List[str]:
+    """依建立時間從索引取出任務 ID (O(log n + k))"""
+    index_key = status_index_key(status)
+    if newest_first:
+        return await redis_client.zrevrange(index_key, start, stop)
+    return await redis_client.zrange(index_key, start, stop)
+
+
+async def load_tasks_by_ids(task_ids: List[str]) -> List[Dict[str, Any]]:
+    """以 pipeline 批次讀取任務狀態，索引中已不存在的任務會順便移除"""
+    if not task_ids:
+        return []
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for task_id in task_ids:
+            pipe.hgetall(task_key(task_id))
+        raw_tasks = await pipe.execute(raise_on_error=False)
+
+    tasks = []
+    missing = []
+    for task_id, raw in zip(task_ids, raw_tasks):
+        if isinstance(raw, ResponseError):
+            task = await get_task_status(task_id)  # 舊版格式，逐筆轉換
+        else:
+            task = decode_fields(raw) if raw else None
+        if task:
+            tasks.append(task)
+        else:
+            missing.append(task_id)
+    if missing:
+        await delete_tasks(missing)
+    return tasks
@@ -0,0 +1,287 @@
+"""
+影片 / GIF 換臉模組
+
+影格以區段串流處理，記憶體只保留一個區段 (CHUNK_SIZE 張影格)，數分鐘的影片在 CPU 上也能處理：
+- 來源臉部 (含 embedding) 整段影片只偵測一次
+- 每 KEYFRAME_INTERVAL 張影格 (或追蹤失敗時) 才執行臉部偵測，
+  中間的影格以光流 (Lucas-Kanade) 追蹤上一張的 5 個關鍵點推算 bbox / kps，不重新偵測
+- 同一區段的換臉在一次叢集 GPU 鎖內連續執行，結果邊處理邊寫入輸出的 mp4
+
+輸出一律為 mp4 (GIF 輸入也輸出 mp4)；OpenCV 不處理音軌，輸出不含聲音。
+"""
+import logging
+import os
+import uuid
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Callable, ContextManager, Iterator, List, Optional, Union
+
+import cv2
+import numpy as np
+from insightface.app.common import Face
+
+from .config import VIDEO_CONFIG, RESULTS_DIR
+from .metrics import time_stage, collect_timings
+from .face_processor import FaceProcessor, _resolution
+
+logger = logging.getLogger(__name__)
+
+# Lucas-Kanade 光流參數
+_LK_PARAMS = dict(
+    winSize=(21, 21),
+    maxLevel=3,
+    criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03),
+)
+_MAX_SCALE_CHANGE = 1.5  # 相鄰影格的臉部縮放超過此倍率視為追蹤失敗
+
+
+def _bbox_iou(a: np.ndarray, b: np.ndarray) -> float:
+    """兩個 bbox (x1, y1, x2, y2) 的重疊率"""
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(x2 - x1, 0) * max(y2 - y1, 0)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return float(inter / union) if union > 0 else 0.0
+
+
+def _track_face(prev_gray: np.ndarray, gray: np.ndarray, face: Face) -> Optional[Face]:
+    """以光流將臉部關鍵點追蹤到下一張影格，追蹤失敗返回 None"""
+    points = face.kps.astype(np.float32).reshape(-1, 1, 2)
+    moved, status, _ = cv2.calcOpticalFlowPyrLK(prev_gray, gray, points, None, **_LK_PARAMS)
+    if moved is None:
+        return None
+    tracked = status.reshape(-1).astype(bool)
+    if tracked.sum() < VIDEO_CONFIG["MIN_TRACKED_POINTS"]:
+        return None
+
+    old = points.reshape(-1, 2)
+    new = moved.reshape(-1, 2)
+    # 追蹤失敗的點沿用整體位移
+    shift = np.median(new[tracked] - old[tracked], axis=0)
+    kps = np.where(tracked[:, None], new, old + shift)
+
+    # bbox 依關鍵點的平移與縮放推算
+    old_center, new_center = old.mean(axis=0), kps.mean(axis=0)
+    old_spread = np.linalg.norm(old - old_center, axis=1).mean()
+    scale = np.linalg.norm(kps - new_center, axis=1).mean() / old_spread if old_spread > 0 else 1.0
+    if not 1 / _MAX_SCALE_CHANGE < scale < _MAX_SCALE_CHANGE:
+        return None
+    height, width = gray.shape[:2]
+    if not (0 <= new_center[0] < width and 0 <= new_center[1] < height):
+        return None
+
+    bbox = face.bbox.astype(np.float32).reshape(2, 2)
+    bbox = (bbox - old_center) * scale + new_center
+    return Face(bbox=bbox.reshape(-1), kps=kps.astype(np.float32), det_score=face.det_score)
+
+
+class FaceTracker:
+    """
+    追蹤影片中的目標臉部
+
+    關鍵影格執行偵測 (只用偵測模型，不計算 embedding 等屬性)，
+    之後以上一張的偵測/追蹤結果為準，在新的偵測結果中挑選重疊最多的臉，使整段影片換的是同一張臉。
+    """
+
+    def __init__(self, processor: FaceProcessor, target_face_index: int):
+        self.processor = processor
+        self.target_face_index = target_face_index
+        self.interval = max(VIDEO_CONFIG["KEYFRAME_INTERVAL"], 1)
+        self.face: Optional[Face] = None
+        self.prev_gray: Optional[np.ndarray] = None
+        self.since_keyframe = self.interval  # 第一張影格即為關鍵影格
+        self.keyframes = 0
+        self.tracked_frames = 0
+
+    def locate(self, frame: np.ndarray) -> Optional[Face]:
+        """返回此影格中的目標臉部 (沒有臉時為 None)"""
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        tracked = None
+        if self.face is not None and self.prev_gray is not None:
+            with time_stage("track"):
+                tracked = _track_face(self.prev_gray, gray, self.face)
+
+        self.since_keyframe += 1
+        # 追蹤失敗時立即重新偵測；原本就沒有臉時依關鍵影格間隔重試
+        if self.since_keyframe >= self.interval or (self.face is not None and tracked is None):
+            self.face = self._detect(frame, tracked or self.face)
+            self.since_keyframe = 0
+            self.keyframes += 1
+        else:
+            self.face = tracked
+            if tracked is not None:
+                self.tracked_frames += 1
+
+        self.prev_gray = gray
+        return self.face
+
+    def _detect(self, frame: np.ndarray, previous: Optional[Face]) -> Optional[Face]:
+        """關鍵影格：偵測臉部並挑出目標臉"""
+        with time_stage("detect_keyframe"):
+            bboxes, kpss = self.processor.face_app.det_model.detect(frame, max_num=0, metric="default")
+        if kpss is None or len(bboxes) == 0:
+            return None
+        faces = sorted(
+            (Face(bbox=bbox[:4], kps=kps, det_score=bbox[4]) for bbox, kps in zip(bboxes, kpss)),
+            key=lambda face: face.bbox[0]
+        )
+        if previous is not None:
+            overlaps = [_bbox_iou(face.bbox, previous.bbox) for face in faces]
+            best = int(np.argmax(overlaps))
+            if overlaps[best] >= VIDEO_CONFIG["REDETECT_IOU"]:
+                return faces[best]
+        # 尚未鎖定目標 (或目標已離開畫面) 時，依由左到右的索引挑選 (與圖片換臉相同)
+        if self.target_face_index < len(faces):
+            return faces[self.target_face_index]
+        return None
+
+
+def _read_chunks(capture: cv2.VideoCapture, chunk_size: int, max_frames: int) -> Iterator[List[np.ndarray]]:
+    """逐段讀取影格"""
+    read = 0
+    while True:
+        chunk = []
+        with time_stage("video_decode"):
+            while len(chunk) < chunk_size:
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                chunk.append(frame)
+        if not chunk:
+            return
+        read += len(chunk)
+        if read > max_frames:
+            raise ValueError(f"影片長度超過上限 {VIDEO_CONFIG['MAX_DURATION']} 秒")
+        yield chunk
+
+
+def swap_video(
+    processor: FaceProcessor,
+    source_image: np.ndarray,
+    video_path: Union[str, Path],
+    source_face_index: int = 0,
+    target_face_index: int = 0,
+    timings: Optional[dict] = None,
+    swap_guard: Optional[Callable[[], ContextManager]] = None,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> dict:
+    """
+    將影片 / GIF 中的目標臉部換成來源臉部，結果輸出為 mp4
+
+    Args:
+        processor: 臉部處理器 (需載入換臉模型)
+        source_image: 來源圖片 (提供臉部)
+        video_path: 影片或 GIF 路徑
+        source_face_index: 來源臉部索引
+        target_face_index: 第一次偵測到臉部時，要替換的臉部索引 (由左到右)
+        timings: 各階段耗時 (秒) 會累加到此 dict
+        swap_guard: 每個區段換臉時進入的 context manager (例如叢集 GPU 鎖)
+        progress: 每個區段完成後呼叫 progress(已處理影格數, 總影格數；未知為 0)
+
+    Returns:
+        dict: 結果路徑、影格數、關鍵影格數等統計
+    """
+    with collect_timings(timings):
+        return _swap_video(
+            processor, source_image, Path(video_path), source_face_index, target_face_index,
+            swap_guard or nullcontext, progress,
+        )
+
+
+def _swap_video(
+    processor: FaceProcessor,
+    source_image: np.ndarray,
+    video_path: Path,
+    source_face_index: int,
+    target_face_index: int,
+    swap_guard: Callable[[], ContextManager],
+    progress: Optional[Callable[[int, int], None]],
+) -> dict:
+    """swap_video 的實作"""
+    # 來源臉部只偵測一次，整段影片共用同一個 embedding
+    with time_stage("detect_source"):
+        source_faces = processor.detect_source_faces(source_image)
+    if len(source_faces) == 0:
+        raise ValueError("在來源圖片中沒有偵測到臉部，請上傳清晰的正面照片")
+    if source_face_index >= len(source_faces):
+        raise ValueError(f"來源圖片只有 {len(source_faces)} 張臉，但指定了第 {source_face_index + 1} 張臉")
+    source_face = source_faces[source_face_index]
+
+    capture = cv2.VideoCapture(str(video_path))
+    if not capture.isOpened():
+        raise ValueError("無法開啟影片檔案，請確認格式是否正確")
+
+    result_path = RESULTS_DIR / f"result_{uuid.uuid4().hex}.mp4"
+    # 寫入中的檔案不使用 result_ 前綴，完成後才改名，避免被下載到不完整的影片
+    partial_path = RESULTS_DIR / f"partial_{result_path.name}"
+    writer = None
+    try:
+        fps = capture.get(cv2.CAP_PROP_FPS)
+        if not 0 < fps <= 120:
+            fps = VIDEO_CONFIG["DEFAULT_FPS"]
+        total_frames = max(int(capture.get(cv2.CAP_PROP_FRAME_COUNT)), 0)
+        max_frames = int(VIDEO_CONFIG["MAX_DURATION"] * fps)
+        if total_frames > max_frames:
+            raise ValueError(f"影片長度超過上限 {VIDEO_CONFIG['MAX_DURATION']} 秒")
+
+        tracker = FaceTracker(processor, target_face_index)
+        processed = swapped = 0
+        resolution = None
+        for chunk in _read_chunks(capture, max(VIDEO_CONFIG["CHUNK_SIZE"], 1), max_frames):
+            if writer is None:
+                resolution = _resolution(chunk[0])
+                height, width = chunk[0].shape[:2]
+                RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+                writer = cv2.VideoWriter(
+                    str(partial_path), cv2.VideoWriter_fourcc(*VIDEO_CONFIG["OUTPUT_CODEC"]), fps, (width, height)
+                )
+                if not writer.isOpened():
+                    raise RuntimeError("影片編碼器初始化失敗")
+
+            targets = [tracker.locate(frame) for frame in chunk]
+            if any(face is not None for face in targets):
+                with swap_guard():
+                    for index, face in enumerate(targets):
+                        if face is not None:
+                            chunk[index] = processor._run_swapper(chunk[index], face, source_face)
+                            swapped += 1
+
+            with time_stage("video_encode"):
+                for frame in chunk:
+                    writer.write(frame)
+            processed += len(chunk)
+            if progress:
+                progress(processed, total_frames)
+
+        if writer is None:
+            raise ValueError("影片中沒有任何影格")
+        if swapped == 0:
+            raise ValueError("在影片中沒有偵測到臉部")
+
+        writer.release()
+        writer = None
+        with time_stage("fsync"):
+            with open(partial_path, "rb+") as f:
+                os.fsync(f.fileno())
+            partial_path.replace(result_path)
+    finally:
+        capture.release()
+        if writer is not None:
+            writer.release()
+        partial_path.unlink(missing_ok=True)
+
+    logger.info(
+        f"影片換臉完成：{result_path} ({processed} 影格，關鍵影格 {tracker.keyframes}，"
+        f"追蹤 {tracker.tracked_frames}，換臉 {swapped})"
+    )
+    return {
+        "result_path": str(result_path),
+        "frames": processed,
+        "swapped_frames": swapped,
+        "keyframes": tracker.keyframes,
+        "tracked_frames": tracker.tracked_frames,
+        "fps": round(fps, 2),
+        "duration": round(processed / fps, 2),
+        "video_resolution": resolution,
+        "source_resolution": _resolution(source_image),
+    }
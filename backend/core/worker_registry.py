@@ -0,0 +1,332 @@
+"""
+Worker 註冊與心跳
+
+每個 worker 啟動時產生唯一 ID 並登記到 workers 集合，之後定期寫入帶 TTL 的心跳 hash
+(worker:{id})。心跳 key 過期即代表 worker 已離線 (當機、被強制停止或網路中斷)。
+心跳內容包含運算裝置、ONNX provider、目前任務、累計完成數與滾動吞吐量估計，
+API 以所有存活 worker 的彙總作為容量，用於准入控制、ETA 估算與佇列狀態。
+
+worker 以 LMOVE / BLMOVE 將工作從佇列原子地移到自己的 inflight 清單 (worker:{id}:inflight)，
+優先通道 (同步請求) 先於一般佇列，一般佇列在預看範圍內依模板親和性重排 (有等待上限)；處理結束後才移除，worker 中途消失時，工作仍留在 inflight 清單中，由回收流程重新排隊。
+"""
+import asyncio
+import os
+import socket
+import time
+import uuid
+import logging
+from typing import Optional, Dict, Any, List, Tuple
+
+from core.config import QUEUE_CONFIG
+from core.redis_client import (
+    redis_client,
+    TASK_QUEUE_KEY,
+    TASK_PRIORITY_QUEUE_KEY,
+    WORKERS_KEY,
+    WORKER_KEY_PREFIX,
+    TEMPLATE_OWNERS_KEY,
+)
+from core.task_store import encode_fields, decode_fields
+from core.metrics import record_claim
+
+logger = logging.getLogger(__name__)
+
+
+def generate_worker_id() -> str:
+    """產生 worker ID (主機名稱 + PID + 隨機字串，重啟後不會重複)"""
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+def worker_key(worker_id: str) -> str:
+    """worker 心跳 key"""
+    return f"{WORKER_KEY_PREFIX}{worker_id}"
+
+
+def inflight_key(worker_id: str) -> str:
+    """worker 處理中工作清單 key"""
+    return f"{WORKER_KEY_PREFIX}{worker_id}:inflight"
+
+
+async def send_heartbeat(worker_id: str, fields: Dict[str, Any]) -> None:
+    """寫入心跳欄位並刷新租約"""
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.sadd(WORKERS_KEY, worker_id)
+        pipe.hset(worker_key(worker_id), mapping=encode_fields({**fields, "last_seen": time.time()}))
+        pipe.expire(worker_key(worker_id), QUEUE_CONFIG["WORKER_LEASE_SECONDS"])
+        await pipe.execute()
+
+
+async def deregister_worker(worker_id: str) -> None:
+    """worker 正常結束：移除心跳 (inflight 清單若非空，交由回收流程處理)"""
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.delete(worker_key(worker_id))
+        pipe.llen(inflight_key(worker_id))
+        _, inflight = await pipe.execute()
+    if not inflight:
+        await redis_client.srem(WORKERS_KEY, worker_id)
+
+
+async def get_worker_liveness() -> Tuple[List[str], List[str]]:
+    """
+    區分存活與離線的 worker
+
+    Returns:
+        Tuple[存活 worker ID 列表, 離線 worker ID 列表]
+    """
+    worker_ids = sorted(await redis_client.smembers(WORKERS_KEY))
+    if not worker_ids:
+        return [], []
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for worker_id in worker_ids:
+            pipe.exists(worker_key(worker_id))
+        alive_flags = await pipe.execute()
+    alive = [worker_id for worker_id, flag in zip(worker_ids, alive_flags) if flag]
+    dead = [worker_id for worker_id, flag in zip(worker_ids, alive_flags) if not flag]
+    return alive, dead
+
+
+async def get_worker_info(worker_id: str) -> Optional[Dict[str, Any]]:
+    """讀取 worker 心跳內容"""
+    raw = await redis_client.hgetall(worker_key(worker_id))
+    return decode_fields(raw) if raw else None
+
+
+async def get_live_workers() -> List[Dict[str, Any]]:
+    """讀取所有存活 worker 的心跳內容 (單次 pipeline)"""
+    worker_ids = sorted(await redis_client.smembers(WORKERS_KEY))
+    if not worker_ids:
+        return []
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for worker_id in worker_ids:
+            pipe.hgetall(worker_key(worker_id))
+        raw_workers = await pipe.execute()
+    return [
+        {"worker_id": worker_id, **decode_fields(raw)}
+        for worker_id, raw in zip(worker_ids, raw_workers)
+        if raw
+    ]
+
+
+def summarize_capacity(workers: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    彙總 worker 容量 (吞吐量為各 worker 滾動估計值的總和，單位：任務/秒)
+
+    驗證 worker (role=validator) 不處理換臉任務，只計入 validators。
+    """
+    validators = sum(1 for worker in workers if worker.get("role") == "validator")
+    workers = [worker for worker in workers if worker.get("role") != "validator"]
+    devices: Dict[str, int] = {}
+    for worker in workers:
+        device = worker.get("device") or "unknown"
+        devices[device] = devices.get(device, 0) + 1
+    throughputs = [worker["throughput"] for worker in workers if worker.get("throughput")]
+    durations = [worker["avg_job_seconds"] for worker in workers if worker.get("avg_job_seconds")]
+    busy = sum(1 for worker in workers if worker.get("current_task"))
+    return {
+        "live_workers": len(workers),
+        "busy_workers": busy,
+        "idle_workers": len(workers) - busy,
+        "devices": devices,
+        "throughput": round(sum(throughputs), 4) if throughputs else None,
+        "avg_job_seconds": round(sum(durations) / len(durations), 3) if durations else None,
+        "validators": validators,
+    }
+
+
+# 容量彙總的行程內快取 (避免每個請求都讀取所有 worker)
+_capacity_cache: Tuple[float, Optional[Dict[str, Any]]] = (0.0, None)
+
+
+async def get_worker_capacity() -> Dict[str, Any]:
+    """獲取 worker 容量彙總 (快取數秒)"""
+    global _capacity_cache
+    cached_at, capacity = _capacity_cache
+    if capacity is None or time.monotonic() - cached_at > QUEUE_CONFIG["CAPACITY_CACHE_SECONDS"]:
+        capacity = summarize_capacity(await get_live_workers())
+        _capacity_cache = (time.monotonic(), capacity)
+    return capacity
+
+
+# 取出下一個工作並移入 inflight 清單：優先通道取最前面；一般佇列在前 N 個工作內依模板親和性挑選
+# - 佇列最前面的工作等待超過重排上限時直接取出 (不會因重排而餓死)
+# - 否則取第一個「模板由本 worker 持有」的工作，其次是第一個模板沒有被其他 worker 持有的工作，
+#   都沒有時取最前面的工作
+# - 取出後登記本 worker 為該模板的持有者 (template_owners: template_id -> "worker_id|時間")，
+#   其他 worker 在親和性有效期間內會避開，讓每個 worker 的常用模板集合 (快取) 保持精簡
+# KEYS: 優先佇列, 一般佇列, inflight 清單, 模板持有者 hash
+# ARGV: worker_id, 目前時間, 預看數量, 重排上限 (秒), 親和性有效期 (秒)
+# 返回: {payload, 取出原因 (priority / affinity / unowned / head / aged)} 或 false
+_CLAIM_SCRIPT = """
+local payload = redis.call("lmove", KEYS[1], KEYS[3], "LEFT", "RIGHT")
+if payload then
+    return {payload, "priority"}
+end
+
+local items = redis.call("lrange", KEYS[2], 0, tonumber(ARGV[3]) - 1)
+if #items == 0 then
+    return false
+end
+
+local worker_id = ARGV[1]
+local now = tonumber(ARGV[2])
+local owner_ttl = tonumber(ARGV[5])
+
+local function decode(raw)
+    local ok, job = pcall(cjson.decode, raw)
+    if ok and type(job) == "table" then
+        return job
+    end
+    return nil
+end
+
+local function template_of(job)
+    if job and type(job["template_id"]) == "string" and job["template_id"] ~= "custom" then
+        return job["template_id"]
+    end
+    return nil
+end
+
+local function owner_of(template_id)
+    local value = redis.call("hget", KEYS[4], template_id)
+    if not value then
+        return nil
+    end
+    local sep = string.find(value, "|", 1, true)
+    if not sep or now - tonumber(string.sub(value, sep + 1)) > owner_ttl then
+        return nil
+    end
+    return string.sub(value, 1, sep - 1)
+end
+
+local chosen, reason = 1, "head"
+local head = decode(items[1])
+if head and tonumber(head["enqueued_at"]) and now - tonumber(head["enqueued_at"]) >= tonumber(ARGV[4]) then
+    reason = "aged"
+else
+    local unowned = nil
+    for index, raw in ipairs(items) do
+        local template_id = template_of(decode(raw))
+        local owner = template_id and owner_of(template_id)
+        if owner == worker_id then
+            chosen, reason = index, "affinity"
+            unowned = nil
+            break
+        end
+        if not unowned and not owner then
+            unowned = index
+        end
+    end
+    if unowned then
+        chosen, reason = unowned, "unowned"
+    end
+end
+
+payload = items[chosen]
+redis.call("lrem", KEYS[2], 1, payload)
+redis.call("rpush", KEYS[3], payload)
+local template_id = template_of(decode(payload))
+if template_id then
+    redis.call("hset", KEYS[4], template_id, worker_id .. "|" .. ARGV[2])
+end
+return {payload, reason}
+"""
+
+_claim_script = redis_client.register_script(_CLAIM_SCRIPT)
+
+# 所有通道都是空的時，阻塞等待優先通道的秒數 (一般佇列最多因此延後這麼久才被取出)
+CLAIM_BLOCK_SECONDS = 1
+
+
+async def claim_job(worker_id: str, timeout: int = 5) -> Optional[str]:
+    """
+    等待下一個工作並移入 inflight 清單，逾時返回 None
+
+    先以 Lua script 非阻塞取出 (優先通道 → 一般佇列依模板親和性挑選)；都是空的時 BLMOVE 只能阻塞等待單一 list，
+    因此短暫阻塞等待優先通道後再重試，讓同步請求在閒置時也能立即被取出。
+    """
+    inflight = inflight_key(worker_id)
+    deadline = time.monotonic() + timeout
+    while True:
+        claimed = await _claim_script(
+            keys=[TASK_PRIORITY_QUEUE_KEY, TASK_QUEUE_KEY, inflight, TEMPLATE_OWNERS_KEY],
+            args=[
+                worker_id,
+                time.time(),
+                QUEUE_CONFIG["AFFINITY_WINDOW"],
+                QUEUE_CONFIG["MAX_REORDER_DELAY"],
+                QUEUE_CONFIG["AFFINITY_TTL"],
+            ],
+        )
+        if claimed:
+            payload, reason = claimed
+            record_claim(reason)
+            return payload
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        payload = await redis_client.blmove(
+            TASK_PRIORITY_QUEUE_KEY,
+            inflight,
+            min(CLAIM_BLOCK_SECONDS, max(remaining, 0.1)),
+            "LEFT",
+            "RIGHT",
+        )
+        if payload:
+            record_claim("priority")
+            return payload
+
+
+async def ack_job(worker_id: str, payload: str) -> None:
+    """工作處理結束，從 inflight 清單移除"""
+    await redis_client.lrem(inflight_key(worker_id), 1, payload)
+
+
+class WorkerHeartbeat:
+    """背景定期送出心跳，欄位可隨時更新 (下一次心跳帶出)"""
+
+    def __init__(self, worker_id: str, fields: Optional[Dict[str, Any]] = None):
+        self.worker_id = worker_id
+        self.fields: Dict[str, Any] = dict(fields or {})
+        self._task: Optional[asyncio.Task] = None
+
+    def update(self, **fields: Any) -> None:
+        self.fields.update(fields)
+
+    def record_job(self, duration: float, succeeded: bool) -> None:
+        """記錄一個任務的處理時間，更新完成數與滾動吞吐量 (EWMA)"""
+        counter = "jobs_done" if succeeded else "jobs_failed"
+        self.fields[counter] = self.fields.get(counter, 0) + 1
+        alpha = QUEUE_CONFIG["THROUGHPUT_EWMA_ALPHA"]
+        previous = self.fields.get("avg_job_seconds")
+        average = duration if previous is None else alpha * duration + (1 - alpha) * previous
+        self.fields["avg_job_seconds"] = round(average, 3)
+        self.fields["throughput"] = round(1.0 / average, 4) if average > 0 else None
+
+    async def beat(self) -> None:
+        """立即送出一次心跳"""
+        await send_heartbeat(self.worker_id, self.fields)
+
+    async def _run(self) -> None:
+        interval = QUEUE_CONFIG["WORKER_HEARTBEAT_INTERVAL"]
+        while True:
+            try:
+                await self.beat()
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:  # noqa: BLE001
+                logger.warning(f"送出 worker 心跳失敗：{exc}")
+            await asyncio.sleep(interval)
+
+    async def start(self) -> None:
+        await self.beat()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):  # noqa: BLE001
+                pass
+            self._task = None
+        await deregister_worker(self.worker_id)
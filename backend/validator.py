@@ -0,0 +1,95 @@
+"""
+驗證 Worker：只載入臉部偵測模型，平行處理 /api/validate-image 的圖片驗證與提交換臉前的照片預檢
+
+每次上傳預覽都會呼叫驗證，與換臉任務分開處理可避免被長任務拖慢，也不必為每個行程載入換臉模型。
+"""
+import asyncio
+import logging
+import logging.config
+import os
+import signal
+import socket
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict
+
+from core.config import ensure_directories, LOGGING_CONFIG, QUEUE_CONFIG
+from core.metrics import start_metrics_server
+from core.redis_client import VALIDATE_QUEUE_KEY
+from core.rpc import serve_rpc
+from core.worker_registry import WorkerHeartbeat, generate_worker_id
+
+# 設置 logging 使用 UTC+8 時區
+logging.Formatter.converter = lambda *args: time.localtime(time.time() + 28800 - time.timezone)
+
+logging.config.dictConfig(LOGGING_CONFIG)
+logger = logging.getLogger("validator")
+
+
+WORKER_ID = generate_worker_id()
+
+
+def rpc_validate_image(file_path: str) -> Dict[str, Any]:
+    """RPC：偵測圖片中的臉部 (只使用偵測模型)"""
+    from core.face_processor import get_face_detector
+    return get_face_detector().validate_image(Path(file_path).read_bytes())
+
+
+def rpc_prescreen_image(file_path: str, source_face_index: int = 0) -> Dict[str, Any]:
+    """RPC：提交換臉前的照片預檢 (低解析度偵測 + 品質檢查)"""
+    from core.face_processor import get_face_detector
+    return get_face_detector().prescreen_image(Path(file_path).read_bytes(), source_face_index)
+
+
+async def validator_loop() -> None:
+    """驗證 Worker 主循環"""
+    ensure_directories()
+    start_metrics_server(int(os.getenv("WORKER_METRICS_PORT", "9102")))
+
+    logger.info("🔥 驗證 Worker 啟動，正在載入偵測模型...")
+    from core.face_processor import get_face_detector
+    detector = get_face_detector()
+    logger.info(f"✅ 偵測模型載入完成！GPU 狀態: {'啟用' if detector.gpu_available else '未啟用'}")
+
+    # 模型就緒後才註冊，API 才會把驗證請求送到 validate_queue
+    heartbeat = WorkerHeartbeat(WORKER_ID, {
+        "role": "validator",
+        "hostname": socket.gethostname(),
+        "pid": os.getpid(),
+        "started_at": datetime.now().isoformat(),
+        "device": "gpu" if detector.gpu_available else "cpu",
+        "provider": getattr(detector, "provider", None),
+    })
+    await heartbeat.start()
+
+    logger.info(f"📡 驗證 Worker {WORKER_ID} 就緒，等待驗證請求...")
+    try:
+        await serve_rpc(
+            {"validate_image": rpc_validate_image, "prescreen_image": rpc_prescreen_image},
+            concurrency=QUEUE_CONFIG["VALIDATE_CONCURRENCY"],
+            queue_key=VALIDATE_QUEUE_KEY,
+            batch_size=QUEUE_CONFIG["VALIDATE_BATCH_SIZE"],
+        )
+    finally:
+        await heartbeat.stop()
+
+
+def main() -> None:
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, loop.stop)
+        except NotImplementedError:
+            # Windows 無法註冊 signal handler
+            pass
+    try:
+        loop.run_until_complete(validator_loop())
+    finally:
+        loop.close()
+        logger.info("驗證 Worker 已關閉")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,17 +5,26 @@ import asyncio
 import json
 import logging
 import logging.config
+import os
 import signal
+import socket
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple
 from datetime import datetime
 
-from core.redis_client import redis_client, TASK_QUEUE_KEY
-from core.config import ensure_directories, LOGGING_CONFIG, PENDING_UPLOADS_DIR
-from api.face_swap import (
-    process_face_swap_task,
-    update_task_status,
-    decr_queue_size,
+from core.config import ensure_directories, LOGGING_CONFIG, PENDING_UPLOADS_DIR, MONITORING_CONFIG
+from api.face_swap import process_face_swap_task
+from api.video import process_video_task
+from api.fanout import process_fanout_task
+from core.task_queue import finish_task
+from core.metrics import QUEUE_WAIT_SECONDS, time_stage, start_metrics_server, record_task_result, format_timings
+from core.rpc import serve_rpc
+from core.profiler import SlowJobProfiler, get_profiler, register_profiler_signal, run_profiler_listener
+from core.worker_registry import (
+    WorkerHeartbeat,
+    generate_worker_id,
+    claim_job,
+    ack_job,
 )
 
 
@@ -28,23 +37,30 @@ logging.config.dictConfig(LOGGING_CONFIG)
 logger = logging.getLogger("gpu_worker")
 
 
-async def fetch_job(timeout: int = 5) -> Optional[Dict[str, Any]]:
-    """阻塞等待下一個任務，若逾時返回 None"""
-    result = await redis_client.blpop(TASK_QUEUE_KEY, timeout)
-    if not result:
+WORKER_ID = generate_worker_id()
+
+
+async def fetch_job(timeout: int = 5) -> Optional[Tuple[str, Optional[Dict[str, Any]]]]:
+    """
+    阻塞等待下一個任務並移入本 worker 的 inflight 清單，若逾時返回 None
+
+    Returns:
+        Tuple[原始 payload (確認時使用), 解析後的任務 (格式錯誤時為 None)]
+    """
+    payload = await claim_job(WORKER_ID, timeout)
+    if payload is None:
         return None
-    _, payload = result
     try:
-        return json.loads(payload)
+        return payload, json.loads(payload)
     except json.JSONDecodeError as exc:
         logger.error(f"解析佇列任務失敗：{exc}，payload={payload!r}")
-        return None
+        return payload, None
 
 
 async def clean_pending_files(job: Dict[str, Any]) -> None:
     """清理暫存的上傳檔案"""
-    for key in ("file_path", "template_path"):
-        value = job.get(key)
+    paths = [job.get(key) for key in ("file_path", "template_path", "video_path")]
+    for value in paths + list(job.get("extra_source_paths") or []):
         if not value:
             continue
         try:
@@ -55,47 +71,108 @@ async def clean_pending_files(job: Dict[str, Any]) -> None:
             logger.warning(f"刪除暫存檔失敗 ({value}): {exc}")
 
 
-async def process_job(job: Dict[str, Any]) -> None:
-    """執行單一佇列任務"""
+async def process_job(job: Dict[str, Any]) -> bool:
+    """
+    執行單一佇列任務
+
+    Returns:
+        bool: 任務是否成功完成
+    """
     task_id = job["task_id"]
     file_path = Path(job["file_path"])
     template_path = job.get("template_path")
 
     logger.info(f"[GPU Worker] 開始處理任務 {task_id}")
+    enqueued_at = job.get("enqueued_at")
+    # 各階段耗時，隨最終狀態寫入任務
+    timings: Dict[str, float] = {}
+    if enqueued_at:
+        timings["queue_wait"] = max(time.time() - enqueued_at, 0.0)
+        QUEUE_WAIT_SECONDS.observe(timings["queue_wait"])
 
     try:
-        file_content = file_path.read_bytes()
+        with time_stage("read_file", timings):
+            file_content = file_path.read_bytes()
     except Exception as exc:  # noqa: BLE001
         logger.error(f"讀取來源檔案失敗 ({file_path}): {exc}")
-        await update_task_status(task_id, {
+        await finish_task(task_id, {
             "status": "failed",
             "progress": 0,
             "message": "來源檔案不存在或讀取失敗",
             "error": str(exc),
             "failed_at": datetime.now().isoformat(),
+            "timings": format_timings(timings),
         })
-        await decr_queue_size()
+        record_task_result("failed", reason="read_file")
         await clean_pending_files(job)
-        return
+        return False
 
     template_content: Optional[bytes] = None
     if template_path:
         try:
-            template_content = Path(template_path).read_bytes()
+            with time_stage("read_file", timings):
+                template_content = Path(template_path).read_bytes()
         except Exception as exc:  # noqa: BLE001
             logger.error(f"讀取自訂模板失敗 ({template_path}): {exc}")
-            await update_task_status(task_id, {
+            await finish_task(task_id, {
                 "status": "failed",
                 "progress": 0,
                 "message": "自訂模板檔案讀取失敗",
                 "error": str(exc),
                 "failed_at": datetime.now().isoformat(),
+                "timings": format_timings(timings),
             })
-            await decr_queue_size()
+            record_task_result("failed", reason="read_file")
             await clean_pending_files(job)
-            return
+            return False
+
+    if job.get("kind") == "video":
+        succeeded = await process_video_task(
+            task_id=task_id,
+            file_content=file_content,
+            video_path=job["video_path"],
+            source_face_index=job.get("source_face_index", 0),
+            target_face_index=job.get("target_face_index", 0),
+            worker_id=WORKER_ID,
+            enqueued_at=enqueued_at,
+            timings=timings,
+        )
+        await clean_pending_files(job)
+        logger.info(f"[GPU Worker] 影片任務 {task_id} 處理完成")
+        return succeeded
 
-    await process_face_swap_task(
+    extra_source_contents = []
+    for extra_path in job.get("extra_source_paths") or []:
+        try:
+            with time_stage("read_file", timings):
+                extra_source_contents.append(Path(extra_path).read_bytes())
+        except Exception as exc:  # noqa: BLE001
+            # 其他來源照片只用於融合特徵，讀取失敗時以其餘照片處理
+            logger.warning(f"讀取其他來源照片失敗 ({extra_path}): {exc}")
+
+    # 有照片讀取失敗時融合結果與摘要不符，不寫入特徵快取
+    source_digest = job.get("source_digest") if len(extra_source_contents) == len(job.get("extra_source_paths") or []) else None
+
+    if job.get("kind") == "fanout":
+        succeeded = await process_fanout_task(
+            task_id=task_id,
+            file_content=file_content,
+            template_ids=job["template_ids"],
+            source_face_index=job.get("source_face_index", 0),
+            target_face_index=job.get("target_face_index", 0),
+            worker_id=WORKER_ID,
+            enqueued_at=enqueued_at,
+            timings=timings,
+            extra_source_contents=extra_source_contents,
+            source_digest=source_digest,
+            identity_id=job.get("identity_id"),
+            source_hints=job.get("source_hints"),
+        )
+        await clean_pending_files(job)
+        logger.info(f"[GPU Worker] 全模板任務 {task_id} 處理完成")
+        return succeeded
+
+    succeeded = await process_face_swap_task(
         task_id=task_id,
         file_content=file_content,
         template_id=job["template_id"],
@@ -103,35 +180,150 @@ async def process_job(job: Dict[str, Any]) -> None:
         source_face_index=job.get("source_face_index", 0),
         target_face_index=job.get("target_face_index", 0),
         initial_queue_size=job.get("initial_queue_position"),
+        worker_id=WORKER_ID,
+        enqueued_at=enqueued_at,
+        timings=timings,
+        extra_source_contents=extra_source_contents,
+        source_digest=source_digest,
+        identity_id=job.get("identity_id"),
+        source_hints=job.get("source_hints"),
     )
 
     await clean_pending_files(job)
     logger.info(f"[GPU Worker] 任務 {task_id} 處理完成")
+    return succeeded
+
+
+def update_device_info(heartbeat: WorkerHeartbeat, processor=None) -> None:
+    """將目前使用的運算裝置寫入心跳 (GPU 失敗時處理器可能已切換為 CPU)"""
+    if processor is None:
+        from core import face_processor
+        processor = face_processor._processor_instance
+        if processor is None:
+            return
+    gpu_available = getattr(processor, "gpu_available", False)
+    heartbeat.update(
+        device="gpu" if gpu_available else "cpu",
+        provider=getattr(processor, "provider", None),
+    )
+
+
+def rpc_validate_image(file_path: str) -> Dict[str, Any]:
+    """RPC：偵測圖片中的臉部 (供 /api/validate-image 使用)"""
+    from core.face_processor import get_face_processor
+    return get_face_processor().validate_image(Path(file_path).read_bytes())
+
+
+def rpc_prescreen_image(file_path: str, source_face_index: int = 0) -> Dict[str, Any]:
+    """RPC：提交換臉前的照片預檢 (沒有驗證 worker 時由一般 worker 處理)"""
+    from core.face_processor import get_face_processor
+    return get_face_processor().prescreen_image(Path(file_path).read_bytes(), source_face_index)
+
+
+def rpc_system_info() -> Dict[str, Any]:
+    """RPC：回報此 worker 的系統資訊與運算裝置 (供 /api/system/info 使用)"""
+    from core.face_processor import get_face_processor, get_system_info
+    processor = get_face_processor()
+    return {
+        "system_info": get_system_info(),
+        "processor_gpu_enabled": bool(getattr(processor, "gpu_available", False)),
+        "worker_id": WORKER_ID,
+    }
+
+
+def rpc_create_identity(identity_id: str, file_paths: List[str]) -> Dict[str, Any]:
+    """RPC：正規化身分照片並計算所有臉部的特徵 (供 /api/identities 使用)"""
+    from core.face_processor import get_face_processor
+    return get_face_processor().create_identity(identity_id, [Path(path).read_bytes() for path in file_paths])
+
+
+RPC_HANDLERS = {
+    "validate_image": rpc_validate_image,
+    "prescreen_image": rpc_prescreen_image,
+    "create_identity": rpc_create_identity,
+    "system_info": rpc_system_info,
+}
 
 
 async def worker_loop() -> None:
     """Worker 主循環"""
     ensure_directories()
 
+    # 獨立行程沒有 API，另外啟動 /metrics HTTP 服務
+    start_metrics_server(int(os.getenv("WORKER_METRICS_PORT", "9101")))
+
+    heartbeat = WorkerHeartbeat(WORKER_ID, {
+        "role": "worker",
+        "hostname": socket.gethostname(),
+        "pid": os.getpid(),
+        "started_at": datetime.now().isoformat(),
+        "device": "unknown",
+        "provider": None,
+        "current_task": None,
+        "current_task_started_at": None,
+        "jobs_done": 0,
+        "jobs_failed": 0,
+        "avg_job_seconds": None,
+        "throughput": None,
+    })
+    await heartbeat.start()
+
+    # 取樣分析：管理端點經 Pub/Sub 開關；另外自動保留最慢任務的取樣結果
+    profiler_task = asyncio.create_task(run_profiler_listener("worker", WORKER_ID))
+    slow_jobs = SlowJobProfiler() if MONITORING_CONFIG["PROFILE_SLOW_JOBS"] else None
+
+    # API 行程不載入模型，需要模型的輕量請求經 RPC 通道交給 worker (與換臉任務並行處理)
+    rpc_task = asyncio.create_task(serve_rpc(RPC_HANDLERS))
+
     # 預熱 GPU 模型
     logger.info("🔥 GPU Worker 啟動，正在預熱 AI 模型...")
     try:
         from core.face_processor import get_face_processor
         processor = get_face_processor()
+        update_device_info(heartbeat, processor)
         logger.info(f"✅ AI 模型預熱完成！GPU 狀態: {'啟用' if processor.gpu_available else '未啟用'}")
     except Exception as exc:
         logger.error(f"⚠️  模型預熱失敗: {exc}")
         logger.info("   首次任務處理時將進行模型初始化")
 
-    logger.info("📡 GPU Worker 就緒，等待任務...")
-    while True:
-        job = await fetch_job()
-        if not job:
-            continue
-        try:
-            await process_job(job)
-        except Exception as exc:  # noqa: BLE001
-            logger.exception(f"處理任務失敗：{exc}")
+    logger.info(f"📡 GPU Worker {WORKER_ID} 就緒，等待任務...")
+    try:
+        while True:
+            claimed = await fetch_job()
+            if not claimed:
+                continue
+            payload, job = claimed
+            started = time.monotonic()
+            succeeded = False
+            try:
+                if job:
+                    heartbeat.update(
+                        current_task=job.get("task_id"),
+                        current_task_started_at=datetime.now().isoformat(),
+                    )
+                    await heartbeat.beat()
+                    if slow_jobs:
+                        slow_jobs.begin()
+                    succeeded = await process_job(job)
+            except Exception as exc:  # noqa: BLE001
+                logger.exception(f"處理任務失敗：{exc}")
+            finally:
+                if job:
+                    duration = time.monotonic() - started
+                    heartbeat.record_job(duration, succeeded)
+                    update_device_info(heartbeat)
+                    if slow_jobs:
+                        slow_jobs.end(job.get("task_id", "unknown"), duration)
+                    get_profiler().job_finished()
+                heartbeat.update(current_task=None, current_task_started_at=None)
+                # 處理結束才確認；worker 中途消失時工作留在 inflight 清單由回收流程重新排隊
+                await ack_job(WORKER_ID, payload)
+                await heartbeat.beat()
+    finally:
+        profiler_task.cancel()
+        rpc_task.cancel()
+        get_profiler().stop()
+        await heartbeat.stop()
 
 
 def setup_signals(loop: asyncio.AbstractEventLoop) -> None:
@@ -148,6 +340,7 @@ def main() -> None:
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
     setup_signals(loop)
+    register_profiler_signal(loop)
     try:
         loop.run_until_complete(worker_loop())
     finally:
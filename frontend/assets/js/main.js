@@ -331,8 +331,8 @@ async function handleProcessImage() {
             description: `任務已提交 (ID: ${taskId.substring(0, 8)}...)，正在處理...`
         });
         
-        // 開始輪詢任務狀態
-        const result = await pollTaskStatus(taskId, statusId);
+        // 等待任務完成（優先使用伺服器推播）
+        const result = await waitForTaskResult(taskId, statusId);
         
         // 更新狀態為完成
         updateStatusItem(statusId, {
@@ -443,6 +443,73 @@ async function submitFaceSwapTask(file, templateId, retryCount = 0) {
     }
 }
 
+// 等待任務結果：優先使用 SSE 推播，不支援或連線失敗時改用輪詢
+async function waitForTaskResult(taskId, statusId) {
+    if (!window.EventSource) {
+        return pollTaskStatus(taskId, statusId);
+    }
+    
+    try {
+        return await streamTaskStatus(taskId, statusId);
+    } catch (error) {
+        if (error.name !== 'StreamUnavailableError') {
+            throw error;
+        }
+        console.warn('任務推播不可用，改用輪詢:', error.message);
+        return pollTaskStatus(taskId, statusId);
+    }
+}
+
+// 透過 Server-Sent Events 接收任務狀態
+function streamTaskStatus(taskId, statusId) {
+    return new Promise((resolve, reject) => {
+        const url = Utils.getApiUrl(`${API_CONFIG.ENDPOINTS.FACE_SWAP_EVENTS}/${taskId}`);
+        const source = new EventSource(url);
+        let receivedStatus = false;
+        
+        const timeoutId = setTimeout(() => {
+            source.close();
+            reject(new Error('任務處理超時，請稍後查看結果或重新提交'));
+        }, API_CONFIG.REQUEST.MAX_POLL_TIME);
+        
+        const finish = () => {
+            clearTimeout(timeoutId);
+            source.close();
+        };
+        
+        source.addEventListener('status', (event) => {
+            receivedStatus = true;
+            const taskStatus = JSON.parse(event.data);
+            updateTaskProgress(taskStatus, statusId);
+            
+            if (taskStatus.status === 'completed') {
+                finish();
+                resolve(taskStatus);
+            } else if (taskStatus.status === 'failed') {
+                finish();
+                reject(new Error(taskStatus.error || '任務處理失敗'));
+            }
+        });
+        
+        source.addEventListener('position', (event) => {
+            const position = JSON.parse(event.data);
+            updateStatusItem(statusId, {
+                description: `排隊中，前方還有 ${position.queue_ahead} 個任務`
+            });
+        });
+        
+        source.onerror = () => {
+            // 尚未收到任何狀態就失敗，視為推播不可用；否則交由 EventSource 自動重連
+            if (!receivedStatus) {
+                finish();
+                const error = new Error('無法建立任務推播連線');
+                error.name = 'StreamUnavailableError';
+                reject(error);
+            }
+        };
+    });
+}
+
 // 輪詢任務狀態
 async function pollTaskStatus(taskId, statusId) {
     const startTime = Date.now();
@@ -8,6 +8,7 @@ const API_CONFIG = {
         TEMPLATES: '/templates',
         FACE_SWAP: '/face-swap',
         FACE_SWAP_STATUS: '/face-swap/status',
+        FACE_SWAP_EVENTS: '/face-swap/events',
         FACE_SWAP_TASKS: '/face-swap/tasks',
         RESULTS: '/results',
         HEALTH: '/health'